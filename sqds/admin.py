@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Unit, Skill, Gear, Guild, Category
+from .models import Unit, Skill, Gear, Guild, Category, RefreshJob
 
 
 # noinspection PyMethodMayBeStatic,PyUnusedLocal
@@ -43,3 +43,9 @@ class CategoryAdmin(ReadOnlyMixin, admin.ModelAdmin):
 @admin.register(Guild)
 class GuildAdmin(ReadOnlyMixin, admin.ModelAdmin):
     pass
+
+
+@admin.register(RefreshJob)
+class RefreshJobAdmin(ReadOnlyMixin, admin.ModelAdmin):
+    list_display = ('__str__', 'status', 'created', 'finished')
+    list_filter = ('kind', 'status')
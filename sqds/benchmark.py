@@ -0,0 +1,256 @@
+"""
+Ingest benchmark: replay the recorded swgoh.help fixtures of `sqds/tests/data` through
+the guild import and roster synchronisation code, and measure wall time, number of
+queries, rows written and peak Python memory of each scenario.
+
+Players are cloned from the recorded fixtures with ally codes and IDs of their own, so
+that any number of them can be ingested and existing data is never touched. Units, skills
+and gear they reference are created if missing. Everything is run in a transaction which
+is rolled back at the end.
+
+The benchmark runs against the configured database: run it with each database
+configuration to compare (e.g. SQLite and PostgreSQL). Rows inserted with COPY (see
+`RosterWriter`) are not counted in rows written. Tracing memory allocations slows
+ingestion down significantly: wall times are only comparable between runs with the same
+memory tracing setting.
+"""
+import copy
+import json
+import os
+import time
+import tracemalloc
+from collections import namedtuple
+from typing import Callable, List
+from unittest import mock
+
+from django.db import connection, transaction
+from django.test import override_settings
+
+from . import swgoh
+from .models import Gear, GameDataRegistry, Guild, Player, Skill, Unit, bulk_sync
+from .utils import QueryLogger
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'tests', 'data')
+
+BENCHMARK_GUILD_ID = 'G-benchmark'
+FIRST_ALLY_CODE = 900000001
+
+BenchmarkResult = namedtuple('BenchmarkResult', [
+    'scenario', 'vendor', 'players', 'wall_time', 'queries', 'rows_written',
+    'peak_memory'])
+
+# Metrics compared between runs, see `compare()`
+METRICS = ['wall_time', 'queries', 'rows_written', 'peak_memory']
+
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE')
+
+
+def recorded_player_data() -> List[dict]:
+    """
+    :return: list of the recorded player data fixtures
+    """
+    path = os.path.join(DATA_DIR, 'player_data')
+    all_player_data = []
+    for file_name in sorted(os.listdir(path)):
+        if file_name.endswith('.json'):
+            with open(os.path.join(path, file_name)) as fp:
+                all_player_data.append(json.load(fp))
+    return all_player_data
+
+
+def benchmark_player_data(count: int) -> List[dict]:
+    """
+    Clone the recorded players into `count` players with unique ally codes and IDs.
+    :param count: number of players
+    :return: list of player data
+    """
+    recorded = recorded_player_data()
+    all_player_data = []
+    for i in range(count):
+        player_data = copy.deepcopy(recorded[i % len(recorded)])
+        player_data['allyCode'] = FIRST_ALLY_CODE + i
+        player_data['id'] = f'benchmark{i}'
+        player_data['guildRefId'] = BENCHMARK_GUILD_ID
+        for unit_data in player_data['roster']:
+            unit_data['id'] = f'{unit_data["id"]}-{i}'
+            for mod_data in unit_data['mods']:
+                mod_data['id'] = f'{mod_data["id"]}-{i}'
+        all_player_data.append(player_data)
+    return all_player_data
+
+
+def change_rosters(all_player_data: List[dict]) -> List[dict]:
+    """
+    Simulate a day of progress: every fifth unit gains GP and speed, and every tenth
+    unit loses a mod.
+    :param all_player_data: list of player data
+    :return: list of changed player data
+    """
+    all_player_data = copy.deepcopy(all_player_data)
+    for player_data in all_player_data:
+        for i, unit_data in enumerate(player_data['roster']):
+            if i % 5 == 0 and 'stats' in unit_data:
+                unit_data['gp'] = (unit_data['gp'] or 0) + 100
+                unit_data['stats']['final']['Speed'] += 1
+            if i % 10 == 0 and unit_data['mods']:
+                unit_data['mods'].pop()
+    return all_player_data
+
+
+def benchmark_guild_data(all_player_data: List[dict]) -> dict:
+    return {
+        'id': BENCHMARK_GUILD_ID,
+        'name': 'Benchmark',
+        'gp': sum(player_data['stats'][0]['value'] for player_data in all_player_data),
+        'roster': [{'allyCode': player_data['allyCode'], 'name': player_data['name']}
+                   for player_data in all_player_data],
+    }
+
+
+def ensure_game_data(all_player_data: List[dict]):
+    """
+    Create the units, zeta skills and gear pieces referenced by player data, if missing.
+    """
+    units = {}
+    skills = {}
+    gear = {}
+    for player_data in all_player_data:
+        for unit_data in player_data['roster']:
+            if unit_data['combatType'] != 1:
+                continue
+            units[unit_data['defId']] = {'name': unit_data['nameKey']}
+            for skill_data in unit_data['skills']:
+                if skill_data['isZeta']:
+                    skills[skill_data['id']] = {'name': skill_data['nameKey'],
+                                                'unit': unit_data['defId'],
+                                                'is_zeta': True}
+            for gear_data in unit_data['equipped']:
+                gear[gear_data['equipmentId']] = {
+                    'name': gear_data['nameKey'], 'tier': 1, 'required_rarity': 1,
+                    'required_level': 1, 'is_left_hand_g12': False,
+                    'is_right_hand_g12': False}
+
+    def missing(model, rows):
+        existing = set(model.objects.filter(api_id__in=rows)
+                       .values_list('api_id', flat=True))
+        return {api_id: values for api_id, values in rows.items()
+                if api_id not in existing}
+
+    bulk_sync(Unit, missing(Unit, units))
+    unit_ids = dict(Unit.objects.filter(api_id__in=units).values_list('api_id', 'pk'))
+    bulk_sync(Skill, {api_id: {'name': values['name'], 'is_zeta': values['is_zeta'],
+                               'unit_id': unit_ids[values['unit']]}
+                      for api_id, values in missing(Skill, skills).items()})
+    bulk_sync(Gear, missing(Gear, gear))
+
+
+def measure(scenario: str, players: int, func: Callable[[], object],
+            trace_memory=True) -> BenchmarkResult:
+    """
+    Run a scenario and measure it.
+    :param scenario: name of the scenario
+    :param players: number of players ingested by the scenario
+    :param func: function running the scenario
+    :param trace_memory: (optional) if False, peak memory is not measured (reported as 0)
+    :return: the measurements
+    """
+    query_logger = QueryLogger()
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        with connection.execute_wrapper(query_logger):
+            func()
+        wall_time = time.perf_counter() - start
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    rows_written = sum(max(query.get('rows', 0), 0) for query in query_logger.queries
+                       if query['sql'].lstrip().upper().startswith(WRITE_STATEMENTS))
+    return BenchmarkResult(scenario, connection.vendor, players, wall_time,
+                           len(query_logger.queries), rows_written, peak_memory)
+
+
+def run(player_count=50, batch_size=swgoh.Swgoh.INITIAL_BATCH_SIZE, use_copy=False,
+        trace_memory=True) -> List[BenchmarkResult]:
+    """
+    Run all scenarios:
+    - guild_import: import a guild and all its players
+    - guild_reimport: import it again, unchanged
+    - update_player_units: synchronise changed rosters
+    - update_player_units_unchanged: synchronise the same rosters again
+    :param player_count: (optional) number of players
+    :param batch_size: (optional) number of players per downloaded batch
+    :param use_copy: (optional) insert rosters with COPY on PostgreSQL
+    :param trace_memory: (optional) measure peak memory
+    :return: list of measurements
+    """
+    all_player_data = benchmark_player_data(player_count)
+    player_data_by_ally_code = {p['allyCode']: p for p in all_player_data}
+    guild_data = benchmark_guild_data(all_player_data)
+
+    def iter_player_data_batch(ally_codes, **_):
+        ally_codes = list(ally_codes)
+        for i in range(0, len(ally_codes), batch_size):
+            yield [player_data_by_ally_code[ally_code]
+                   for ally_code in ally_codes[i:i + batch_size]]
+
+    def import_guild():
+        Guild.objects.update_or_create_from_swgoh(FIRST_ALLY_CODE, use_copy=use_copy)
+
+    changed_player_data = change_rosters(all_player_data)
+
+    def update_player_units():
+        players = {player.ally_code: player for player in Player.objects.filter(
+            ally_code__in=[p['allyCode'] for p in changed_player_data])}
+        for player_data in changed_player_data:
+            Player.objects.update_player_units(players[player_data['allyCode']],
+                                               player_data['roster'])
+
+    results = []
+    try:
+        with override_settings(SQDS_ARCHIVE_DIR=None), \
+                mock.patch.object(swgoh.api, 'get_guild_list', return_value=guild_data), \
+                mock.patch.object(swgoh.api, 'iter_player_data_batch',
+                                  side_effect=iter_player_data_batch), \
+                transaction.atomic():
+            ensure_game_data(all_player_data)
+            for scenario, func in [('guild_import', import_guild),
+                                   ('guild_reimport', import_guild),
+                                   ('update_player_units', update_player_units),
+                                   ('update_player_units_unchanged', update_player_units)]:
+                results.append(measure(scenario, player_count, func, trace_memory))
+            transaction.set_rollback(True)
+    finally:
+        # The registry may hold game data which was rolled back
+        GameDataRegistry.clear()
+    return results
+
+
+def compare(results: List[BenchmarkResult], baseline: List[BenchmarkResult],
+            threshold=.2) -> List[str]:
+    """
+    Compare measurements with a baseline from a previous run. Only scenarios run on the
+    same database vendor with the same number of players are compared, and peak memory
+    only if it was measured in both runs.
+    :param results: measurements
+    :param baseline: baseline measurements
+    :param threshold: (optional) relative increase above which a metric regressed
+    :return: list of regression descriptions
+    """
+    baseline = {(r.scenario, r.vendor, r.players): r for r in baseline}
+    regressions = []
+    for result in results:
+        reference = baseline.get((result.scenario, result.vendor, result.players))
+        if reference is None:
+            continue
+        for metric in METRICS:
+            value = getattr(result, metric)
+            reference_value = getattr(reference, metric)
+            if metric == 'peak_memory' and not (value and reference_value):
+                continue
+            if value > reference_value * (1 + threshold):
+                regressions.append(f'{result.scenario}: {metric} increased from '
+                                   f'{reference_value:g} to {value:g}')
+    return regressions
@@ -0,0 +1,10 @@
+from django_extensions.management.jobs import HourlyJob
+
+from ... import scheduler
+
+
+class Job(HourlyJob):
+    help = "Refresh the most outdated and most viewed guilds and players"
+
+    def execute(self):
+        scheduler.run()
@@ -1,27 +1,33 @@
 from django.utils import timezone
 from django_extensions.management.jobs import BaseJob
 
-from ..models import Player, Guild
+from ..models import Player
+from ..scheduler import refresh_guilds
 
 
-def update_guild(ally_code):
-    should_execute = False
+def needs_update(ally_code):
     try:
         player = Player.objects.get(ally_code=ally_code)
         guild = player.guild;
         since_last_update = timezone.now() - guild.last_updated
-        if since_last_update.total_seconds() >= 4 * 3600:
-            should_execute = True
+        return since_last_update.total_seconds() >= 4 * 3600
     except Player.DoesNotExist:
-        should_execute = True
+        return True
 
-    if should_execute:
-        Guild.objects.update_or_create_from_swgoh(ally_code=ally_code)
+
+def update_guilds(ally_codes):
+    """
+    Download the guilds that need it concurrently, and import each of them as soon as
+    it is downloaded.
+    :param ally_codes: one ally code per guild
+    """
+    ally_codes = [ally_code for ally_code in ally_codes if needs_update(ally_code)]
+    if ally_codes:
+        refresh_guilds(ally_codes)
 
 
 class Job(BaseJob):
     help = "Update PREPARE and PREPAIRED data from swgoh.help"
 
     def execute(self):
-        update_guild(116235559)
-        update_guild(343174317)
+        update_guilds([116235559, 343174317])
@@ -0,0 +1,54 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from sqds import benchmark
+from sqds.swgoh import Swgoh
+
+
+class Command(BaseCommand):
+    help = "Benchmark guild and roster ingestion against the configured database, " \
+           "with players cloned from the recorded swgoh.help fixtures"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players', type=int, default=50,
+                            help="Number of players ingested")
+        parser.add_argument('--batch-size', type=int, default=Swgoh.INITIAL_BATCH_SIZE,
+                            help="Number of players per downloaded batch")
+        parser.add_argument('--use-copy', action='store_true',
+                            help="Insert rosters with COPY (PostgreSQL only)")
+        parser.add_argument('--no-memory', action='store_true',
+                            help="Do not measure peak memory, which slows ingestion "
+                                 "down")
+        parser.add_argument('--output', metavar='PATH',
+                            help="Save the results as JSON, to be used as a baseline")
+        parser.add_argument('--baseline', metavar='PATH',
+                            help="Fail if results regressed compared to a previous run")
+        parser.add_argument('--threshold', type=float, default=.2,
+                            help="Relative increase of a metric considered a regression")
+
+    def handle(self, *args, **options):
+        results = benchmark.run(options['players'], options['batch_size'],
+                                options['use_copy'], not options['no_memory'])
+
+        self.stdout.write(f"{'scenario':<32}{'players':>8}{'time (s)':>10}"
+                          f"{'ms/player':>11}{'queries':>9}{'rows':>9}"
+                          f"{'KiB/player':>12}")
+        for result in results:
+            self.stdout.write(
+                f"{result.scenario:<32}{result.players:>8}{result.wall_time:>10.2f}"
+                f"{result.wall_time / result.players * 1000:>11.1f}{result.queries:>9}"
+                f"{result.rows_written:>9}"
+                f"{result.peak_memory / result.players / 1024:>12.1f}")
+
+        if options['output']:
+            with open(options['output'], 'w') as fp:
+                json.dump([result._asdict() for result in results], fp, indent=2)
+
+        if options['baseline']:
+            with open(options['baseline']) as fp:
+                baseline = [benchmark.BenchmarkResult(**result) for result in json.load(fp)]
+            regressions = benchmark.compare(results, baseline, options['threshold'])
+            if regressions:
+                raise CommandError("Regressions detected:\n" + "\n".join(regressions))
+            self.stdout.write(self.style.SUCCESS("No regression"))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from sqds.models import Guild, Player, PlayerStats, GuildStats, ModStatHistogram, \
+    PlayerCategoryGP
+
+
+class Command(BaseCommand):
+    help = "Rebuild the player mod histograms, category GP and the player and guild " \
+           "stats rollups from raw player data"
+
+    def add_arguments(self, parser):
+        parser.add_argument('guild_api_ids', nargs='*', metavar='guild_api_id',
+                            help="Only rebuild the stats of these guilds and their "
+                                 "players (default: everything)")
+        parser.add_argument('--chunk-size', type=int, default=50,
+                            help="Number of players updated per transaction")
+
+    def handle(self, *args, **options):
+        players = Player.objects.all()
+        guilds = Guild.objects.all()
+        if options['guild_api_ids']:
+            players = players.filter(guild__api_id__in=options['guild_api_ids'])
+            guilds = guilds.filter(api_id__in=options['guild_api_ids'])
+
+        player_ids = list(players.order_by('pk').values_list('pk', flat=True))
+        chunk_size = options['chunk_size']
+        for i in range(0, len(player_ids), chunk_size):
+            with transaction.atomic():
+                ModStatHistogram.objects.rebuild_for_players(player_ids[i:i + chunk_size])
+                PlayerCategoryGP.objects.update_for_players(player_ids[i:i + chunk_size])
+                PlayerStats.objects.update_for_players(player_ids[i:i + chunk_size])
+            self.stdout.write(f"Updated {min(i + chunk_size, len(player_ids))}/"
+                              f"{len(player_ids)} players")
+
+        guild_ids = list(guilds.values_list('pk', flat=True))
+        with transaction.atomic():
+            GuildStats.objects.update_for_guilds(guild_ids)
+        self.stdout.write(self.style.SUCCESS(f"Updated {len(guild_ids)} guilds"))
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from sqds.models import RefreshJob, RefreshJobKind, RefreshJobStatus
+
+
+class Command(BaseCommand):
+    help = "Run queued player and guild refreshes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help="Exit once no job is pending instead of waiting for "
+                                 "new ones")
+        parser.add_argument('--poll-interval', type=float, default=2.,
+                            help="Seconds between checks for new jobs")
+        parser.add_argument('--stale-after', type=int, default=3600,
+                            help="Seconds after which running jobs are considered "
+                                 "abandoned and queued again")
+
+    def handle(self, *args, **options):
+        while True:
+            RefreshJob.objects.requeue_stale(options['stale_after'])
+            job = RefreshJob.objects.claim()
+            if job is None:
+                if options['once']:
+                    return
+                time.sleep(options['poll_interval'])
+                continue
+
+            job.run()
+            message = (f"{RefreshJobKind.label(job.kind)} {job.ally_code}: "
+                       f"{RefreshJobStatus.label(job.status)}")
+            if job.status == RefreshJobStatus.FAILED:
+                self.stderr.write(self.style.ERROR(f"{message} ({job.error})"))
+            else:
+                self.stdout.write(self.style.SUCCESS(message))
@@ -0,0 +1,85 @@
+import collections
+from concurrent import futures
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from sqds.models import ArchivedPayload, ArchivedPayloadKind, Guild, Player, \
+    RosterWriter, update_stats
+from sqds_medals.models import Medal
+
+
+def load_payloads(payloads):
+    return [payload.load() for payload in payloads]
+
+
+def iter_loaded_batches(batches, workers):
+    """
+    Load batches of payloads in worker threads, keeping at most `workers` batches
+    loaded ahead of the consumer.
+    """
+    with futures.ThreadPoolExecutor(workers) as executor:
+        pending = collections.deque()
+        for batch in batches:
+            pending.append(executor.submit(load_payloads, batch))
+            if len(pending) > workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class Command(BaseCommand):
+    help = "Ingest the latest archived payload of each guild and player again, " \
+           "without downloading anything"
+
+    def add_arguments(self, parser):
+        parser.add_argument('ally_codes', nargs='*', type=int, metavar='ally_code',
+                            help="Only reingest these players (default: every archived "
+                                 "guild and player)")
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help="Number of players written per transaction")
+        parser.add_argument('--workers', type=int, default=4,
+                            help="Number of threads decompressing and parsing payloads")
+
+    def handle(self, *args, **options):
+        if ArchivedPayload.objects.archive_dir() is None:
+            raise CommandError("Archiving is disabled (SQDS_ARCHIVE_DIR is None)")
+
+        # Guilds first, so that players can be attached to them
+        ally_codes = options['ally_codes']
+        if not ally_codes:
+            for payload in ArchivedPayload.objects.latest(ArchivedPayloadKind.GUILD):
+                Guild.objects.update_or_create_from_data(payload.load())
+
+        player_payloads = ArchivedPayload.objects.latest(ArchivedPayloadKind.PLAYER)
+        if ally_codes:
+            player_payloads = player_payloads.filter(key__in=map(str, ally_codes))
+        player_payloads = list(player_payloads.order_by('key'))
+        batch_size = options['batch_size']
+        batches = [player_payloads[i:i + batch_size]
+                   for i in range(0, len(player_payloads), batch_size)]
+        guilds = {guild.api_id: guild for guild in Guild.objects.all()}
+
+        # Rosters are written even if they did not change since they were downloaded
+        archived_ally_codes = [int(payload.key) for payload in player_payloads]
+        Player.objects.filter(ally_code__in=archived_ally_codes).update(
+            api_updated=None, roster_hash='')
+
+        # Payloads are loaded by worker threads while batches are written
+        player_ids = []
+        for all_player_data in iter_loaded_batches(batches, options['workers']):
+            with transaction.atomic():
+                roster_writer = RosterWriter()
+                for player_data in all_player_data:
+                    player = Player.objects.update_or_create_from_data(
+                        player_data, guilds.get(player_data['guildRefId']),
+                        roster_writer)
+                    player_ids.append(player.pk)
+                roster_writer.write()
+            self.stdout.write(f"Reingested {len(player_ids)}/{len(player_payloads)} "
+                              f"players")
+
+        with transaction.atomic():
+            Medal.objects.update_all(archived_ally_codes)
+            update_stats(player_ids, [guild.pk for guild in guilds.values()])
+        self.stdout.write(self.style.SUCCESS(f"Reingested {len(player_ids)} players"))
@@ -0,0 +1,83 @@
+# Generated by Django 2.2.28 on 2026-10-17 21:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sqds', '0014_auto_20190819_1858'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlayerStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('unit_count', models.IntegerField(default=0)),
+                ('seven_star_unit_count', models.IntegerField(default=0)),
+                ('g13_unit_count', models.IntegerField(default=0)),
+                ('g12_unit_count', models.IntegerField(default=0)),
+                ('g11_unit_count', models.IntegerField(default=0)),
+                ('g10_unit_count', models.IntegerField(default=0)),
+                ('zeta_count', models.IntegerField(default=0)),
+                ('g12_gear_count', models.IntegerField(default=0)),
+                ('right_hand_g12_gear_count_g12_only', models.IntegerField(default=0)),
+                ('left_hand_g12_gear_count_g12_only', models.IntegerField(default=0)),
+                ('right_hand_g12_gear_count', models.IntegerField(default=0)),
+                ('left_hand_g12_gear_count', models.IntegerField(default=0)),
+                ('mod_count', models.IntegerField(default=0)),
+                ('mod_count_6dot', models.IntegerField(default=0)),
+                ('mod_count_speed_25', models.IntegerField(default=0)),
+                ('mod_count_speed_20', models.IntegerField(default=0)),
+                ('mod_count_speed_15', models.IntegerField(default=0)),
+                ('mod_count_speed_10', models.IntegerField(default=0)),
+                ('mod_total_speed_15plus', models.IntegerField(default=0)),
+                ('medal_count', models.IntegerField(default=0)),
+                ('sep_gp', models.IntegerField(default=0)),
+                ('gr_gp', models.IntegerField(default=0)),
+                ('last_updated', models.DateTimeField(auto_now=True)),
+                ('player', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stats', to='sqds.Player')),
+            ],
+            options={
+                'verbose_name_plural': 'Player stats',
+            },
+        ),
+        migrations.CreateModel(
+            name='GuildStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('unit_count', models.IntegerField(default=0)),
+                ('seven_star_unit_count', models.IntegerField(default=0)),
+                ('g13_unit_count', models.IntegerField(default=0)),
+                ('g12_unit_count', models.IntegerField(default=0)),
+                ('g11_unit_count', models.IntegerField(default=0)),
+                ('g10_unit_count', models.IntegerField(default=0)),
+                ('zeta_count', models.IntegerField(default=0)),
+                ('g12_gear_count', models.IntegerField(default=0)),
+                ('right_hand_g12_gear_count_g12_only', models.IntegerField(default=0)),
+                ('left_hand_g12_gear_count_g12_only', models.IntegerField(default=0)),
+                ('right_hand_g12_gear_count', models.IntegerField(default=0)),
+                ('left_hand_g12_gear_count', models.IntegerField(default=0)),
+                ('mod_count', models.IntegerField(default=0)),
+                ('mod_count_6dot', models.IntegerField(default=0)),
+                ('mod_count_speed_25', models.IntegerField(default=0)),
+                ('mod_count_speed_20', models.IntegerField(default=0)),
+                ('mod_count_speed_15', models.IntegerField(default=0)),
+                ('mod_count_speed_10', models.IntegerField(default=0)),
+                ('mod_total_speed_15plus', models.IntegerField(default=0)),
+                ('medal_count', models.IntegerField(default=0)),
+                ('sep_gp', models.IntegerField(default=0)),
+                ('gr_gp', models.IntegerField(default=0)),
+                ('last_updated', models.DateTimeField(auto_now=True)),
+                ('player_count', models.IntegerField(default=0)),
+                ('gp_char', models.IntegerField(default=0)),
+                ('gp_ship', models.IntegerField(default=0)),
+                ('guild', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stats', to='sqds.Guild')),
+            ],
+            options={
+                'verbose_name_plural': 'Guild stats',
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-17 21:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sqds', '0015_guildstats_playerstats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='player',
+            name='api_updated',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='player',
+            name='roster_hash',
+            field=models.CharField(blank=True, default='', max_length=40),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 2.2.28 on 2026-10-17 21:55
+
+from django.db import migrations, models
+import django_enumfield.db.fields
+import sqds.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sqds', '0016_player_change_detection'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RefreshJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', django_enumfield.db.fields.EnumField(default=1, enum=sqds.models.RefreshJobKind)),
+                ('ally_code', models.IntegerField()),
+                ('status', django_enumfield.db.fields.EnumField(default=1, enum=sqds.models.RefreshJobStatus)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(null=True)),
+                ('finished', models.DateTimeField(null=True)),
+            ],
+            options={
+                'index_together': {('status', 'created'), ('kind', 'ally_code')},
+            },
+        ),
+    ]
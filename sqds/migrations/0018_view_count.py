@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-17 21:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sqds', '0017_refreshjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='guild',
+            name='view_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='player',
+            name='view_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
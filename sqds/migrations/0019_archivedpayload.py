@@ -0,0 +1,30 @@
+# Generated by Django 2.2.28 on 2026-10-17 21:59
+
+from django.db import migrations, models
+import django_enumfield.db.fields
+import sqds.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sqds', '0018_view_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedPayload',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', django_enumfield.db.fields.EnumField(default=1, enum=sqds.models.ArchivedPayloadKind)),
+                ('key', models.CharField(max_length=50)),
+                ('digest', models.CharField(max_length=64)),
+                ('size', models.IntegerField()),
+                ('archived', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'unique_together': {('kind', 'key', 'digest')},
+                'index_together': {('kind', 'key', 'archived')},
+            },
+        ),
+    ]
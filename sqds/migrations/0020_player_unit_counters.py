@@ -0,0 +1,46 @@
+# Generated by Django 2.2.28 on 2026-10-17 22:12
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def compute_counters(apps, schema_editor):
+    PlayerUnit = apps.get_model('sqds', 'PlayerUnit')
+    counters = {
+        'mod_speed_no_set': Coalesce(Sum('mod_set__speed'), 0),
+        'zeta_count': Count('zeta_set'),
+    }
+    PlayerUnit.objects.update(**{
+        field: Subquery(PlayerUnit.objects
+                        .filter(pk=OuterRef('pk'))
+                        .annotate(value=aggregate)
+                        .values('value'),
+                        output_field=models.IntegerField())
+        for field, aggregate in counters.items()})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sqds', '0019_archivedpayload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='playerunit',
+            name='medal_count',
+            field=models.IntegerField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='playerunit',
+            name='mod_speed_no_set',
+            field=models.IntegerField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='playerunit',
+            name='zeta_count',
+            field=models.IntegerField(db_index=True, default=0),
+        ),
+        migrations.RunPython(compute_counters, migrations.RunPython.noop),
+    ]
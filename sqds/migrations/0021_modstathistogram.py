@@ -0,0 +1,59 @@
+# Generated by Django 2.2.28 on 2026-10-17 22:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django_enumfield.db.fields
+import sqds.models
+
+# (stat, Mod field, primary stat of non-secondary values, scale), see MOD_HISTOGRAM_STATS
+HISTOGRAM_STATS = [
+    (1, 'speed', 'SP', 1),
+    (2, 'offense', None, 1),
+    (3, 'critical_chance', 'CC', 10000),
+    (4, 'potency', 'PO', 10000),
+]
+
+
+def build_histograms(apps, schema_editor):
+    Mod = apps.get_model('sqds', 'Mod')
+    ModStatHistogram = apps.get_model('sqds', 'ModStatHistogram')
+
+    for stat, field, primary_stat, scale in HISTOGRAM_STATS:
+        counts = {}
+        rows = (Mod.objects
+                .filter(player_unit__isnull=False, **{field + '__gt': 0})
+                .exclude(primary_stat=primary_stat)
+                .order_by()
+                .values_list('player_unit__player', field)
+                .annotate(count=models.Count('id')))
+        for player_id, value, count in rows:
+            key = (player_id, int(round(value * scale)))
+            counts[key] = counts.get(key, 0) + count
+        ModStatHistogram.objects.bulk_create(
+            [ModStatHistogram(player_id=player_id, stat=stat, value=value, count=count)
+             for (player_id, value), count in counts.items()],
+            batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sqds', '0020_player_unit_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ModStatHistogram',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stat', django_enumfield.db.fields.EnumField(default=1, enum=sqds.models.ModStat)),
+                ('value', models.IntegerField()),
+                ('count', models.IntegerField()),
+                ('player', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mod_histogram_set', to='sqds.Player')),
+            ],
+            options={
+                'unique_together': {('player', 'stat', 'value')},
+            },
+        ),
+        migrations.RunPython(build_histograms, migrations.RunPython.noop),
+    ]
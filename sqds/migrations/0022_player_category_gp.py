@@ -0,0 +1,42 @@
+# Generated by Django 2.2.28 on 2026-10-17 22:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_category_gp(apps, schema_editor):
+    PlayerUnit = apps.get_model('sqds', 'PlayerUnit')
+    PlayerCategoryGP = apps.get_model('sqds', 'PlayerCategoryGP')
+
+    rows = (PlayerUnit.objects
+            .filter(player__isnull=False, unit__categories__isnull=False)
+            .order_by()
+            .values_list('player', 'unit__categories')
+            .annotate(gp=models.Sum('gp')))
+    PlayerCategoryGP.objects.bulk_create(
+        [PlayerCategoryGP(player_id=player_id, category_id=category_id, gp=gp)
+         for player_id, category_id, gp in rows],
+        batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sqds', '0021_modstathistogram'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlayerCategoryGP',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gp', models.IntegerField()),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='player_gp_set', to='sqds.Category')),
+                ('player', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='category_gp_set', to='sqds.Player')),
+            ],
+            options={
+                'unique_together': {('player', 'category')},
+            },
+        ),
+        migrations.RunPython(build_category_gp, migrations.RunPython.noop),
+    ]
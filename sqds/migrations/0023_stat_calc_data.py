@@ -0,0 +1,21 @@
+# Generated by Django 2.2.28 on 2026-10-17 22:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sqds', '0022_player_category_gp'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatCalcData',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255, unique=True)),
+                ('data', models.TextField()),
+            ],
+        ),
+    ]
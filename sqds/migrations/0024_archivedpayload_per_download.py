@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-17 22:53
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sqds', '0023_stat_calc_data'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='archivedpayload',
+            unique_together=set(),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 2.2.28 on 2026-10-17 22:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sqds', '0024_archivedpayload_per_download'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SingleFlightLock',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255, unique=True)),
+                ('token', models.CharField(max_length=32)),
+                ('expires', models.DateTimeField()),
+            ],
+        ),
+    ]
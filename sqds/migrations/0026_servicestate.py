@@ -0,0 +1,25 @@
+# Generated by Django 2.2.28 on 2026-10-17 22:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sqds', '0025_singleflightlock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ServiceState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('tokens', models.FloatField(null=True)),
+                ('tokens_updated', models.FloatField(null=True)),
+                ('failures', models.IntegerField(default=0)),
+                ('open_until', models.FloatField(null=True)),
+                ('trial_until', models.FloatField(null=True)),
+            ],
+        ),
+    ]
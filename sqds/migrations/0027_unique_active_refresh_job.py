@@ -0,0 +1,31 @@
+# Generated by Django 2.2.28 on 2026-10-17 23:15
+
+from django.db import migrations, models
+
+
+def fail_duplicate_active_jobs(apps, schema_editor):
+    RefreshJob = apps.get_model('sqds', 'RefreshJob')
+    seen = set()
+    duplicates = []
+    for job in (RefreshJob.objects.filter(status__in=[1, 2])
+                .order_by('created', 'pk')):
+        if (job.kind, job.ally_code) in seen:
+            duplicates.append(job.pk)
+        seen.add((job.kind, job.ally_code))
+    RefreshJob.objects.filter(pk__in=duplicates).update(
+        status=4, error='Duplicate of an active job')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sqds', '0026_servicestate'),
+    ]
+
+    operations = [
+        migrations.RunPython(fail_duplicate_active_jobs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='refreshjob',
+            constraint=models.UniqueConstraint(condition=models.Q(status__in=[1, 2]), fields=('kind', 'ally_code'), name='unique_active_refresh_job'),
+        ),
+    ]
@@ -1,19 +1,77 @@
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import uuid
+from collections import Counter, defaultdict
 from copy import copy
+from datetime import timedelta
 from typing import Union, Collection, List
 
 import pandas
-from django.db import models, transaction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models, transaction, connection, IntegrityError
 from django.db.models import Q, Sum, Count, Subquery, OuterRef, F
 from django.db.models.functions import Coalesce
+from django.db.models.sql.constants import LOUTER
 from django.utils import timezone
 from django.utils.html import format_html
 from django_enumfield import enum
 
-from . import swgoh
+from . import swgoh, stat_calc, page_cache
+from .single_flight import single_flight, single_flight_many
+
+logger = logging.getLogger(__name__)
 
 LEFT_HAND_G12_GEAR_ID = [158, 159, 160, 161, 162, 163, 164, 165]
 RIGHT_HAND_G12_GEAR_ID = [166, 167, 168, 169, 170, 171]
 
+# Factions whose total GP is part of player and guild stats, keyed by statistic name
+FACTION_GP_CATEGORIES = {
+    'sep_gp': 'affiliation_separatist',
+    'gr_gp': 'affiliation_republic',
+}
+
+
+def bulk_sync(model, rows, delete_missing=False):
+    """
+    Synchronise a table with a dictionary of rows keyed by `api_id`, with one query to
+    load existing rows and bulk queries to insert, update and (optionally) delete them.
+    :param model: model with an `api_id` field
+    :param rows: dictionary of field values, keyed by api_id
+    :param delete_missing: (optional) delete the rows which are not in `rows`
+    :return: dictionary of primary keys, keyed by api_id
+    """
+    existing = model.objects.in_bulk(field_name='api_id')
+    fields = {field for values in rows.values() for field in values}
+
+    created = []
+    updated = []
+    for api_id, values in rows.items():
+        obj = existing.get(api_id)
+        if obj is None:
+            created.append(model(api_id=api_id, **values))
+        elif any(getattr(obj, field) != value for field, value in values.items()):
+            for field, value in values.items():
+                setattr(obj, field, value)
+            updated.append(obj)
+
+    model.objects.bulk_create(created, batch_size=500)
+    if updated:
+        model.objects.bulk_update(updated, fields, batch_size=500)
+    if delete_missing:
+        missing = [obj.pk for api_id, obj in existing.items() if api_id not in rows]
+        if missing:
+            model.objects.filter(pk__in=missing).delete()
+
+    # bulk_create() does not set primary keys on all backends
+    if not created:
+        return {api_id: existing[api_id].pk for api_id in rows}
+    return dict(model.objects.filter(api_id__in=rows).values_list('api_id', 'pk'))
+
 
 def update_game_data(ability_data_list=None,
                      skill_data_list=None,
@@ -32,34 +90,53 @@ def update_game_data(ability_data_list=None,
     ability_dict = {item['id']: item for item in ability_data_list}
 
     with transaction.atomic():
-        for category_data in category_data_list:
-            category, _ = Category.objects.update_or_create(
-                api_id=category_data['id'],
-                defaults={'name': category_data['descKey']})
+        category_ids = bulk_sync(Category, {
+            category_data['id']: {'name': category_data['descKey']}
+            for category_data in category_data_list})
 
-        unit_id_list = []
-        for unit_data in unit_data_list:
-            unit, _ = Unit.objects.update_or_create(
-                api_id=unit_data['baseId'],
-                defaults={'name': unit_data['nameKey']}
-            )
-            unit_id_list.append(unit.id)
+        unit_ids = bulk_sync(Unit, {
+            unit_data['baseId']: {'name': unit_data['nameKey']}
+            for unit_data in unit_data_list})
 
+        skill_rows = {}
+        for unit_data in unit_data_list:
             for skill_ref in unit_data['skillReferenceList']:
                 skill_data = skill_dict[skill_ref['skillId']]
-                skill, _ = Skill.objects.update_or_create(
-                    api_id=skill_data['id'],
-                    defaults={
-                        'unit': unit,
-                        'name': ability_dict[
-                            skill_data['abilityReference']]['nameKey'],
-                        'is_zeta': skill_data['isZeta']})
-
-            for category in Category.objects.filter(
-                    api_id__in=unit_data['categoryIdList']).all():
-                unit.categories.add(category)
-
-        Unit.objects.exclude(id__in=unit_id_list).delete()
+                skill_rows[skill_data['id']] = {
+                    'unit_id': unit_ids[unit_data['baseId']],
+                    'name': ability_dict[skill_data['abilityReference']]['nameKey'],
+                    'is_zeta': skill_data['isZeta']}
+        bulk_sync(Skill, skill_rows)
+
+        # Unit categories are rewritten with a single diff of the through table
+        through = Unit.categories.through
+        unit_categories = {(unit_ids[unit_data['baseId']], category_ids[category_id])
+                           for unit_data in unit_data_list
+                           for category_id in unit_data['categoryIdList']
+                           if category_id in category_ids}
+        existing = {(unit_id, category_id): pk for pk, unit_id, category_id
+                    in through.objects.values_list('pk', 'unit_id', 'category_id')}
+        through.objects.filter(pk__in=[pk for key, pk in existing.items()
+                                       if key not in unit_categories]).delete()
+        through.objects.bulk_create(
+            [through(unit_id=unit_id, category_id=category_id)
+             for unit_id, category_id in unit_categories - existing.keys()],
+            batch_size=500)
+
+        # The category GP and stats rollups of the players owning units whose
+        # categories changed, or which are deleted, must be refreshed
+        deleted_units = Unit.objects.exclude(id__in=unit_ids.values())
+        changed_unit_ids = {unit_id for unit_id, _ in unit_categories ^ existing.keys()}
+        changed_unit_ids.update(deleted_units.values_list('id', flat=True))
+        player_ids = set(PlayerUnit.objects
+                         .filter(unit_id__in=changed_unit_ids)
+                         .values_list('player_id', flat=True))
+
+        deleted_units.delete()
+
+        if player_ids:
+            update_stats(player_ids)
+        GameDataRegistry.invalidate()
 
 
 class Category(models.Model):
@@ -101,26 +178,26 @@ class GearManager(models.Manager):
         """Update gear table from server"""
 
         gear_data_list = swgoh.api.get_gear_list()
+        gear_rows = {}
+        for gear_data in gear_data_list:
+            gid = int(gear_data['id']) if str.isdigit(gear_data['id']) \
+                else 0
+            is_left = gid in LEFT_HAND_G12_GEAR_ID
+            is_right = gid in RIGHT_HAND_G12_GEAR_ID or gear_data['id'].startswith(
+                'G12Finisher')
+            gear_rows[gear_data['id']] = {
+                'name': gear_data['nameKey'],
+                'tier': gear_data['tier'],
+                'required_rarity': gear_data['requiredRarity'],
+                'required_level': gear_data['requiredLevel'],
+                'is_left_hand_g12': is_left,
+                'is_right_hand_g12': is_right,
+            }
+
         with transaction.atomic():
-            gear_id_list = []
-            for gear_data in gear_data_list:
-                gid = int(gear_data['id']) if str.isdigit(gear_data['id']) \
-                    else 0
-                is_left = gid in LEFT_HAND_G12_GEAR_ID
-                is_right = gid in RIGHT_HAND_G12_GEAR_ID or gear_data['id'].startswith(
-                    'G12Finisher')
-                gear, _ = Gear.objects.update_or_create(
-                    api_id=gear_data['id'],
-                    defaults={
-                        'name': gear_data['nameKey'],
-                        'tier': gear_data['tier'],
-                        'required_rarity': gear_data['requiredRarity'],
-                        'required_level': gear_data['requiredLevel'],
-                        'is_left_hand_g12': is_left,
-                        'is_right_hand_g12': is_right,
-                    })
-                gear_id_list.append(gear.id)
-            Gear.objects.exclude(id__in=gear_id_list).delete()
+            bulk_sync(Gear, gear_rows, delete_missing=True)
+            GameDataRegistry.invalidate()
+        stat_calc.store_gear_stats(gear_data_list)
 
 
 class Gear(models.Model):
@@ -139,18 +216,198 @@ class Gear(models.Model):
         return self.name
 
 
+class StatCalcData(models.Model):
+    """
+    Data used by the local stat calculator (base stats of unit progressions and gear
+    stats), see `sqds.stat_calc`.
+    """
+    key = models.CharField(max_length=255, unique=True)
+    data = models.TextField()  # JSON
+
+
+class GameDataRegistry:
+    """
+    Process-wide snapshot of the game data (units, skills, gear and categories), keyed
+    by API ID, used to avoid one query per looked up object during ingest.
+
+    The snapshot is loaded in bulk and reloaded when the game data version changes. The
+    version is stored in the cache so that it is shared by all processes, and changes
+    whenever a game data update is committed. Objects missing from the snapshot are
+    looked up in database.
+    """
+    VERSION_CACHE_KEY = 'game_data_version'
+
+    _current = None
+
+    def __init__(self, version):
+        self.version = version
+        self.categories = {c.api_id: c for c in Category.objects.all()}
+        self.units = {u.api_id: u for u in Unit.objects.all()}
+        self.skills = {s.api_id: s for s in Skill.objects.all()}
+        self.gear = {g.api_id: g for g in Gear.objects.all()}
+
+    @classmethod
+    def get(cls) -> 'GameDataRegistry':
+        """
+        Return the registry, reloading it if the game data changed since it was loaded.
+        """
+        version = cache.get(cls.VERSION_CACHE_KEY)
+        if cls._current is None or cls._current.version != version:
+            cls._current = cls(version)
+        return cls._current
+
+    @classmethod
+    def invalidate(cls):
+        """
+        Change the game data version once the current transaction is committed, so that
+        every process reloads its registry and cached pages are rendered again.
+        """
+        transaction.on_commit(lambda: cache.set(cls.VERSION_CACHE_KEY, uuid.uuid4().hex,
+                                                None))
+        page_cache.invalidate([page_cache.GLOBAL])
+
+    @classmethod
+    def clear(cls):
+        """
+        Drop this process' registry, which is reloaded on next access.
+        """
+        cls._current = None
+
+    @staticmethod
+    def _lookup(objects, model, api_id):
+        obj = objects.get(api_id)
+        if obj is None:
+            obj = objects[api_id] = model.objects.get(api_id=api_id)
+        return obj
+
+    def category(self, api_id: str) -> Category:
+        return self._lookup(self.categories, Category, api_id)
+
+    def unit(self, api_id: str) -> Unit:
+        return self._lookup(self.units, Unit, api_id)
+
+    def skill(self, api_id: str) -> Skill:
+        return self._lookup(self.skills, Skill, api_id)
+
+    def gear_piece(self, api_id: str) -> Gear:
+        return self._lookup(self.gear, Gear, api_id)
+
+
 class GuildManager(models.Manager):
 
-    # pylint: disable=too-many-locals
     # noinspection PyMethodMayBeStatic
     def update_or_create_from_swgoh(
-            self, ally_code=116235559, guild_only=False):
+            self, ally_code=116235559, guild_only=False, use_copy=False,
+            only_changed_gp=False):
         """ Create a guild that contains provided ally_code, or update it if
             it already exists. If all_player is True, all players are then
-            fully imported. Otherwise, only ally_code is imported. """
+            fully imported. Otherwise, only ally_code is imported. If use_copy is
+            True, player rosters are inserted with COPY on PostgreSQL (see
+            `RosterWriter`). If only_changed_gp is True, players whose GP did not
+            change since their last import are not downloaded (roster changes which
+            do not affect GP, such as mod swaps, are then missed). """
 
-        # Get guild data from server
-        guild_data = swgoh.api.get_guild_list(ally_code)
+        if guild_only:
+            return self.update_or_create_from_data(swgoh.api.get_guild_list(ally_code))
+
+        # Download the guild, then for all of the guild players, download their info,
+        # roster, mods and skills. Each downloaded batch of players is written while the
+        # next ones are being downloaded.
+        # Concurrent imports of the same guild are coalesced before anything is
+        # downloaded.
+        def update_or_create():
+            guild_data = swgoh.api.get_guild_list(ally_code)
+            ally_codes = [p['allyCode'] for p in guild_data['roster']]
+            if only_changed_gp:
+                ally_codes = Player.objects.changed_gp_ally_codes(guild_data['roster'])
+            return self.update_or_create_from_data(
+                guild_data, swgoh.api.iter_player_data_batch(ally_codes), use_copy)
+
+        return single_flight('guild', self.refresh_key(ally_code), update_or_create)
+
+    def update_or_create_multiple_from_swgoh(
+            self, ally_codes: Collection[int], use_copy=False,
+            only_changed_gp=False) -> List['Guild']:
+        """
+        Import several guilds concurrently, like `update_or_create_from_swgoh()`: the
+        guilds are downloaded concurrently, then the players of all of them (see
+        `swgoh.AsyncSwgoh`), each guild being written as soon as its players are
+        downloaded. Guilds which are already being imported are not downloaded again:
+        the concurrent import is waited for and its result shared (see
+        `sqds.single_flight`).
+        :param ally_codes: one ally code per guild
+        :param use_copy: see `update_or_create_from_swgoh()`
+        :param only_changed_gp: see `update_or_create_from_swgoh()`
+        :return: list of Guild objects, for the guilds which exist
+        """
+        keys = {self.refresh_key(ally_code): ally_code for ally_code in ally_codes}
+        guilds = single_flight_many(
+            'guild', keys,
+            lambda owned_keys: self._update_or_create_multiple(
+                {key: keys[key] for key in owned_keys}, use_copy, only_changed_gp))
+        return [guilds[key] for key in keys if key in guilds]
+
+    def _update_or_create_multiple(self, ally_codes_by_key, use_copy, only_changed_gp):
+        client = swgoh.AsyncSwgoh()
+        try:
+            # Guilds reached through several ally codes are only downloaded once
+            keys_by_guild_id = defaultdict(list)
+            guilds = []
+            for key, guild_data in zip(
+                    ally_codes_by_key,
+                    client.get_guild_lists(list(ally_codes_by_key.values()))):
+                if guild_data is None:
+                    continue
+                if guild_data['id'] not in keys_by_guild_id:
+                    ally_codes = [p['allyCode'] for p in guild_data['roster']]
+                    if only_changed_gp:
+                        ally_codes = Player.objects.changed_gp_ally_codes(
+                            guild_data['roster'])
+                    guilds.append((guild_data, ally_codes))
+                keys_by_guild_id[guild_data['id']].append(key)
+
+            results = {}
+            batch_size = swgoh.Swgoh.MAX_BATCH_SIZE
+            for guild_data, player_data in client.iter_guild_data(guilds=guilds):
+                guild = self.update_or_create_from_data(
+                    guild_data, [player_data[i:i + batch_size]
+                                 for i in range(0, len(player_data), batch_size)],
+                    use_copy)
+                for key in keys_by_guild_id[guild_data['id']]:
+                    results[key] = guild
+            return results
+        finally:
+            client.close()
+
+    @staticmethod
+    def refresh_key(ally_code):
+        """
+        Key of the imports of a guild (see `sqds.single_flight`), which is known before
+        the guild is downloaded: the ID of the ally code's guild if the player is known,
+        so that imports through different members are coalesced, or the ally code
+        otherwise.
+        """
+        guild_id = (Player.objects.filter(ally_code=ally_code).exclude(guild=None)
+                    .values_list('guild__api_id', flat=True).first())
+        return guild_id or f'ally_code:{ally_code}'
+
+    # pylint: disable=too-many-locals
+    # noinspection PyMethodMayBeStatic
+    def update_or_create_from_data(self, guild_data, player_data_batches=None,
+                                   use_copy=False):
+        """
+        Create or update a guild based on data from swgoh.help.
+        :param guild_data: the guild data from swgoh.help
+        :param player_data_batches: (optional) iterable of arrays of player data for the
+        guild's players, each array being written in its own transaction. Players no
+        longer in the guild are deleted. If None, only the guild itself is updated.
+        :param use_copy: if True, player rosters are inserted with COPY on PostgreSQL
+        (see `RosterWriter`)
+        :return: the Guild object created or updated
+        """
+
+        ArchivedPayload.objects.store_many(ArchivedPayloadKind.GUILD,
+                                           [(guild_data['id'], guild_data)])
 
         # Create or update Guild instance
         guild_id = guild_data['id']
@@ -158,165 +415,106 @@ class GuildManager(models.Manager):
             'name': guild_data['name'],
             'gp': guild_data['gp']})
 
-        if guild_only:
+        if player_data_batches is None:
             return guild
 
-        # For all of the guild players, download their info, roster, mods and skills.
-
+        # Medals and stats of each batch are refreshed in the batch's transaction, so
+        # that they stay consistent with the players already written if a later batch
+        # fails.
         ally_codes = [p['allyCode'] for p in guild_data['roster']]
-        all_player_data = swgoh.api.get_player_data_batch(ally_codes)
-
-        # Create or update all Player instance, deleting players no longer present
+        for player_data_batch in player_data_batches:
+            if not player_data_batch:
+                continue
+            ArchivedPayload.objects.store_many(
+                ArchivedPayloadKind.PLAYER,
+                [(player_data['allyCode'], player_data)
+                 for player_data in player_data_batch])
+            with transaction.atomic():
+                roster_writer = RosterWriter(use_copy=use_copy)
+                players = [Player.objects.update_or_create_from_data(
+                    player_data, guild, roster_writer)
+                    for player_data in player_data_batch]
+                roster_writer.write()
+
+                Medal.objects.update_all([player.ally_code for player in players])
+                update_stats([player.pk for player in players], [guild.pk])
+
+        # Delete players no longer present and update guild-wide data. Players which
+        # were not downloaded are kept.
         with transaction.atomic():
-            player_id_array = []
-
-            for player_data in all_player_data:
-                player = Player.objects.update_or_create_from_data(player_data, guild)
-                player_id_array.append(player.id)
-
-            guild.player_set.exclude(id__in=player_id_array).delete()
-
-            Medal.objects.update_all(ally_codes)
+            guild.player_set.exclude(ally_code__in=ally_codes).delete()
+            update_stats([], [guild.pk])
 
         return guild
 
 
 class GuildSet(models.QuerySet):
     def annotate_stats(self):
-        player_count = Guild.objects.filter(pk=OuterRef('pk')).annotate(
-            cnt=Count('player_set'))
-        gp_char = Guild.objects.filter(pk=OuterRef('pk')).annotate(
-            cnt=Sum('player_set__gp_char'))
-        gp_ship = Guild.objects.filter(pk=OuterRef('pk')).annotate(
-            cnt=Sum('player_set__gp_ship'))
-        unit_count = Guild.objects.filter(pk=OuterRef('pk')).annotate(
-            cnt=Count('player_set__unit_set'))
-        seven_star_unit_count = Guild.objects.filter(pk=OuterRef('pk')).annotate(
-            cnt=Count('player_set__unit_set', filter=Q(player_set__unit_set__rarity=7)))
-        g13_unit_count = Guild.objects.filter(pk=OuterRef('pk')).annotate(
-            cnt=Count('player_set__unit_set', filter=Q(player_set__unit_set__gear=13)))
-        g12_unit_count = Guild.objects.filter(pk=OuterRef('pk')).annotate(
-            cnt=Count('player_set__unit_set', filter=Q(player_set__unit_set__gear=12)))
-        g11_unit_count = Guild.objects.filter(pk=OuterRef('pk')).annotate(
-            cnt=Count('player_set__unit_set', filter=Q(player_set__unit_set__gear=11)))
-        g10_unit_count = Guild.objects.filter(pk=OuterRef('pk')).annotate(
-            cnt=Count('player_set__unit_set', filter=Q(player_set__unit_set__gear=10)))
-        zeta_count = Guild.objects.filter(pk=OuterRef('pk')).annotate(
-            cnt=Count('player_set__unit_set__zeta_set'))
-        g12_gear_count = Guild.objects.filter(pk=OuterRef('pk')).annotate(
-            cnt=Count(
-                'player_set__unit_set__pug_set',
-                filter=(Q(
-                    player_set__unit_set__pug_set__gear__is_right_hand_g12=True)
-                        | Q(
-                            player_set__unit_set__pug_set__gear__is_left_hand_g12=True))))
-        right_hand_g12_gear_count = Guild.objects.filter(pk=OuterRef('pk')).annotate(
-            cnt=Count('player_set__unit_set__pug_set',
-                      filter=Q(
-                          player_set__unit_set__pug_set__gear__is_right_hand_g12=True)))
-        left_hand_g12_gear_count = Guild.objects.filter(pk=OuterRef('pk')).annotate(
-            cnt=Count('player_set__unit_set__pug_set',
-                      filter=Q(
-                          player_set__unit_set__pug_set__gear__is_left_hand_g12=True)))
-        mod_count = Guild.objects.filter(pk=OuterRef('pk')).annotate(
-            cnt=Count('player_set__unit_set__mod_set'))
-        mod_count_6dot = Guild.objects.filter(pk=OuterRef('pk')).annotate(
-            cnt=Count('player_set__unit_set__mod_set',
-                      filter=Q(player_set__unit_set__mod_set__pips__gte=6)))
-        mod_count_speed_25 = Guild.objects.filter(pk=OuterRef('pk')).annotate(
-            cnt=Count('player_set__unit_set__mod_set',
-                      filter=(Q(player_set__unit_set__mod_set__speed__gte=25) & ~Q(
-                          player_set__unit_set__mod_set__primary_stat='SP'))))
-        mod_count_speed_20 = Guild.objects.filter(pk=OuterRef('pk')).annotate(
-            cnt=Count('player_set__unit_set__mod_set',
-                      filter=(Q(player_set__unit_set__mod_set__speed__gte=20) & Q(
-                          player_set__unit_set__mod_set__speed__lt=25) & ~Q(
-                          player_set__unit_set__mod_set__primary_stat='SP'))))
-        mod_count_speed_15 = Guild.objects.filter(pk=OuterRef('pk')).annotate(
-            cnt=Count('player_set__unit_set__mod_set',
-                      filter=(Q(player_set__unit_set__mod_set__speed__gte=15) & Q(
-                          player_set__unit_set__mod_set__speed__lt=20) & ~Q(
-                          player_set__unit_set__mod_set__primary_stat='SP'))))
-        mod_count_speed_10 = Guild.objects.filter(pk=OuterRef('pk')).annotate(
-            cnt=Count('player_set__unit_set__mod_set',
-                      filter=(Q(player_set__unit_set__mod_set__speed__gte=10) & Q(
-                          player_set__unit_set__mod_set__speed__lt=15) & ~Q(
-                          player_set__unit_set__mod_set__primary_stat='SP'))))
-        mod_total_speed_15plus = Guild.objects.filter(pk=OuterRef('pk')).annotate(
-            sum15=Sum('player_set__unit_set__mod_set__speed',
-                      filter=(Q(player_set__unit_set__mod_set__speed__gte=15) & ~Q(
-                          player_set__unit_set__mod_set__primary_stat='SP'))))
-        medal_count = Guild.objects.filter(pk=OuterRef('pk')).annotate(
-            cnt=Count('player_set__unit_set__medal_set'))
-
-        return self.annotate(
-            player_count=Subquery(player_count.values('cnt'),
-                                  output_field=models.IntegerField()),
-            gp_char=Subquery(gp_char.values('cnt'),
-                             output_field=models.IntegerField()),
-            gp_ship=Subquery(gp_ship.values('cnt'),
-                             output_field=models.IntegerField()),
-            unit_count=Subquery(unit_count.values('cnt'),
-                                output_field=models.IntegerField()),
-            seven_star_unit_count=Subquery(seven_star_unit_count.values('cnt'),
-                                           output_field=models.IntegerField()),
-            g13_unit_count=Subquery(g13_unit_count.values('cnt'),
-                                    output_field=models.IntegerField()),
-            g12_unit_count=Subquery(g12_unit_count.values('cnt'),
-                                    output_field=models.IntegerField()),
-            g11_unit_count=Subquery(g11_unit_count.values('cnt'),
-                                    output_field=models.IntegerField()),
-            g10_unit_count=Subquery(g10_unit_count.values('cnt'),
-                                    output_field=models.IntegerField()),
-            zeta_count=Subquery(zeta_count.values('cnt'),
-                                output_field=models.IntegerField()),
-            g12_gear_count=Subquery(g12_gear_count.values('cnt'),
-                                    output_field=models.IntegerField()),
-            right_hand_g12_gear_count_g12_only=Subquery(right_hand_g12_gear_count.values(
-                'cnt'), output_field=models.IntegerField()),
-            left_hand_g12_gear_count_g12_only=Subquery(left_hand_g12_gear_count.values(
-                'cnt'), output_field=models.IntegerField()),
-            right_hand_g12_gear_count=F('right_hand_g12_gear_count_g12_only') + 3 * F(
-                'g13_unit_count'),
-            left_hand_g12_gear_count=F('left_hand_g12_gear_count_g12_only') + 3 * F(
-                'g13_unit_count'),
-            mod_count=Subquery(mod_count.values('cnt'),
-                               output_field=models.IntegerField()),
-            mod_count_6dot=Subquery(mod_count_6dot.values('cnt'),
-                                    output_field=models.IntegerField()),
-            mod_count_speed_25=Subquery(mod_count_speed_25.values('cnt'),
-                                        output_field=models.IntegerField()),
-            mod_count_speed_20=Subquery(mod_count_speed_20.values('cnt'),
-                                        output_field=models.IntegerField()),
-            mod_count_speed_15=Subquery(mod_count_speed_15.values('cnt'),
-                                        output_field=models.IntegerField()),
-            mod_count_speed_10=Subquery(mod_count_speed_10.values('cnt'),
-                                        output_field=models.IntegerField()),
-
-            mod_total_speed_15plus=Subquery(mod_total_speed_15plus.values('sum15'),
-                                            output_field=models.IntegerField()),
-            medal_count=Subquery(medal_count.values('cnt'),
-                                 output_field=models.IntegerField()))
+        queryset, annotations = stat_annotations(self, 'guild')
+        return queryset.annotate(**stored_annotations(annotations))
 
     def annotate_faction_gp(self):
-        unit_ids = Unit.objects.filter(
-            categories__api_id='affiliation_separatist').values('id')
-        sep_gp = Guild.objects.filter(pk=OuterRef('pk')).annotate(
-            sep_gp=Sum('player_set__unit_set__gp',
-                       filter=Q(player_set__unit_set__unit__id__in=unit_ids)))
-
-        gr_unit_ids = Unit.objects.filter(
-            categories__api_id='affiliation_republic').values('id')
-        gr_gp = Guild.objects.filter(pk=OuterRef('pk')).annotate(
-            gr_gp=Sum('player_set__unit_set__gp',
-                      filter=Q(player_set__unit_set__unit__id__in=gr_unit_ids)))
-
-        return self.annotate(
-            sep_gp=Subquery(sep_gp.values('sep_gp'), output_field=models.IntegerField()),
-            gr_gp=Subquery(gr_gp.values('gr_gp'), output_field=models.IntegerField()))
+        queryset, annotations = table_annotations(self, faction_gp_tables('guild'))
+        return queryset.annotate(**stored_annotations(annotations))
 
+    def annotate_category_gp(self, categories):
+        """
+        Annotate the total GP of the guilds' units of some categories.
+        :param categories: see `category_gp_annotations()`
+        """
+        return self.annotate(**category_gp_annotations(
+            categories, 'player_set__category_gp_set'))
 
-class Guild(models.Model):
+    def compute_stats(self):
+        """
+        Compute the same statistics as `annotate_stats()` and `annotate_faction_gp()`
+        from raw data, with one grouped query per child table. See `compute_stats()`.
+        :return: dictionary of statistics dictionaries, keyed by guild primary key
+        """
+        return compute_stats('guild', self.values_list('pk', flat=True))
+
+
+class ViewCountMixin:
+    """
+    Page views of a model's objects, counted in the cache so that viewing a page does
+    not write to the database. Counts are added to the `view_count` field by
+    `flush_view_counts()`, see `sqds.scheduler`.
+    """
+
+    @classmethod
+    def _view_count_key(cls, pk):
+        return f'view_count:{cls._meta.label_lower}:{pk}'
+
+    def record_view(self):
+        """Count a page view of the object."""
+        key = self._view_count_key(self.pk)
+        if not cache.add(key, 1, None):
+            try:
+                cache.incr(key)
+            except ValueError:  # evicted in the meantime
+                cache.set(key, 1, None)
+
+    @classmethod
+    def flush_view_counts(cls):
+        """
+        Add the page views counted in the cache to the `view_count` field.
+        """
+        keys = {cls._view_count_key(pk): pk
+                for pk in cls.objects.values_list('pk', flat=True)}
+        pks_by_count = defaultdict(list)
+        for key, count in cache.get_many(list(keys)).items():
+            if count:
+                pks_by_count[count].append(keys[key])
+                try:
+                    # views counted meanwhile are kept
+                    cache.decr(key, count)
+                except ValueError:
+                    pass
+        for count, pks in pks_by_count.items():
+            cls.objects.filter(pk__in=pks).update(view_count=F('view_count') + count)
+
+
+class Guild(ViewCountMixin, models.Model):
     api_id = models.CharField(max_length=50, unique=True, db_index=True)
 
     name = models.CharField(max_length=200)
@@ -324,12 +522,347 @@ class Guild(models.Model):
 
     last_updated = models.DateTimeField(auto_now=True)
 
+    # page views since the last refreshes, halved after each scheduled refresh
+    view_count = models.PositiveIntegerField(default=0)
+
     objects = GuildManager.from_queryset(GuildSet)()
 
     def __str__(self):  # pragma: no cover
         return self.name
 
 
+def set_changed_fields(instance, values):
+    """
+    Set the fields of a model instance whose value differs from the provided one. Values
+    are compared as they would be stored in database.
+    :param instance: the model instance
+    :param values: dictionary of new values keyed by field attribute name
+    :return: True if at least one field was changed
+    """
+    fields = {f.attname: f for f in instance._meta.concrete_fields}
+    changed = False
+    for attname, value in values.items():
+        field = fields[attname]
+        if (field.get_prep_value(getattr(instance, attname))
+                != field.get_prep_value(value)):
+            setattr(instance, attname, value)
+            changed = True
+    return changed
+
+
+def roster_hash(all_units_data):
+    """
+    Fingerprint of a player's roster, used to detect unchanged rosters.
+    :param all_units_data: the player's roster from swgoh.help
+    :return: the hexadecimal hash
+    """
+    return hashlib.sha1(json.dumps(all_units_data, sort_keys=True).encode()).hexdigest()
+
+
+def copy_text(value):
+    """
+    Format a value for PostgreSQL's COPY text format.
+    :param value: the value, as prepared for the database
+    :return: the formatted string
+    """
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    return (str(value)
+            .replace('\\', '\\\\')
+            .replace('\t', '\\t')
+            .replace('\n', '\\n')
+            .replace('\r', '\\r'))
+
+
+class RosterWriter:
+    """
+    Synchronise the units, zetas, gear and mods of a batch of players with their roster
+    from swgoh.help.
+
+    Rosters are compared with the stored rows so that only what changed is written:
+    changed rows are updated, new rows are inserted and rows absent from the roster are
+    deleted. Writes are done in bulk for the whole batch. New PlayerUnits are inserted
+    first, their primary keys being returned by the database where supported (e.g.
+    PostgreSQL) or fetched back by (player, unit) otherwise, so that their children can
+    then be inserted in bulk as well.
+    """
+    BATCH_SIZE = 500
+
+    def __init__(self, use_copy=False):
+        """
+        :param use_copy: if True and the database is PostgreSQL, new rows are inserted
+        with COPY (see `copy_create()`) instead of INSERT statements
+        """
+        self.rosters = []
+        self.use_copy = use_copy and connection.vendor == 'postgresql'
+
+    @staticmethod
+    def player_unit_values(unit_data):
+        """
+        Extract `PlayerUnit` field values from a roster item of swgoh.help's player data.
+        :param unit_data: the roster item
+        :return: dictionary of field values
+        """
+        unit_stats = unit_data['stats']['final']
+        mod_stats = unit_data['stats']['mods']
+
+        return dict(
+            gp=unit_data['gp'] if unit_data['gp'] is not None else 0,
+            rarity=unit_data['rarity'],
+            level=unit_data['level'],
+            gear=unit_data['gear'],
+            equipped_count=len(unit_data['equipped']),
+
+            speed=unit_stats['Speed'],
+            health=unit_stats['Health'],
+            protection=unit_stats.get('Protection', 0),
+
+            physical_damage=unit_stats['Physical Damage'],
+            physical_crit_chance=unit_stats['Physical Critical Chance'],
+            special_damage=unit_stats['Special Damage'],
+            special_crit_chance=unit_stats['Special Critical Chance'],
+            crit_damage=unit_stats['Critical Damage'],
+
+            potency=unit_stats.get('Potency', 0.0),
+            tenacity=unit_stats.get('Tenacity', 0.0),
+            armor=unit_stats.get('Armor', 0.0),
+            resistance=unit_stats.get('Resistance', 0.0),
+            armor_penetration=unit_stats.get('Armor Penetration', 0),
+            resistance_penetration=unit_stats.get('Resistance Penetration', 0),
+            health_steal=unit_stats.get('Health Steal', 0.0),
+            accuracy=unit_stats.get('Accuracy', 0.0),
+
+            mod_speed=mod_stats.get('Speed', 0.0),
+            mod_health=mod_stats.get('Health', 0.0),
+            mod_protection=mod_stats.get('Protection', 0.0),
+            mod_physical_damage=mod_stats.get('Physical Damage', 0.0),
+            mod_special_damage=mod_stats.get('Special Damage', 0.0),
+            mod_physical_crit_chance=mod_stats.get('Physical Critical Chance', 0.0),
+            mod_special_crit_chance=mod_stats.get('Special Critical Chance', 0.0),
+            mod_crit_damage=mod_stats.get('Critical Damage', 0.0),
+            mod_potency=mod_stats.get('Potency', 0.0),
+            mod_tenacity=mod_stats.get('Tenacity', 0.0),
+            mod_armor=mod_stats.get('Armor', 0.0),
+            mod_resistance=mod_stats.get('Resistance', 0.0),
+            mod_critical_avoidance=mod_stats.get('Critical Avoidance', 0.0),
+            mod_accuracy=mod_stats.get('Accuracy', 0.0))
+
+    @staticmethod
+    def mod(mod_data):
+        """
+        Build a `Mod` from a mod of swgoh.help's player data, without its player unit.
+        :param mod_data: the mod data
+        :return: the unsaved Mod object
+        """
+        mod = Mod(
+            api_id=mod_data['id'],
+            mod_set=mod_data['set'],
+            slot=mod_data['slot'] - 1,
+            level=mod_data['level'],
+            pips=mod_data['pips'],
+            tier=mod_data['tier'])
+        mod.update_stats(mod_data)
+        return mod
+
+    def add(self, player, all_units_data):
+        """
+        Add a player to the batch.
+        :param player: the Player object
+        :param all_units_data: the player's roster from swgoh.help
+        """
+        self.rosters.append((player, all_units_data))
+
+    def write(self):
+        """
+        Write the rosters of all players of the batch.
+        """
+        game_data = GameDataRegistry.get()
+        players = [player for player, _ in self.rosters]
+
+        with transaction.atomic():
+            player_units = {(pu.player_id, pu.unit_id): pu
+                            for pu in PlayerUnit.objects.filter(player__in=players)}
+            stored_player_unit_ids = {pu.id for pu in player_units.values()}
+            current_zetas = defaultdict(dict)
+            for pu_id, skill_id, zeta_id in (Zeta.objects
+                    .filter(player_unit__player__in=players)
+                    .values_list('player_unit_id', 'skill_id', 'id')):
+                current_zetas[pu_id][skill_id] = zeta_id
+            current_pugs = defaultdict(lambda: defaultdict(list))
+            for pu_id, gear_id, pug_id in (PlayerUnitGear.objects
+                    .filter(player_unit__player__in=players)
+                    .values_list('player_unit_id', 'gear_id', 'id')):
+                current_pugs[pu_id][gear_id].append(pug_id)
+            current_mods = {mod.api_id: mod for mod in
+                            Mod.objects.filter(player_unit__player__in=players)}
+
+            # (D1) Insert new PlayerUnits, so that all children can refer to them
+            units_data = []
+            pus_to_create = []
+            for player, all_units_data in self.rosters:
+                for unit_data in all_units_data:
+                    # ignore ships
+                    if unit_data['combatType'] != 1:
+                        continue
+
+                    unit = game_data.unit(unit_data['defId'])
+                    mods = [self.mod(mod_data) for mod_data in unit_data['mods']]
+                    values = self.player_unit_values(unit_data)
+                    values.update(
+                        mod_speed_no_set=sum(int(mod.speed) for mod in mods),
+                        zeta_count=sum(1 for skill_data in unit_data['skills']
+                                       if skill_data['isZeta']
+                                       and skill_data['tier'] == 8))
+                    units_data.append((player, unit, unit_data, values, mods))
+                    if (player.id, unit.id) not in player_units:
+                        player_unit = PlayerUnit(player=player, unit=unit, **values)
+                        player_units[(player.id, unit.id)] = player_unit
+                        pus_to_create.append(player_unit)
+            self.create_player_units(pus_to_create)
+
+            now = timezone.now()
+            roster_player_unit_ids = set()
+            pus_to_update = []
+            zetas_to_create = []
+            zeta_ids_to_delete = []
+            pugs_to_create = []
+            pug_ids_to_delete = []
+            mods_to_create = []
+            mods_to_update = []
+            histograms = {player.id: Counter() for player in players}
+
+            for player, unit, unit_data, values, mods in units_data:
+                # (D2) Update PlayerUnit model
+                player_unit = player_units[(player.id, unit.id)]
+                roster_player_unit_ids.add(player_unit.id)
+                if set_changed_fields(player_unit, values):
+                    player_unit.last_updated = now
+                    pus_to_update.append(player_unit)
+
+                # (D3) Update Zeta model
+                zetas = current_zetas.pop(player_unit.id, {})
+                for skill_data in unit_data['skills']:
+                    if skill_data['isZeta'] and skill_data['tier'] == 8:
+                        skill = game_data.skill(skill_data['id'])
+                        if zetas.pop(skill.id, None) is None:
+                            zetas_to_create.append(
+                                Zeta(player_unit=player_unit, skill=skill))
+                zeta_ids_to_delete.extend(zetas.values())
+
+                # (D4) Update PlayerUnitGear model
+                pugs = current_pugs.pop(player_unit.id, {})
+                for gear_data in unit_data['equipped']:
+                    gear = game_data.gear_piece(gear_data['equipmentId'])
+                    if pugs.get(gear.id):
+                        pugs[gear.id].pop()
+                    else:
+                        pugs_to_create.append(
+                            PlayerUnitGear(player_unit=player_unit, gear=gear))
+                pug_ids_to_delete.extend(pk for pks in pugs.values() for pk in pks)
+
+                # (D5) Update Mod model (mods may move between the player's units)
+                histograms[player.id].update(ModStatHistogram.objects.count_mods(mods))
+                for mod in mods:
+                    mod.player_unit = player_unit
+                    current_mod = current_mods.pop(mod.api_id, None)
+                    if current_mod is None:
+                        mods_to_create.append(mod)
+                    elif set_changed_fields(current_mod, {
+                            f.attname: getattr(mod, f.attname)
+                            for f in Mod.updatable_fields()}):
+                        mods_to_update.append(current_mod)
+
+            PlayerUnit.objects.bulk_update(
+                pus_to_update,
+                [f.name for f in PlayerUnit._meta.concrete_fields
+                 if not f.primary_key and f.name not in ('player', 'unit')],
+                batch_size=self.BATCH_SIZE)
+            self.delete(Zeta, zeta_ids_to_delete)
+            self.create(Zeta, zetas_to_create)
+            self.delete(PlayerUnitGear, pug_ids_to_delete)
+            self.create(PlayerUnitGear, pugs_to_create)
+            self.delete(Mod, [mod.id for mod in current_mods.values()])
+            Mod.objects.bulk_update(mods_to_update,
+                                    [f.name for f in Mod.updatable_fields()],
+                                    batch_size=self.BATCH_SIZE)
+            self.create(Mod, mods_to_create)
+            ModStatHistogram.objects.replace_for_players(histograms)
+
+            # Deleted last, so that mods moved away from these units are kept
+            self.delete(PlayerUnit, stored_player_unit_ids - roster_player_unit_ids)
+
+    def create_player_units(self, player_units):
+        """
+        Bulk insert PlayerUnits and set their primary key.
+        :param player_units: list of unsaved PlayerUnit objects
+        """
+        self.create(PlayerUnit, player_units)
+        if player_units and (self.use_copy
+                             or not connection.features.can_return_ids_from_bulk_insert):
+            pks = {(player_id, unit_id): pk for player_id, unit_id, pk in
+                   (PlayerUnit.objects
+                    .filter(player__in={pu.player_id for pu in player_units})
+                    .values_list('player_id', 'unit_id', 'id'))}
+            for player_unit in player_units:
+                player_unit.pk = pks[(player_unit.player_id, player_unit.unit_id)]
+
+    def create(self, model, objs):
+        """
+        Bulk insert objects, with COPY if enabled.
+        :param model: the model class
+        :param objs: list of unsaved objects
+        """
+        if self.use_copy:
+            self.copy_create(model, objs)
+        else:
+            model.objects.bulk_create(objs, batch_size=self.BATCH_SIZE)
+
+    @staticmethod
+    def copy_create(model, objs):
+        """
+        Insert objects using PostgreSQL's COPY. Rows are streamed into a temporary
+        staging table, which is then merged into the model's table with a single
+        INSERT ... SELECT statement. Primary keys of the objects are not set.
+        :param model: the model class
+        :param objs: list of unsaved objects
+        """
+        if not objs:
+            return
+
+        fields = [f for f in model._meta.concrete_fields if not f.primary_key]
+        table = connection.ops.quote_name(model._meta.db_table)
+        staging = connection.ops.quote_name(model._meta.db_table + '_staging')
+        columns = ', '.join(connection.ops.quote_name(f.column) for f in fields)
+
+        data = io.StringIO()
+        for obj in objs:
+            data.write('\t'.join(
+                copy_text(f.get_db_prep_save(f.pre_save(obj, True), connection))
+                for f in fields))
+            data.write('\n')
+        data.seek(0)
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'CREATE TEMPORARY TABLE {staging} AS '
+                           f'SELECT {columns} FROM {table} WITH NO DATA')
+            cursor.copy_expert(f'COPY {staging} ({columns}) FROM STDIN', data)
+            cursor.execute(f'INSERT INTO {table} ({columns}) '
+                           f'SELECT {columns} FROM {staging}')
+            cursor.execute(f'DROP TABLE {staging}')
+
+    def delete(self, model, ids):
+        """
+        Delete objects by primary key, in batches.
+        :param model: the model class
+        :param ids: collection of primary keys
+        """
+        ids = list(ids)
+        for i in range(0, len(ids), self.BATCH_SIZE):
+            model.objects.filter(id__in=ids[i:i + self.BATCH_SIZE]).delete()
+
+
 class PlayerManager(models.Manager):
     def ensure_exist(
             self, ally_codes: Union[int, Collection[int]],
@@ -367,25 +900,66 @@ class PlayerManager(models.Manager):
 
     def update_or_create_multiple_from_swgoh(
             self, ally_codes: Collection[int]) -> List['Player']:
+        """
+        Download and update or create players. Players which are already being
+        refreshed by a concurrent request are not downloaded again: the concurrent
+        refresh is waited for and its result shared (see `sqds.single_flight`).
+        :param ally_codes: ally codes of the players
+        :return: list of Player objects, for the players which exist
+        """
+        players = single_flight_many(
+            'player', ally_codes,
+            lambda codes: {player.ally_code: player
+                           for player in self._update_or_create_multiple(codes)})
+        return [players[ally_code] for ally_code in dict.fromkeys(ally_codes)
+                if ally_code in players]
+
+    def _update_or_create_multiple(self, ally_codes: Collection[int]) -> List['Player']:
         # Get data for all players
         all_player_data = swgoh.api.get_player_data_batch(ally_codes)
+        ArchivedPayload.objects.store_many(
+            ArchivedPayloadKind.PLAYER,
+            [(player_data['allyCode'], player_data) for player_data in all_player_data])
+
+        # Guilds players belong to before the update also need their stats updated
+        previous_guild_ids = list(Player.objects
+                                  .filter(ally_code__in=ally_codes)
+                                  .values_list('guild', flat=True))
+
+        # find player guilds, outside of the transaction since API calls lock the
+        # state of the service (see `swgoh.locked_service_state()`)
+        guilds = [Guild.objects.update_or_create_from_swgoh(
+            player_data['allyCode'], guild_only=True)
+            if player_data['guildRefId'] != '' else None
+            for player_data in all_player_data]
 
         with transaction.atomic():
             players = []
-            for player_data in all_player_data:
-                # find player guilds
-                if player_data['guildRefId'] != '':
-                    guild = Guild.objects.update_or_create_from_swgoh(
-                        player_data['allyCode'], guild_only=True)
-                else:
-                    guild = None
+            roster_writer = RosterWriter()
+            for player_data, guild in zip(all_player_data, guilds):
+                players.append(
+                    self.update_or_create_from_data(player_data, guild, roster_writer))
 
-                players.append(self.update_or_create_from_data(player_data, guild))
+            roster_writer.write()
 
             Medal.objects.update_all(ally_codes)
+            update_stats([p.pk for p in players], previous_guild_ids)
 
         return players
 
+    @staticmethod
+    def changed_gp_ally_codes(guild_roster_data) -> List[int]:
+        """
+        Find the players of a guild roster whose GP differs from the stored one.
+        :param guild_roster_data: the guild roster from swgoh.help
+        :return: ally codes of new players and players whose GP changed
+        """
+        stored_gp = dict(Player.objects
+                         .filter(ally_code__in=[p['allyCode'] for p in guild_roster_data])
+                         .values_list('ally_code', 'gp'))
+        return [p['allyCode'] for p in guild_roster_data
+                if stored_gp.get(p['allyCode']) != p['gp']]
+
     def update_or_create_from_swgoh(self, ally_code: int) -> 'Player':
         """
         Update or create a single player. TODO: is this function still used?
@@ -393,249 +967,92 @@ class PlayerManager(models.Manager):
         return self.update_or_create_multiple_from_swgoh([ally_code])[0]
 
     def update_or_create_from_data(self, player_data,
-                                   guild: Union[Guild, None]) -> 'Player':
+                                   guild: Union[Guild, None],
+                                   roster_writer: 'RosterWriter' = None) -> 'Player':
         """
-        Update or create a player based on data from swgoh.help.
+        Update or create a player based on data from swgoh.help. The player's roster is
+        only written if it changed since the last update, according to swgoh.help's
+        `updated` timestamp or to the roster's hash, or if the number of stored units
+        does not match it (e.g. units were deleted outside of ingestion).
         Note: this function makes multiple calls to the database and is best wrapped in
         an transaction.atomic() statement to ensure consistency.
         :param player_data: the data from swgoh.help
         :param guild: the guild object for the player or None
+        :param roster_writer: (optional) if provided, the player's roster is added to
+        this writer instead of being written immediately
         :return: the Player object created or updated
         """
-        player, _ = Player.objects.update_or_create(
-            api_id=player_data['id'],
-            defaults={
-                'guild': guild,
-                'name': player_data['name'],
-                'level': player_data['level'],
-                'ally_code': player_data['allyCode'],
-                'gp': player_data['stats'][0]['value'],
-                'gp_char': player_data['stats'][1]['value'],
-                'gp_ship': player_data['stats'][2]['value']})
-        player.save()  # force last updated change
-        self.update_player_units(player, all_units_data=player_data['roster'])
+        player = (Player.objects.filter(api_id=player_data['id']).first()
+                  or Player(api_id=player_data['id']))
+        api_updated = player_data.get('updated')
+        new_roster_hash = roster_hash(player_data['roster'])
+        roster_unchanged = player.pk is not None and (
+                (api_updated is not None and player.api_updated == api_updated)
+                or player.roster_hash == new_roster_hash)
+        if roster_unchanged:
+            # ships are not stored
+            unit_count = sum(1 for unit_data in player_data['roster']
+                             if unit_data['combatType'] == 1)
+            roster_unchanged = player.unit_set.count() == unit_count
+
+        player.guild = guild
+        player.name = player_data['name']
+        player.level = player_data['level']
+        player.ally_code = player_data['allyCode']
+        player.gp = player_data['stats'][0]['value']
+        player.gp_char = player_data['stats'][1]['value']
+        player.gp_ship = player_data['stats'][2]['value']
+        player.api_updated = api_updated
+        player.roster_hash = new_roster_hash
+        player.save()  # also updates last_updated
+        if roster_unchanged:
+            return player
+
+        if roster_writer is None:
+            self.update_player_units(player, all_units_data=player_data['roster'])
+        else:
+            roster_writer.add(player, player_data['roster'])
         return player
 
     @staticmethod
     def update_player_units(player, all_units_data):
-        with transaction.atomic():
-            # Delete everything and batch create
-            PlayerUnit.objects.filter(player=player).delete()
-
-            zetas_to_create = []
-            pugs_to_create = []
-            mods_to_create = []
-
-            for unit_data in all_units_data:
-                # ignore ships
-                if unit_data['combatType'] != 1:
-                    continue
-
-                unit = Unit.objects.get(api_id=unit_data['defId'])
-                unit_stats = unit_data['stats']['final']
-                mod_stats = unit_data['stats']['mods']
-
-                # (D1) Update player model
-                player_unit = PlayerUnit(
-                    player=player,
-                    unit=unit,
-
-                    gp=unit_data['gp'] if unit_data['gp'] is not None else 0,
-                    rarity=unit_data['rarity'],
-                    level=unit_data['level'],
-                    gear=unit_data['gear'],
-                    equipped_count=len(unit_data['equipped']),
-
-                    speed=unit_stats['Speed'],
-                    health=unit_stats['Health'],
-                    protection=unit_stats.get('Protection', 0),
-
-                    physical_damage=unit_stats['Physical Damage'],
-                    physical_crit_chance=unit_stats[
-                        'Physical Critical Chance'],
-                    special_damage=unit_stats['Special Damage'],
-                    special_crit_chance=unit_stats['Special Critical Chance'],
-                    crit_damage=unit_stats['Critical Damage'],
-
-                    potency=unit_stats.get('Potency', 0.0),
-                    tenacity=unit_stats.get('Tenacity', 0.0),
-                    armor=unit_stats.get('Armor', 0.0),
-                    resistance=unit_stats.get('Resistance', 0.0),
-                    armor_penetration=unit_stats.get('Armor Penetration', 0),
-                    resistance_penetration=unit_stats.get(
-                        'Resistance Penetration', 0),
-                    health_steal=unit_stats.get('Health Steal', 0.0),
-                    accuracy=unit_stats.get('Accuracy', 0.0),
-
-                    mod_speed=mod_stats.get('Speed', 0.0),
-                    mod_health=mod_stats.get('Health', 0.0),
-                    mod_protection=mod_stats.get('Protection', 0.0),
-                    mod_physical_damage=mod_stats.get('Physical Damage', 0.0),
-                    mod_special_damage=mod_stats.get('Special Damage', 0.0),
-                    mod_physical_crit_chance=mod_stats.get('Physical Critical Chance',
-                                                           0.0),
-                    mod_special_crit_chance=mod_stats.get('Special Critical Chance', 0.0),
-                    mod_crit_damage=mod_stats.get('Critical Damage', 0.0),
-                    mod_potency=mod_stats.get('Potency', 0.0),
-                    mod_tenacity=mod_stats.get('Tenacity', 0.0),
-                    mod_armor=mod_stats.get('Armor', 0.0),
-                    mod_resistance=mod_stats.get('Resistance', 0.0),
-                    mod_critical_avoidance=mod_stats.get('Critical Avoidance', 0.0),
-                    mod_accuracy=mod_stats.get('Accuracy', 0.0)
-                )
-                player_unit.save()
-
-                # (D2) Update Zeta model
-                for skill_data in unit_data['skills']:
-                    if skill_data['isZeta'] and skill_data['tier'] == 8:
-                        zeta = Zeta(
-                            player_unit=player_unit,
-                            skill=Skill.objects.get(api_id=skill_data['id']))
-                        zetas_to_create.append(zeta)
-
-                # (D3) Update PlayerUnitGear model
-                for gear_data in unit_data['equipped']:
-                    pug = PlayerUnitGear(
-                        player_unit=player_unit,
-                        gear=Gear.objects.get(api_id=gear_data['equipmentId']))
-                    pugs_to_create.append(pug)
-
-                # (D4) Update Mod model
-                for mod_data in unit_data['mods']:
-                    mod = Mod(
-                        api_id=mod_data['id'],
-                        player_unit=player_unit,
-                        mod_set=mod_data['set'],
-                        slot=mod_data['slot'] - 1,
-                        level=mod_data['level'],
-                        pips=mod_data['pips'],
-                        tier=mod_data['tier'])
-                    mod.update_stats(mod_data)
-                    mods_to_create.append(mod)
-
-            Zeta.objects.bulk_create(zetas_to_create)
-            PlayerUnitGear.objects.bulk_create(pugs_to_create)
-            Mod.objects.bulk_create(mods_to_create)
+        """
+        Synchronise a player's units, zetas, gear and mods with its roster. See
+        `RosterWriter`.
+        :param player: the Player object
+        :param all_units_data: the player's roster from swgoh.help
+        """
+        writer = RosterWriter()
+        writer.add(player, all_units_data)
+        writer.write()
 
 
 class PlayerSet(models.QuerySet):
     def annotate_stats(self):
-        unit_count = Player.objects.filter(pk=OuterRef('pk')).annotate(
-            cnt=Count('unit_set'))
-        seven_star_unit_count = Player.objects.filter(pk=OuterRef('pk')).annotate(
-            cnt=Count('unit_set', filter=Q(unit_set__rarity=7)))
-        g13_unit_count = Player.objects.filter(pk=OuterRef('pk')).annotate(
-            cnt=Count('unit_set', filter=Q(unit_set__gear=13)))
-        g12_unit_count = Player.objects.filter(pk=OuterRef('pk')).annotate(
-            cnt=Count('unit_set', filter=Q(unit_set__gear=12)))
-        g11_unit_count = Player.objects.filter(pk=OuterRef('pk')).annotate(
-            cnt=Count('unit_set', filter=Q(unit_set__gear=11)))
-        g10_unit_count = Player.objects.filter(pk=OuterRef('pk')).annotate(
-            cnt=Count('unit_set', filter=Q(unit_set__gear=10)))
-        zeta_count = Player.objects.filter(pk=OuterRef('pk')).annotate(
-            cnt=Count('unit_set__zeta_set'))
-        g12_gear_count = Player.objects.filter(pk=OuterRef('pk')).annotate(
-            cnt=Count('unit_set__pug_set',
-                      filter=(Q(unit_set__pug_set__gear__is_right_hand_g12=True) | Q(
-                          unit_set__pug_set__gear__is_left_hand_g12=True))))
-        right_hand_g12_gear_count = Player.objects.filter(pk=OuterRef('pk')).annotate(
-            cnt=Count('unit_set__pug_set',
-                      filter=Q(unit_set__pug_set__gear__is_right_hand_g12=True)))
-        left_hand_g12_gear_count = Player.objects.filter(pk=OuterRef('pk')).annotate(
-            cnt=Count('unit_set__pug_set',
-                      filter=Q(unit_set__pug_set__gear__is_left_hand_g12=True)))
-        mod_count = Player.objects.filter(pk=OuterRef('pk')).annotate(
-            cnt=Count('unit_set__mod_set'))
-        mod_count_6dot = Player.objects.filter(pk=OuterRef('pk')).annotate(
-            cnt=Count('unit_set__mod_set',
-                      filter=Q(unit_set__mod_set__pips__gte=6)))
-        mod_count_speed_25 = Player.objects.filter(pk=OuterRef('pk')).annotate(
-            cnt=Count('unit_set__mod_set',
-                      filter=(Q(unit_set__mod_set__speed__gte=25) & ~Q(
-                          unit_set__mod_set__primary_stat='SP'))))
-        mod_count_speed_20 = Player.objects.filter(pk=OuterRef('pk')).annotate(
-            cnt=Count('unit_set__mod_set',
-                      filter=(Q(unit_set__mod_set__speed__gte=20) & Q(
-                          unit_set__mod_set__speed__lt=25) & ~Q(
-                          unit_set__mod_set__primary_stat='SP'))))
-        mod_count_speed_15 = Player.objects.filter(pk=OuterRef('pk')).annotate(
-            cnt=Count('unit_set__mod_set',
-                      filter=(Q(unit_set__mod_set__speed__gte=15) & Q(
-                          unit_set__mod_set__speed__lt=20) & ~Q(
-                          unit_set__mod_set__primary_stat='SP'))))
-        mod_count_speed_10 = Player.objects.filter(pk=OuterRef('pk')).annotate(
-            cnt=Count('unit_set__mod_set',
-                      filter=(Q(unit_set__mod_set__speed__gte=10) & Q(
-                          unit_set__mod_set__speed__lt=15) & ~Q(
-                          unit_set__mod_set__primary_stat='SP'))))
-        mod_total_speed_15plus = Player.objects.filter(pk=OuterRef('pk')).annotate(
-            sum15=Sum('unit_set__mod_set__speed',
-                      filter=(Q(unit_set__mod_set__speed__gte=15) & ~Q(
-                          unit_set__mod_set__primary_stat='SP'))))
-        medal_count = Player.objects.filter(pk=OuterRef('pk')).annotate(
-            cnt=Count('unit_set__medal_set'))
-
-        return self.annotate(
-            unit_count=Subquery(unit_count.values('cnt'),
-                                output_field=models.IntegerField()),
-            seven_star_unit_count=Subquery(seven_star_unit_count.values('cnt'),
-                                           output_field=models.IntegerField()),
-            g13_unit_count=Subquery(g13_unit_count.values('cnt'),
-                                    output_field=models.IntegerField()),
-            g12_unit_count=Subquery(g12_unit_count.values('cnt'),
-                                    output_field=models.IntegerField()),
-            g11_unit_count=Subquery(g11_unit_count.values('cnt'),
-                                    output_field=models.IntegerField()),
-            g10_unit_count=Subquery(g10_unit_count.values('cnt'),
-                                    output_field=models.IntegerField()),
-            zeta_count=Subquery(zeta_count.values('cnt'),
-                                output_field=models.IntegerField()),
-            g12_gear_count=Subquery(g12_gear_count.values('cnt'),
-                                    output_field=models.IntegerField()),
-            right_hand_g12_gear_count_g12_only=Subquery(right_hand_g12_gear_count.values(
-                'cnt'), output_field=models.IntegerField()),
-            left_hand_g12_gear_count_g12_only=Subquery(left_hand_g12_gear_count.values(
-                'cnt'), output_field=models.IntegerField()),
-            right_hand_g12_gear_count=F('right_hand_g12_gear_count_g12_only') + 3 * F(
-                'g13_unit_count'),
-            left_hand_g12_gear_count=F('left_hand_g12_gear_count_g12_only') + 3 * F(
-                'g13_unit_count'),
-            mod_count=Subquery(mod_count.values('cnt'),
-                               output_field=models.IntegerField()),
-            mod_count_6dot=Subquery(mod_count_6dot.values('cnt'),
-                                    output_field=models.IntegerField()),
-            mod_count_speed_25=Subquery(mod_count_speed_25.values('cnt'),
-                                        output_field=models.IntegerField()),
-            mod_count_speed_20=Subquery(mod_count_speed_20.values('cnt'),
-                                        output_field=models.IntegerField()),
-            mod_count_speed_15=Subquery(mod_count_speed_15.values('cnt'),
-                                        output_field=models.IntegerField()),
-            mod_count_speed_10=Subquery(mod_count_speed_10.values('cnt'),
-                                        output_field=models.IntegerField()),
-            mod_total_speed_15plus=Subquery(mod_total_speed_15plus.values('sum15'),
-                                            output_field=models.IntegerField()),
-            medal_count=Subquery(medal_count.values('cnt'),
-                                 output_field=models.IntegerField()))
+        queryset, annotations = stat_annotations(self)
+        return queryset.annotate(**stored_annotations(annotations))
 
     def annotate_faction_gp(self):
-        unit_ids = Unit.objects.filter(
-            categories__api_id='affiliation_separatist').values('id')
-        sep_gp = Player.objects.filter(pk=OuterRef('pk')).annotate(
-            sep_gp=Sum('unit_set__gp',
-                       filter=Q(unit_set__unit__id__in=unit_ids)))
+        queryset, annotations = table_annotations(self, faction_gp_tables())
+        return queryset.annotate(**stored_annotations(annotations))
 
-        gr_unit_ids = Unit.objects.filter(
-            categories__api_id='affiliation_republic').values('id')
-        gr_gp = Player.objects.filter(pk=OuterRef('pk')).annotate(
-            gr_gp=Sum('unit_set__gp',
-                      filter=Q(unit_set__unit__id__in=gr_unit_ids)))
+    def annotate_category_gp(self, categories):
+        """
+        Annotate the total GP of the players' units of some categories.
+        :param categories: see `category_gp_annotations()`
+        """
+        return self.annotate(**category_gp_annotations(categories, 'category_gp_set'))
 
-        return self.annotate(
-            sep_gp=Subquery(sep_gp.values('sep_gp'), output_field=models.IntegerField()),
-            gr_gp=Subquery(gr_gp.values('gr_gp'), output_field=models.IntegerField()))
+    def compute_stats(self):
+        """
+        Compute the same statistics as `annotate_stats()` and `annotate_faction_gp()`
+        from raw data, with one grouped query per child table. See `compute_stats()`.
+        :return: dictionary of statistics dictionaries, keyed by player primary key
+        """
+        return compute_stats('', self.values_list('pk', flat=True))
 
 
-class Player(models.Model):
+class Player(ViewCountMixin, models.Model):
     api_id = models.CharField(max_length=50, unique=True, db_index=True)
 
     guild = models.ForeignKey(Guild, null=True, on_delete=models.CASCADE,
@@ -648,8 +1065,15 @@ class Player(models.Model):
     gp_char = models.IntegerField(verbose_name='GP (Characters)')
     gp_ship = models.IntegerField(verbose_name='GP (Ships)')
 
+    # swgoh.help's last update timestamp (ms) and hash of the last imported roster
+    api_updated = models.BigIntegerField(null=True)
+    roster_hash = models.CharField(max_length=40, blank=True, default='')
+
     last_updated = models.DateTimeField(auto_now=True)
 
+    # page views since the last refreshes, halved after each scheduled refresh
+    view_count = models.PositiveIntegerField(default=0)
+
     objects = PlayerManager.from_queryset(PlayerSet)()
 
     def __str__(self):  # pragma: no cover
@@ -687,21 +1111,37 @@ class PlayerUnitManager(models.Manager):
             return {}
 
 
+# Stored PlayerUnit counters and the aggregate of their children they are computed from
+PLAYER_UNIT_COUNTERS = {
+    'mod_speed_no_set': Coalesce(Sum('mod_set__speed'), 0),
+    'zeta_count': Count('zeta_set'),
+    'medal_count': Count('medal_set'),
+}
+
+
 class PlayerUnitSet(models.QuerySet):
     def annotate_stats(self):
-        mod_speed_no_set = PlayerUnit.objects.filter(pk=OuterRef('pk')).annotate(
-            mod_speed_no_set=Coalesce(Sum('mod_set__speed'), 0))
-        zeta_count = PlayerUnit.objects.filter(pk=OuterRef('pk')).annotate(
-            zeta_count=Count('zeta_set'))
-        medal_count = PlayerUnit.objects.filter(pk=OuterRef('pk')).annotate(
-            cnt=Count('medal_set'))
-        return self.annotate(
-            mod_speed_no_set=Subquery(mod_speed_no_set.values('mod_speed_no_set'),
-                                      output_field=models.IntegerField()),
-            zeta_count=Subquery(zeta_count.values('zeta_count'),
-                                output_field=models.IntegerField()),
-            medal_count=Subquery(medal_count.values('cnt'),
-                                 output_field=models.IntegerField()))
+        """
+        The statistics of player units are stored in their `mod_speed_no_set`,
+        `zeta_count` and `medal_count` fields, so that they can be sorted by index:
+        nothing needs to be annotated.
+        """
+        return self
+
+    def update_counters(self, fields=tuple(PLAYER_UNIT_COUNTERS)):
+        """
+        Recompute the stored counters of the player units from their children, with a
+        single UPDATE query.
+        :param fields: (optional) names of the counters to update
+        :return: the number of updated player units
+        """
+        return self.update(**{
+            field: Subquery(PlayerUnit.objects
+                            .filter(pk=OuterRef('pk'))
+                            .annotate(value=PLAYER_UNIT_COUNTERS[field])
+                            .values('value'),
+                            output_field=models.IntegerField())
+            for field in fields})
 
 
 class PlayerUnit(models.Model):
@@ -751,6 +1191,11 @@ class PlayerUnit(models.Model):
     mod_critical_avoidance = models.FloatField(verbose_name="Mod CA")
     mod_accuracy = models.FloatField(verbose_name="Mod acc.")
 
+    # counters of child rows, see `PlayerUnitSet.update_counters()`
+    mod_speed_no_set = models.IntegerField(default=0, db_index=True)
+    zeta_count = models.IntegerField(default=0, db_index=True)
+    medal_count = models.IntegerField(default=0, db_index=True)
+
     last_updated = models.DateTimeField(auto_now=True)
 
     objects = PlayerUnitManager.from_queryset(PlayerUnitSet)()
@@ -923,6 +1368,14 @@ class Mod(models.Model):
     critical_avoidance_roll = models.SmallIntegerField(default=0)
     accuracy_roll = models.SmallIntegerField(default=0)
 
+    @classmethod
+    def updatable_fields(cls):
+        """
+        Fields which may change when a mod is reimported from swgoh.help.
+        """
+        return [f for f in cls._meta.concrete_fields
+                if not f.primary_key and f.name != 'api_id']
+
     def update_stats(self, mod_data):
         self.primary_stat = MOD_STAT_MAP[mod_data['primaryStat']['unitStat']]['abbrev']
         for stat in [mod_data['primaryStat'], *mod_data['secondaryStat']]:
@@ -933,6 +1386,919 @@ class Mod(models.Model):
                 setattr(self, modified_stat_info['name'] + '_roll', stat['roll'])
 
 
+class ModStat(enum.Enum):
+    """Mod secondary statistics whose values are histogrammed, see `ModStatHistogram`."""
+    SPEED = 1
+    OFFENSE = 2
+    CRITICAL_CHANCE = 3
+    POTENCY = 4
+
+    labels = {
+        SPEED: 'Speed',
+        OFFENSE: 'Offense',
+        CRITICAL_CHANCE: 'Critical Chance',
+        POTENCY: 'Potency',
+    }
+
+
+# For each histogrammed statistic: the Mod field, the primary stat of mods whose value is
+# not a secondary (None if the field is never a primary) and the scale applied to values
+# to store them as integers (e.g. critical chance in hundredths of percent)
+MOD_HISTOGRAM_STATS = {
+    ModStat.SPEED: ('speed', 'SP', 1),
+    ModStat.OFFENSE: ('offense', None, 1),
+    ModStat.CRITICAL_CHANCE: ('critical_chance', 'CC', 10000),
+    ModStat.POTENCY: ('potency', 'PO', 10000),
+}
+
+
+def histogram_value(stat, value):
+    """
+    Convert a Mod field value to a histogram value.
+    :param stat: a ModStat value
+    :param value: value of the stat's Mod field
+    :return: the integer histogram value
+    """
+    return int(round(value * MOD_HISTOGRAM_STATS[stat][2]))
+
+
+def histogram_filter(stat, minimum=None, maximum=None, prefix=''):
+    """
+    Filter the histogram rows of a statistic whose value is in [minimum, maximum[.
+    :param stat: a ModStat value
+    :param minimum: (optional) lower bound, in Mod field units
+    :param maximum: (optional) upper bound (excluded), in Mod field units
+    :param prefix: (optional) lookup path from the queried model to the histogram
+    :return: the Q object
+    """
+    q = Q(**{prefix + 'stat': stat})
+    if minimum is not None:
+        q &= Q(**{prefix + 'value__gte': histogram_value(stat, minimum)})
+    if maximum is not None:
+        q &= Q(**{prefix + 'value__lt': histogram_value(stat, maximum)})
+    return q
+
+
+def histogram_buckets(stat, boundaries):
+    """
+    Build count aggregates (relative to ModStatHistogram) for buckets of a statistic
+    delimited by `boundaries`, the last bucket being open-ended.
+    :param stat: a ModStat value
+    :param boundaries: increasing bucket lower bounds, in Mod field units
+    :return: dictionary of aggregates, keyed by bucket name (e.g. 'speed_15_20',
+    'speed_25plus')
+    """
+    name = ModStat.name(stat).lower()
+    buckets = {}
+    for minimum, maximum in zip(boundaries, [*boundaries[1:], None]):
+        bucket_name = (f'{name}_{minimum:g}_{maximum:g}' if maximum is not None
+                       else f'{name}_{minimum:g}plus')
+        buckets[bucket_name] = Sum('count', filter=histogram_filter(stat, minimum,
+                                                                    maximum))
+    return buckets
+
+
+class ModStatHistogramSet(models.QuerySet):
+    def buckets(self, stat, boundaries, group=''):
+        """
+        Count the mods of players (or guilds) per bucket of a secondary statistic, with a
+        single grouped query.
+        :param stat: a ModStat value
+        :param boundaries: increasing bucket lower bounds, in Mod field units (e.g.
+        [10, 15, 20, 25] for speed, or [.05, .1] for critical chance)
+        :param group: (optional) '' to group by player, 'guild' to group by guild
+        :return: dictionary of {bucket name: count} dictionaries, keyed by player (or
+        guild) primary key. Players without mods are omitted.
+        """
+        lookup = '__'.join(p for p in ('player', group) if p)
+        aggregates = histogram_buckets(stat, boundaries)
+        rows = (self
+                .filter(stat=stat)
+                .order_by()
+                .values(lookup)
+                .annotate(**{'bucket_' + name: aggregate
+                             for name, aggregate in aggregates.items()}))
+        return {row.pop(lookup): {name[7:]: value or 0 for name, value in row.items()}
+                for row in rows}
+
+
+class ModStatHistogramManager(models.Manager):
+    @staticmethod
+    def count_mods(mods):
+        """
+        Count the secondary statistic values of mods.
+        :param mods: iterable of Mod objects
+        :return: Counter of (stat, value) tuples
+        """
+        counts = Counter()
+        for mod in mods:
+            for stat, (field, primary_stat, _) in MOD_HISTOGRAM_STATS.items():
+                value = getattr(mod, field)
+                if value and mod.primary_stat != primary_stat:
+                    counts[(stat, histogram_value(stat, value))] += 1
+        return counts
+
+    def replace_for_players(self, counts_by_player):
+        """
+        Replace the histograms of some players, unless they did not change.
+        :param counts_by_player: dictionary of Counters of (stat, value) tuples (see
+        `count_mods()`), keyed by player primary key
+        """
+        stored = {player_id: Counter() for player_id in counts_by_player}
+        for player_id, stat, value, count in self.filter(
+                player_id__in=list(counts_by_player)).values_list(
+                    'player_id', 'stat', 'value', 'count'):
+            stored[player_id][(stat, value)] = count
+        changed = [player_id for player_id, counts in counts_by_player.items()
+                   if +counts != stored[player_id]]
+        if not changed:
+            return
+
+        self.filter(player_id__in=changed).delete()
+        self.bulk_create(
+            [self.model(player_id=player_id, stat=stat, value=value, count=count)
+             for player_id in changed
+             for (stat, value), count in counts_by_player[player_id].items() if count],
+            batch_size=RosterWriter.BATCH_SIZE)
+
+    def rebuild_for_players(self, player_ids):
+        """
+        Rebuild the histograms of some players from their stored mods, with one grouped
+        query per statistic.
+        :param player_ids: primary keys of the players
+        """
+        player_ids = list(player_ids)
+        counts_by_player = {player_id: Counter() for player_id in player_ids}
+        for stat, (field, primary_stat, _) in MOD_HISTOGRAM_STATS.items():
+            rows = (Mod.objects
+                    .filter(player_unit__player__in=player_ids, **{field + '__gt': 0})
+                    .exclude(primary_stat=primary_stat)
+                    .order_by()
+                    .values_list('player_unit__player', field)
+                    .annotate(count=Count('id')))
+            for player_id, value, count in rows:
+                counts_by_player[player_id][(stat, histogram_value(stat, value))] += count
+        with transaction.atomic():
+            self.replace_for_players(counts_by_player)
+
+
+class ModStatHistogram(models.Model):
+    """
+    Number of mods of a player per value of a secondary statistic. Mod statistics can
+    be counted in any value buckets from this compact table instead of the Mod table.
+    """
+    player = models.ForeignKey(Player, on_delete=models.CASCADE,
+                               related_name='mod_histogram_set')
+    stat = enum.EnumField(ModStat)
+    value = models.IntegerField()
+    count = models.IntegerField()
+
+    objects = ModStatHistogramManager.from_queryset(ModStatHistogramSet)()
+
+    class Meta:
+        unique_together = [('player', 'stat', 'value')]
+
+
+class PlayerCategoryGPManager(models.Manager):
+    def update_for_players(self, player_ids):
+        """
+        Recompute the category GP rollups of some players from their units, with one
+        grouped query. Only changed rows are written.
+        :param player_ids: primary keys of the players to update
+        """
+        player_ids = list(player_ids)
+        rows = (PlayerUnit.objects
+                .filter(player__in=player_ids, unit__categories__isnull=False)
+                .order_by()
+                .values_list('player', 'unit__categories')
+                .annotate(gp=Sum('gp')))
+        computed = {(player_id, category_id): gp for player_id, category_id, gp in rows}
+        stored = {(obj.player_id, obj.category_id): obj
+                  for obj in self.filter(player__in=player_ids)}
+
+        to_create = []
+        to_update = []
+        for key, gp in computed.items():
+            obj = stored.pop(key, None)
+            if obj is None:
+                to_create.append(self.model(player_id=key[0], category_id=key[1], gp=gp))
+            elif obj.gp != gp:
+                obj.gp = gp
+                to_update.append(obj)
+
+        self.filter(pk__in=[obj.pk for obj in stored.values()]).delete()
+        self.bulk_update(to_update, ['gp'], batch_size=RosterWriter.BATCH_SIZE)
+        self.bulk_create(to_create, batch_size=RosterWriter.BATCH_SIZE)
+
+
+class PlayerCategoryGP(models.Model):
+    """
+    Total GP of a player's units of a category (e.g. a faction), see
+    `category_gp_annotations()`.
+    """
+    player = models.ForeignKey(Player, on_delete=models.CASCADE,
+                               related_name='category_gp_set')
+    category = models.ForeignKey(Category, on_delete=models.CASCADE,
+                                 related_name='player_gp_set')
+    gp = models.IntegerField()
+
+    objects = PlayerCategoryGPManager()
+
+    class Meta:
+        unique_together = [('player', 'category')]
+
+
+def category_gp_annotations(categories, lookup):
+    """
+    Build annotations of the total GP of some categories, from the PlayerCategoryGP
+    rollups. All categories are aggregated over a single join.
+    :param categories: list of category API IDs, annotated as '<api_id>_gp', or
+    dictionary of category API IDs keyed by annotation name
+    :param lookup: path from the annotated model to PlayerCategoryGP
+    :return: dictionary of annotations, suitable for QuerySet.annotate()
+    """
+    if not isinstance(categories, dict):
+        categories = {f'{api_id}_gp': api_id for api_id in categories}
+    return {name: Coalesce(Sum(f'{lookup}__gp',
+                               filter=Q(**{f'{lookup}__category__api_id': api_id})), 0)
+            for name, api_id in categories.items()}
+
+
+##########################################################################################
+## STATS ENGINE                                                                         ##
+##########################################################################################
+
+def stat_tables(group=''):
+    """
+    Describe the player-level statistics, grouped by the child table they are computed
+    from. Each item is a (model, lookup, aggregates) tuple, where `lookup` is the path
+    from the child model to the player (or to the player's guild if `group` is
+    'guild'), and `aggregates` maps statistic names to aggregates relative to the child
+    model. All the statistics of a table are computed with a single grouped query
+    using conditional aggregation, see `compute_stats()` and `table_annotations()`.
+    :param group: '' to group by player, 'guild' to group by guild
+    :return: list of (model, lookup, aggregates) tuples
+    """
+
+    def lookup(path):
+        return '__'.join(p for p in (path, group) if p)
+
+    def speed_count(minimum, maximum=None):
+        return Sum('count', filter=histogram_filter(ModStat.SPEED, minimum, maximum))
+
+    tables = [
+        (PlayerUnit, lookup('player'), {
+            'unit_count': Count('id'),
+            'seven_star_unit_count': Count('id', filter=Q(rarity=7)),
+            'g13_unit_count': Count('id', filter=Q(gear=13)),
+            'g12_unit_count': Count('id', filter=Q(gear=12)),
+            'g11_unit_count': Count('id', filter=Q(gear=11)),
+            'g10_unit_count': Count('id', filter=Q(gear=10)),
+        }),
+        (Zeta, lookup('player_unit__player'), {
+            'zeta_count': Count('id'),
+        }),
+        (PlayerUnitGear, lookup('player_unit__player'), {
+            'g12_gear_count': Count('id', filter=(Q(gear__is_right_hand_g12=True)
+                                                  | Q(gear__is_left_hand_g12=True))),
+            'right_hand_g12_gear_count_g12_only': Count(
+                'id', filter=Q(gear__is_right_hand_g12=True)),
+            'left_hand_g12_gear_count_g12_only': Count(
+                'id', filter=Q(gear__is_left_hand_g12=True)),
+        }),
+        (Mod, lookup('player_unit__player'), {
+            'mod_count': Count('id'),
+            'mod_count_6dot': Count('id', filter=Q(pips__gte=6)),
+        }),
+        (ModStatHistogram, lookup('player'), {
+            'mod_count_speed_25': speed_count(25),
+            'mod_count_speed_20': speed_count(20, 25),
+            'mod_count_speed_15': speed_count(15, 20),
+            'mod_count_speed_10': speed_count(10, 15),
+            'mod_total_speed_15plus': Sum(F('value') * F('count'),
+                                          filter=histogram_filter(ModStat.SPEED, 15)),
+        }),
+        (Medal, lookup('player_unit__player'), {
+            'medal_count': Count('id'),
+        }),
+    ]
+
+    if group:
+        tables.insert(0, (Player, group, {
+            'player_count': Count('id'),
+            'gp_char': Sum('gp_char'),
+            'gp_ship': Sum('gp_ship'),
+        }))
+
+    return tables
+
+
+def faction_gp_tables(group=''):
+    """
+    Describe the faction GP statistics (see `FACTION_GP_CATEGORIES`), in the same format
+    as `stat_tables()`.
+    :param group: '' to group by player, 'guild' to group by guild
+    :return: list of (model, lookup, aggregates) tuples
+    """
+    lookup = '__'.join(p for p in ('player', group) if p)
+    return [(PlayerCategoryGP, lookup, {
+        name: Sum('gp', filter=Q(category__api_id=category_api_id))
+        for name, category_api_id in FACTION_GP_CATEGORIES.items()
+    })]
+
+
+class GroupedStatsJoin:
+    """
+    LEFT OUTER JOIN of a grouped query (see `table_annotations()`), which returns at
+    most one row per key, on the primary key of a query's base table. Django has no API
+    to join a subquery, so this implements the interface of the `Join` objects of
+    `Query.alias_map` (see `django.db.models.sql.datastructures.Join`).
+    """
+    join_type = LOUTER
+    nullable = True
+    filtered_relation = None
+
+    def __init__(self, table_name, parent_alias, parent_column, query,
+                 table_alias=None):
+        """
+        :param table_name: name of the derived table, unique in the joining query
+        :param parent_alias: alias of the joining query's base table
+        :param parent_column: column of the primary key of the base table
+        :param query: the grouped query, whose 'stat_key' column is joined on the key
+        """
+        self.table_name = table_name
+        self.parent_alias = parent_alias
+        self.parent_column = parent_column
+        self.query = query
+        self.table_alias = table_alias
+
+    def as_sql(self, compiler, connection):
+        qn = compiler.quote_name_unless_alias
+        qn2 = connection.ops.quote_name
+        sql, params = self.query.get_compiler(connection=connection).as_sql()
+        return (f'{self.join_type} ({sql}) {qn(self.table_alias)} ON '
+                f'({qn(self.parent_alias)}.{qn2(self.parent_column)} = '
+                f'{qn(self.table_alias)}.{qn2("stat_key")})'), params
+
+    def relabeled_clone(self, change_map):
+        return self.__class__(self.table_name,
+                              change_map.get(self.parent_alias, self.parent_alias),
+                              self.parent_column, self.query,
+                              change_map.get(self.table_alias, self.table_alias))
+
+    def equals(self, other, with_filtered_relation):
+        return self is other
+
+    def promote(self):
+        return self
+
+    def demote(self):
+        # demoting to an INNER JOIN would drop the rows without children
+        return self
+
+
+class GroupedStatsCol(models.Expression):
+    """
+    Column of a grouped query joined with `GroupedStatsJoin`.
+    """
+
+    def __init__(self, alias, column):
+        super().__init__(output_field=models.IntegerField())
+        self.alias = alias
+        self.column = column
+
+    def as_sql(self, compiler, connection):
+        qn = compiler.quote_name_unless_alias
+        return f'{qn(self.alias)}.{connection.ops.quote_name(self.column)}', []
+
+    def relabeled_clone(self, change_map):
+        return self.__class__(change_map.get(self.alias, self.alias), self.column)
+
+    def get_group_by_cols(self):
+        return [self]
+
+
+def table_annotations(queryset, tables):
+    """
+    Join the statistics of `tables` (see `stat_tables()`) to a queryset of players (or
+    guilds). Like `compute_stats()`, the statistics of each child table are computed by
+    a single grouped query using conditional aggregation, which is joined to the
+    queryset as a derived table. The grouped queries only aggregate the rows of the
+    queryset which have no rollup (see `stored_annotations()`), so that they are cheap
+    when rollups are up to date.
+    :param queryset: queryset of Player (or Guild) objects
+    :param tables: list of (model, lookup, aggregates) tuples
+    :return: (queryset, annotations) tuple: a copy of the queryset joining the grouped
+    queries, and a dictionary of annotations reading their results, suitable for
+    QuerySet.annotate()
+    """
+    # The keys are kept on the query (which is copied with it), so that the grouped
+    # queries of later calls do not aggregate the ones joined by earlier calls
+    keys = getattr(queryset.query, 'stat_keys', None)
+    if keys is None:
+        keys = queryset.order_by().filter(stats__isnull=True).values('pk')
+    queryset = queryset.all()
+    query = queryset.query
+    query.stat_keys = keys
+    annotations = {}
+    for model, lookup, aggregates in tables:
+        grouped = (model.objects
+                   .filter(**{lookup + '__in': keys})
+                   .order_by()
+                   .annotate(stat_key=F(lookup))
+                   .values('stat_key')
+                   .annotate(**{'stat_' + name: aggregate
+                                for name, aggregate in aggregates.items()}))
+        alias = query.join(GroupedStatsJoin(
+            f'stats_{model._meta.model_name}', query.get_initial_alias(),
+            queryset.model._meta.pk.column, grouped.query))
+        for name in aggregates:
+            annotations[name] = Coalesce(GroupedStatsCol(alias, 'stat_' + name), 0)
+    return queryset, annotations
+
+
+def stat_annotations(queryset, group=''):
+    """
+    Join the statistics of `stat_tables()` to a queryset, see `table_annotations()`.
+    :param queryset: queryset of Player (or Guild) objects
+    :param group: '' to annotate players, 'guild' to annotate guilds
+    :return: (queryset, annotations) tuple
+    """
+    queryset, annotations = table_annotations(queryset, stat_tables(group))
+    annotations['right_hand_g12_gear_count'] = (
+            F('right_hand_g12_gear_count_g12_only') + 3 * F('g13_unit_count'))
+    annotations['left_hand_g12_gear_count'] = (
+            F('left_hand_g12_gear_count_g12_only') + 3 * F('g13_unit_count'))
+    return queryset, annotations
+
+
+def stored_annotations(annotations):
+    """
+    Read statistics from the `stats` rollup (PlayerStats or GuildStats) and fall back to
+    the live annotation for rows which have no rollup yet.
+    :param annotations: live annotations, keyed by statistic name
+    :return: dictionary of annotations, suitable for QuerySet.annotate()
+    """
+    return {name: Coalesce(F('stats__' + name), expression)
+            for name, expression in annotations.items()}
+
+
+def compute_stats(group, keys):
+    """
+    Compute all the statistics described by `stat_tables()` and `faction_gp_tables()`
+    for a set of players (or guilds) with a single grouped query per child table, and
+    merge the results.
+    :param group: '' to compute player statistics, 'guild' for guild statistics
+    :param keys: primary keys of the players (or guilds)
+    :return: dictionary of statistics dictionaries, keyed by primary key
+    """
+    keys = list(keys)
+    tables = stat_tables(group) + faction_gp_tables(group)
+    stats = {key: {name: 0 for _, _, aggregates in tables for name in aggregates}
+             for key in keys}
+
+    for model, lookup, aggregates in tables:
+        rows = (model.objects
+                .filter(**{lookup + '__in': keys})
+                .order_by()
+                .values(lookup)
+                .annotate(**{'stat_' + name: aggregate
+                             for name, aggregate in aggregates.items()}))
+        for row in rows:
+            key = row.pop(lookup)
+            stats[key].update({name[5:]: value or 0 for name, value in row.items()})
+
+    for key_stats in stats.values():
+        key_stats['right_hand_g12_gear_count'] = (
+                key_stats['right_hand_g12_gear_count_g12_only']
+                + 3 * key_stats['g13_unit_count'])
+        key_stats['left_hand_g12_gear_count'] = (
+                key_stats['left_hand_g12_gear_count_g12_only']
+                + 3 * key_stats['g13_unit_count'])
+    return stats
+
+
+def update_stats(player_ids, guild_ids=()):
+    """
+    Refresh the category GP and stats rollups of some players and of their guilds, and
+    invalidate the guilds' cached pages (see `sqds.page_cache`). This is meant to be
+    called within the transaction which modified the players' data.
+    :param player_ids: primary keys of the players to update
+    :param guild_ids: primary keys of additional guilds to update (e.g. guilds some of
+    the players just left)
+    """
+    player_ids = list(player_ids)
+    PlayerCategoryGP.objects.update_for_players(player_ids)
+    PlayerStats.objects.update_for_players(player_ids)
+    guild_ids = set(guild_ids) | set(Player.objects
+                                     .filter(pk__in=player_ids)
+                                     .values_list('guild', flat=True))
+    GuildStats.objects.update_for_guilds(guild_ids)
+    page_cache.invalidate_guilds(guild_ids)
+
+
+class StatsFields(models.Model):
+    """
+    Statistics stored by the PlayerStats and GuildStats rollups. There is one field per
+    statistic of `stat_tables()` and `faction_gp_tables()`.
+    """
+    unit_count = models.IntegerField(default=0)
+    seven_star_unit_count = models.IntegerField(default=0)
+    g13_unit_count = models.IntegerField(default=0)
+    g12_unit_count = models.IntegerField(default=0)
+    g11_unit_count = models.IntegerField(default=0)
+    g10_unit_count = models.IntegerField(default=0)
+    zeta_count = models.IntegerField(default=0)
+    g12_gear_count = models.IntegerField(default=0)
+    right_hand_g12_gear_count_g12_only = models.IntegerField(default=0)
+    left_hand_g12_gear_count_g12_only = models.IntegerField(default=0)
+    right_hand_g12_gear_count = models.IntegerField(default=0)
+    left_hand_g12_gear_count = models.IntegerField(default=0)
+    mod_count = models.IntegerField(default=0)
+    mod_count_6dot = models.IntegerField(default=0)
+    mod_count_speed_25 = models.IntegerField(default=0)
+    mod_count_speed_20 = models.IntegerField(default=0)
+    mod_count_speed_15 = models.IntegerField(default=0)
+    mod_count_speed_10 = models.IntegerField(default=0)
+    mod_total_speed_15plus = models.IntegerField(default=0)
+    medal_count = models.IntegerField(default=0)
+    sep_gp = models.IntegerField(default=0)
+    gr_gp = models.IntegerField(default=0)
+
+    last_updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def stat_names(cls):
+        return [f.name for f in StatsFields._meta.fields if f.name != 'last_updated']
+
+
+class PlayerStatsManager(models.Manager):
+    def update_for_players(self, player_ids):
+        """
+        Recompute the rollups of some players from their units, zetas, gear, mods and
+        medals.
+        :param player_ids: primary keys of the players to update
+        """
+        stats = compute_stats('', player_ids)
+        with transaction.atomic():
+            self.filter(player_id__in=stats.keys()).delete()
+            self.bulk_create(self.model(player_id=pk, **player_stats)
+                             for pk, player_stats in stats.items())
+
+
+class PlayerStats(StatsFields):
+    player = models.OneToOneField(Player, on_delete=models.CASCADE,
+                                  related_name='stats')
+
+    objects = PlayerStatsManager()
+
+    class Meta:
+        verbose_name_plural = 'Player stats'
+
+
+class GuildStatsManager(models.Manager):
+    def update_for_guilds(self, guild_ids):
+        """
+        Recompute the rollups of some guilds by summing their players' rollups. Players
+        without rollup have theirs computed first.
+        :param guild_ids: primary keys of the guilds to update (None values are ignored)
+        """
+        guild_ids = [pk for pk in set(guild_ids) if pk is not None]
+        PlayerStats.objects.update_for_players(
+            Player.objects
+                .filter(guild__in=guild_ids, stats__isnull=True)
+                .values_list('pk', flat=True))
+
+        stat_names = self.model.stat_names()
+        stats = {pk: {name: 0 for name in stat_names} for pk in guild_ids}
+        rows = (Player.objects
+                .filter(guild__in=guild_ids)
+                .order_by()
+                .values('guild')
+                .annotate(stat_player_count=Count('id'),
+                          stat_gp_char=Sum('gp_char'),
+                          stat_gp_ship=Sum('gp_ship'),
+                          **{'stat_' + name: Sum('stats__' + name)
+                             for name in stat_names}))
+        for row in rows:
+            stats[row['guild']] = {name: row['stat_' + name] or 0
+                                   for name in ['player_count', 'gp_char', 'gp_ship']
+                                   + stat_names}
+
+        with transaction.atomic():
+            self.filter(guild_id__in=guild_ids).delete()
+            self.bulk_create(self.model(guild_id=pk, **guild_stats)
+                             for pk, guild_stats in stats.items())
+
+
+class GuildStats(StatsFields):
+    guild = models.OneToOneField(Guild, on_delete=models.CASCADE, related_name='stats')
+
+    player_count = models.IntegerField(default=0)
+    gp_char = models.IntegerField(default=0)
+    gp_ship = models.IntegerField(default=0)
+
+    objects = GuildStatsManager()
+
+    class Meta:
+        verbose_name_plural = 'Guild stats'
+
+
+##########################################################################################
+## REFRESH JOBS                                                                         ##
+##########################################################################################
+# Player and guild refreshes requested by page views are queued in the database and run
+# by a separate worker process (see the `refresh_worker` management command), so that
+# web workers never wait on swgoh.help.
+
+
+class RefreshJobKind(enum.Enum):
+    PLAYER = 1
+    GUILD = 2
+
+    labels = {
+        PLAYER: 'Player',
+        GUILD: 'Guild',
+    }
+
+
+class RefreshJobStatus(enum.Enum):
+    PENDING = 1
+    RUNNING = 2
+    DONE = 3
+    FAILED = 4
+
+    labels = {
+        PENDING: 'Pending',
+        RUNNING: 'Running',
+        DONE: 'Done',
+        FAILED: 'Failed',
+    }
+
+
+ACTIVE_REFRESH_JOB_STATUSES = [RefreshJobStatus.PENDING, RefreshJobStatus.RUNNING]
+
+
+class RefreshJobManager(models.Manager):
+    def enqueue(self, kind: int, ally_code: int) -> 'RefreshJob':
+        """
+        Queue a refresh, unless the same refresh is already pending or running.
+        :param kind: a RefreshJobKind value
+        :param ally_code: ally code of the player (or of a player of the guild) to refresh
+        :return: the new or existing RefreshJob object
+        """
+        active_jobs = self.filter(kind=kind, ally_code=ally_code,
+                                  status__in=ACTIVE_REFRESH_JOB_STATUSES)
+        while True:
+            job = active_jobs.first()
+            if job is not None:
+                return job
+            try:
+                # At most one job is active per player or guild (see RefreshJob.Meta), so
+                # concurrent requests cannot both create one
+                with transaction.atomic():
+                    return self.create(kind=kind, ally_code=ally_code)
+            except IntegrityError:
+                pass
+
+    def latest(self, kind: int, ally_code: int) -> Union['RefreshJob', None]:
+        """
+        :return: the most recently queued refresh of a player or guild, or None
+        """
+        return (self.filter(kind=kind, ally_code=ally_code)
+                .order_by('-created', '-pk').first())
+
+    def claim(self) -> Union['RefreshJob', None]:
+        """
+        Mark the oldest pending job as running. Concurrent workers never claim the same
+        job.
+        :return: the claimed RefreshJob object, or None if no job is pending
+        """
+        while True:
+            job = (self.filter(status=RefreshJobStatus.PENDING)
+                   .order_by('created', 'pk').first())
+            if job is None:
+                return None
+            now = timezone.now()
+            if self.filter(pk=job.pk, status=RefreshJobStatus.PENDING).update(
+                    status=RefreshJobStatus.RUNNING, started=now):
+                job.status = RefreshJobStatus.RUNNING
+                job.started = now
+                return job
+
+    def requeue_stale(self, max_seconds: int) -> int:
+        """
+        Queue again the jobs which have been running for too long, e.g. because their
+        worker died.
+        :return: the number of jobs queued again
+        """
+        return (self.filter(status=RefreshJobStatus.RUNNING,
+                            started__lt=timezone.now() - timedelta(seconds=max_seconds))
+                .update(status=RefreshJobStatus.PENDING, started=None))
+
+
+class RefreshJob(models.Model):
+    kind = enum.EnumField(RefreshJobKind)
+    ally_code = models.IntegerField()
+    status = enum.EnumField(RefreshJobStatus, default=RefreshJobStatus.PENDING)
+    error = models.TextField(blank=True, default='')
+
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True)
+    finished = models.DateTimeField(null=True)
+
+    objects = RefreshJobManager()
+
+    class Meta:
+        index_together = [('status', 'created'), ('kind', 'ally_code')]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['kind', 'ally_code'],
+                condition=Q(status__in=ACTIVE_REFRESH_JOB_STATUSES),
+                name='unique_active_refresh_job'),
+        ]
+
+    def __str__(self):  # pragma: no cover
+        return f'{RefreshJobKind.label(self.kind)} {self.ally_code}'
+
+    @property
+    def is_active(self):
+        return self.status in ACTIVE_REFRESH_JOB_STATUSES
+
+    def run(self):
+        """
+        Run a claimed job, recording its outcome.
+        """
+        try:
+            if self.kind == RefreshJobKind.PLAYER:
+                Player.objects.update_or_create_multiple_from_swgoh([self.ally_code])
+            else:
+                Guild.objects.update_or_create_from_swgoh(self.ally_code)
+        except Exception as exc:  # pylint: disable=broad-except
+            logger.exception('Refresh of %s failed', self)
+            self.status = RefreshJobStatus.FAILED
+            self.error = f'{type(exc).__name__}: {exc}'
+        else:
+            self.status = RefreshJobStatus.DONE
+        self.finished = timezone.now()
+        self.save()
+
+
+class SingleFlightLockManager(models.Manager):
+    def acquire(self, key: str, token: str, timeout: int) -> bool:
+        """
+        Acquire a lock, unless it is held and did not expire. Locks are rows with a unique
+        key, so that only one process can insert them.
+        :param key: key of the lock
+        :param token: identifier of the holder
+        :param timeout: number of seconds after which the lock expires
+        :return: True if the lock was acquired
+        """
+        now = timezone.now()
+        self.filter(key=key, expires__lte=now).delete()
+        try:
+            with transaction.atomic():
+                self.create(key=key, token=token,
+                            expires=now + timedelta(seconds=timeout))
+        except IntegrityError:
+            return False
+        return True
+
+    def holders(self, keys: Collection[str]) -> dict:
+        """
+        :return: dictionary of the tokens holding the unexpired locks of some keys
+        """
+        return dict(self.filter(key__in=list(keys), expires__gt=timezone.now())
+                    .values_list('key', 'token'))
+
+    def release(self, keys: Collection[str], token: str):
+        """
+        Release the locks of some keys which are still held by `token`.
+        """
+        self.filter(key__in=list(keys), token=token).delete()
+
+
+class SingleFlightLock(models.Model):
+    """
+    Lock of an in-flight refresh, see `sqds.single_flight`.
+    """
+    key = models.CharField(max_length=255, unique=True)
+    token = models.CharField(max_length=32)
+    expires = models.DateTimeField()
+
+    objects = SingleFlightLockManager()
+
+
+class ServiceState(models.Model):
+    """
+    State of the rate limiter or circuit breaker of an external service, shared by all
+    processes. See `swgoh.locked_service_state()`.
+    """
+    name = models.CharField(max_length=255, unique=True)
+
+    # TokenBucket
+    tokens = models.FloatField(null=True)
+    tokens_updated = models.FloatField(null=True)
+
+    # CircuitBreaker (times are timestamps)
+    failures = models.IntegerField(default=0)
+    open_until = models.FloatField(null=True)
+    trial_until = models.FloatField(null=True)
+
+
+##########################################################################################
+## PAYLOAD ARCHIVE                                                                      ##
+##########################################################################################
+# Raw swgoh.help payloads are archived as gzipped JSON files named after the SHA-256 of
+# their content, in the SQDS_ARCHIVE_DIR directory (archiving is disabled if it is None),
+# so that they can be ingested again without network (see the `reingest` management
+# command). Each download is recorded, identical payloads sharing the same file.
+
+
+class ArchivedPayloadKind(enum.Enum):
+    PLAYER = 1
+    GUILD = 2
+
+    labels = {
+        PLAYER: 'Player',
+        GUILD: 'Guild',
+    }
+
+
+class ArchivedPayloadManager(models.Manager):
+    @staticmethod
+    def archive_dir():
+        return getattr(settings, 'SQDS_ARCHIVE_DIR', None)
+
+    def store_many(self, kind: int, items) -> List['ArchivedPayload']:
+        """
+        Archive payloads, unless archiving is disabled.
+        :param kind: an ArchivedPayloadKind value
+        :param items: iterable of (key, payload) tuples, the key being the ally code or
+        guild ID the payload was downloaded for
+        :return: list of ArchivedPayload objects (not fetched from the database)
+        """
+        directory = self.archive_dir()
+        if directory is None:
+            return []
+
+        payloads = []
+        for key, data in items:
+            raw = json.dumps(data, sort_keys=True, separators=(',', ':')).encode()
+            digest = hashlib.sha256(raw).hexdigest()
+            path = ArchivedPayload.payload_path(directory, digest)
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                temp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+                with gzip.open(temp_path, 'wb') as fp:
+                    fp.write(raw)
+                os.replace(temp_path, path)
+            payloads.append(self.model(kind=kind, key=str(key), digest=digest,
+                                       size=len(raw)))
+        self.bulk_create(payloads)
+        return payloads
+
+    def latest(self, kind: int):
+        """
+        :return: queryset of the most recent payload of each key
+        """
+        latest_pk = (self.filter(kind=kind, key=OuterRef('key'))
+                     .order_by('-archived', '-pk')
+                     .values('pk')[:1])
+        return self.filter(kind=kind, pk=Subquery(latest_pk))
+
+
+class ArchivedPayload(models.Model):
+    kind = enum.EnumField(ArchivedPayloadKind)
+    key = models.CharField(max_length=50)
+    digest = models.CharField(max_length=64)
+    size = models.IntegerField()
+    archived = models.DateTimeField(auto_now_add=True)
+
+    objects = ArchivedPayloadManager()
+
+    class Meta:
+        index_together = [('kind', 'key', 'archived')]
+
+    def __str__(self):  # pragma: no cover
+        return f'{ArchivedPayloadKind.label(self.kind)} {self.key} ({self.digest[:8]})'
+
+    @staticmethod
+    def payload_path(directory, digest):
+        return os.path.join(directory, digest[:2], digest[2:4], f'{digest}.json.gz')
+
+    def load(self):
+        """
+        :return: the archived payload
+        """
+        path = self.payload_path(ArchivedPayload.objects.archive_dir(), self.digest)
+        with gzip.open(path, 'rb') as fp:
+            return json.loads(fp.read())
+
+
 # This import needs to be at the end in order to avoid circular import between sqds and
 # sqds_medal's models.
 from sqds_medals.models import Medal
@@ -0,0 +1,178 @@
+"""
+Cache of the expensive parts of pages showing guild data: computed querysets, rendered
+tables and graphs.
+
+Cached values are keyed on versions of the data they depend on: a version per guild,
+changed whenever the data of its players is ingested (see `update_stats()`), and a global
+version, changed whenever game data or medal rules change. Versions are the times at
+which scopes were last invalidated (see `last_invalidated()`). They are stored in the
+cache so that they are shared by all processes, and change once the transaction which
+modified the data is committed. Outdated values are never deleted: they are no longer
+looked up, and expire after SQDS_PAGE_CACHE_TIMEOUT seconds.
+
+The page cache is disabled if SQDS_PAGE_CACHE_TIMEOUT is None.
+"""
+import hashlib
+import time
+from datetime import datetime, timezone
+from typing import Callable, Collection, List
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.utils.functional import cached_property
+
+# Scope of the values depending on game data and medal rules
+GLOBAL = 'global'
+
+_MISSING = object()
+
+
+def timeout():
+    """
+    :return: number of seconds values are cached, or None if the page cache is disabled
+    """
+    return getattr(settings, 'SQDS_PAGE_CACHE_TIMEOUT', None)
+
+
+def guild_scope(guild_id) -> str:
+    """
+    :return: the scope of the values depending on a guild's data
+    """
+    return f'guild:{guild_id}'
+
+
+def _version_key(scope):
+    return f'page_cache_invalidated:{scope}'
+
+
+def invalidate(scopes: Collection[str]):
+    """
+    Change the versions of some scopes once the current transaction is committed, so
+    that the values cached for them are no longer used.
+    :param scopes: e.g. `GLOBAL` or `guild_scope(guild.pk)`
+    """
+    keys = [_version_key(scope) for scope in scopes]
+    if keys:
+        transaction.on_commit(lambda: cache.set_many(
+            {key: time.time() for key in keys}, None))
+
+
+def invalidate_guilds(guild_ids: Collection[int]):
+    """
+    Invalidate the values cached for some guilds, see `invalidate()`.
+    :param guild_ids: primary keys of the guilds
+    """
+    invalidate([guild_scope(guild_id) for guild_id in guild_ids if guild_id is not None])
+
+
+def versions(scopes: Collection[str]) -> List[float]:
+    """
+    :return: the current versions of some scopes
+    """
+    keys = [_version_key(scope) for scope in scopes]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            # Never seen or evicted: start a new version, unless another process did
+            version = time.time()
+            found[key] = version if cache.add(key, version, None) else cache.get(key)
+    return [found[key] for key in keys]
+
+
+def last_invalidated(scopes: Collection[str]) -> datetime:
+    """
+    :return: the last time one of the scopes was invalidated (or, if it is not known,
+    first looked up)
+    """
+    return datetime.fromtimestamp(max(versions(scopes)), timezone.utc)
+
+
+def make_key(name: str, scopes: Collection[str], *vary_on) -> str:
+    """
+    Build the key of a cached value, which changes whenever one of the scopes is
+    invalidated.
+    :param name: name of the value (e.g. view and part of the page)
+    :param scopes: scopes the value depends on
+    :param vary_on: other values the cached value depends on (e.g. the request path)
+    :return: the cache key
+    """
+    parts = [name, *map(repr, versions(scopes)), *map(str, vary_on)]
+    return f'page_cache:{name}:{hashlib.md5(chr(0).join(parts).encode()).hexdigest()}'
+
+
+def get_or_set(key: str, compute: Callable[[], object]):
+    """
+    Return the value cached under `key`, computing and caching it if missing.
+    :param key: see `make_key()`
+    :param compute: function computing the value
+    """
+    if timeout() is None:
+        return compute()
+    value = cache.get(key, _MISSING)
+    if value is _MISSING:
+        value = compute()
+        cache.set(key, value, timeout())
+    return value
+
+
+class CachedCountPaginator(Paginator):
+    """
+    Paginator caching the number of objects, which otherwise costs a query as expensive
+    as the page itself on annotated querysets.
+    """
+
+    def __init__(self, object_list, per_page, count_key, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.count_key = count_key
+
+    @cached_property
+    def count(self):
+        return get_or_set(self.count_key, lambda: super(CachedCountPaginator, self).count)
+
+
+class PageCacheMixin:
+    """
+    Cache the table of a `SingleTableMixin` view and its number of rows, for each
+    request path (which includes filters, ordering and page). The rendered table is
+    cached by the 'sqds/cached_table.html' template.
+    """
+    page_cache_scopes = [GLOBAL]
+
+    def get_page_cache_scopes(self) -> List[str]:
+        return list(self.page_cache_scopes)
+
+    def get_page_cache_vary_on(self) -> list:
+        return [self.request.get_full_path()]
+
+    def get_page_cache_key(self, name: str) -> str:
+        return make_key(f'{type(self).__name__}.{name}', self.get_page_cache_scopes(),
+                        *self.get_page_cache_vary_on())
+
+    def get_table_pagination(self, table):
+        paginate = super().get_table_pagination(table)
+        if paginate and timeout() is not None:
+            paginate = dict(paginate if isinstance(paginate, dict) else {},
+                            paginator_class=CachedCountPaginator,
+                            count_key=self.get_page_cache_key('count'))
+        return paginate
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        if timeout() is not None:
+            context['page_cache_key'] = self.get_page_cache_key('table')
+            context['page_cache_timeout'] = timeout()
+        return context
+
+
+class GuildPageCacheMixin(PageCacheMixin):
+    """
+    `PageCacheMixin` for views showing the data of `self.guild`.
+    """
+
+    def get_page_cache_scopes(self) -> List[str]:
+        return super().get_page_cache_scopes() + [guild_scope(self.guild.pk)]
+
+    def get_page_cache_vary_on(self) -> list:
+        return [self.guild.last_updated.isoformat()] + super().get_page_cache_vary_on()
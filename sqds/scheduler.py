@@ -0,0 +1,127 @@
+"""
+Scheduling of refreshes across all known guilds and guildless players.
+
+Each scheduler run ranks every guild and guildless player by how outdated its data is
+and how often its page was viewed since the previous runs (page views are counted in
+the cache, and added to the database at the start of each run), then refreshes the best
+ranked ones until the run's budget of player downloads is spent (a guild costs one
+download per member). Data is never refreshed more often than `MIN_REFRESH_INTERVAL`,
+and data older than `MAX_REFRESH_INTERVAL` is refreshed first even if nobody looks at
+it.
+"""
+from collections import namedtuple
+from datetime import timedelta
+from typing import Collection, List
+
+from django.db.models import Count, F, OuterRef, Subquery
+from django.utils import timezone
+
+from .models import Guild, Player
+
+MIN_REFRESH_INTERVAL = timedelta(hours=1)
+MAX_REFRESH_INTERVAL = timedelta(days=1)
+
+# Maximum number of players downloaded per run, to stay within the swgoh.help quota
+PLAYER_BUDGET = 300
+
+RefreshCandidate = namedtuple('RefreshCandidate',
+                              ['model', 'pk', 'ally_code', 'cost', 'priority'])
+
+
+def refresh_priority(last_updated, view_count, now):
+    """
+    :return: a sortable priority (higher first), or None if the data is too recent to
+    be refreshed
+    """
+    age = now - last_updated
+    if age < MIN_REFRESH_INTERVAL:
+        return None
+    overdue = age >= MAX_REFRESH_INTERVAL
+    return overdue, age.total_seconds() / 3600 * (1 + view_count)
+
+
+def refresh_candidates(now=None) -> List[RefreshCandidate]:
+    """
+    List the guilds and guildless players which may be refreshed.
+    :param now: (optional) reference time, defaults to now
+    :return: list of candidates, by decreasing priority
+    """
+    now = now or timezone.now()
+    candidates = []
+
+    # Guilds are refreshed through the ally code of one of their members
+    guilds = (Guild.objects
+              .annotate(member_count=Count('player_set'),
+                        ally_code=Subquery(Player.objects
+                                           .filter(guild=OuterRef('pk'))
+                                           .order_by('pk')
+                                           .values('ally_code')[:1]))
+              .filter(member_count__gt=0)
+              .values_list('pk', 'ally_code', 'member_count', 'last_updated',
+                           'view_count'))
+    for pk, ally_code, member_count, last_updated, view_count in guilds:
+        priority = refresh_priority(last_updated, view_count, now)
+        if priority is not None:
+            candidates.append(RefreshCandidate(Guild, pk, ally_code, member_count,
+                                               priority))
+
+    players = (Player.objects
+               .filter(guild=None)
+               .values_list('pk', 'ally_code', 'last_updated', 'view_count'))
+    for pk, ally_code, last_updated, view_count in players:
+        priority = refresh_priority(last_updated, view_count, now)
+        if priority is not None:
+            candidates.append(RefreshCandidate(Player, pk, ally_code, 1, priority))
+
+    return sorted(candidates, key=lambda c: c.priority, reverse=True)
+
+
+def plan_refreshes(candidates: List[RefreshCandidate],
+                   budget: int = PLAYER_BUDGET) -> List[RefreshCandidate]:
+    """
+    Select candidates by priority, skipping those which do not fit in the remaining
+    budget.
+    :param candidates: candidates by decreasing priority
+    :param budget: (optional) maximum number of player downloads
+    :return: the selected candidates
+    """
+    selected = []
+    for candidate in candidates:
+        if candidate.cost <= budget:
+            selected.append(candidate)
+            budget -= candidate.cost
+    return selected
+
+
+def refresh_guilds(ally_codes: Collection[int]):
+    """
+    Import guilds concurrently. Imports of guilds which are already being imported are
+    coalesced, and players whose GP did not change are not downloaded (see
+    `GuildManager.update_or_create_multiple_from_swgoh()`).
+    :param ally_codes: one ally code per guild
+    """
+    Guild.objects.update_or_create_multiple_from_swgoh(ally_codes, use_copy=True,
+                                                       only_changed_gp=True)
+
+
+def run(budget: int = PLAYER_BUDGET) -> List[RefreshCandidate]:
+    """
+    Refresh the best ranked guilds and guildless players, then halve view counts so
+    that popularity reflects recent views.
+    :param budget: (optional) maximum number of player downloads
+    :return: the refreshed candidates
+    """
+    Guild.flush_view_counts()
+    Player.flush_view_counts()
+    selected = plan_refreshes(refresh_candidates(), budget)
+
+    guild_ally_codes = [c.ally_code for c in selected if c.model is Guild]
+    if guild_ally_codes:
+        refresh_guilds(guild_ally_codes)
+    player_ally_codes = [c.ally_code for c in selected if c.model is Player]
+    if player_ally_codes:
+        Player.objects.update_or_create_multiple_from_swgoh(player_ally_codes)
+
+    Guild.objects.filter(view_count__gt=0).update(view_count=F('view_count') / 2)
+    Player.objects.filter(view_count__gt=0).update(view_count=F('view_count') / 2)
+    return selected
@@ -0,0 +1,115 @@
+"""
+Request coalescing: concurrent callers refreshing the same object (e.g. a player) wait for
+the refresh already in flight and share its result, instead of downloading and writing
+the object again. In-flight refreshes are tracked with locks stored in database (see
+`SingleFlightLock`), so callers are coalesced across processes. Results are shared
+through the Django cache, and callers only wait for them if the cache backend is shared.
+
+Results are shared as soon as the refresh function returns. It must therefore commit its
+own writes, and coalesced refreshes should not be started inside a transaction.
+"""
+import time
+import uuid
+from typing import Callable, Collection, Dict, Hashable
+
+from django.core.cache import cache
+
+# Upper bound of a refresh duration, after which its lock expires
+LOCK_TIMEOUT = 600
+
+# How long results are kept for waiting callers
+RESULT_TIMEOUT = 60
+
+POLL_INTERVAL = .2
+
+_MISSING = object()
+
+
+def _lock_key(namespace, key):
+    return f'{namespace}:{key}'
+
+
+def _result_key(namespace, key, token):
+    return f'single_flight:{namespace}:{key}:{token}'
+
+
+def single_flight_many(namespace: str, keys: Collection[Hashable],
+                       refresh: Callable[[list], Dict], wait_timeout=LOCK_TIMEOUT):
+    """
+    Refresh multiple objects, unless they are already being refreshed.
+    :param namespace: kind of objects (e.g. 'player')
+    :param keys: keys of the objects to refresh (e.g. ally codes)
+    :param refresh: function refreshing the objects of a list of keys, and returning a
+    dictionary of results keyed by key. Keys without results may be omitted.
+    :param wait_timeout: (optional) maximum time in seconds to wait for other refreshes,
+    after which the objects are refreshed again
+    :return: dictionary of results keyed by key, for the keys which have a result
+    """
+    from .models import SingleFlightLock
+
+    keys = list(dict.fromkeys(keys))
+    token = uuid.uuid4().hex
+    owned = [key for key in keys
+             if SingleFlightLock.objects.acquire(_lock_key(namespace, key), token,
+                                                 LOCK_TIMEOUT)]
+    holders = SingleFlightLock.objects.holders(
+        [_lock_key(namespace, key) for key in keys if key not in owned])
+    in_flight = {key: holders.get(_lock_key(namespace, key))
+                 for key in keys if key not in owned}
+
+    results = {}
+    if owned:
+        results.update(_refresh(namespace, owned, refresh, token))
+
+    # Wait for the other refreshes to complete and collect their results. Objects whose
+    # refresh failed, timed out or whose result expired are refreshed again.
+    retry = []
+    deadline = time.monotonic() + wait_timeout
+    while in_flight:
+        holders = SingleFlightLock.objects.holders(
+            [_lock_key(namespace, key) for key in in_flight])
+        for key, other_token in list(in_flight.items()):
+            if (other_token is not None
+                    and holders.get(_lock_key(namespace, key)) == other_token
+                    and time.monotonic() < deadline):
+                continue
+            del in_flight[key]
+            result = cache.get(_result_key(namespace, key, other_token), _MISSING)
+            if other_token is None or result is _MISSING:
+                retry.append(key)
+            elif result is not None:
+                results[key] = result
+        if in_flight:
+            time.sleep(POLL_INTERVAL)
+
+    if retry:
+        results.update(refresh(retry))
+    return results
+
+
+def single_flight(namespace: str, key: Hashable, refresh: Callable[[], object],
+                  wait_timeout=LOCK_TIMEOUT):
+    """
+    Refresh an object, unless it is already being refreshed. See `single_flight_many()`.
+    :param namespace: kind of object (e.g. 'guild')
+    :param key: key of the object
+    :param refresh: function refreshing the object and returning a result
+    :param wait_timeout: (optional) maximum time in seconds to wait for another refresh
+    :return: the result of the refresh
+    """
+    return single_flight_many(namespace, [key], lambda keys: {key: refresh()},
+                              wait_timeout).get(key)
+
+
+def _refresh(namespace, keys, refresh, token):
+    from .models import SingleFlightLock
+
+    try:
+        results = refresh(keys)
+        cache.set_many({_result_key(namespace, key, token): results.get(key)
+                        for key in keys}, RESULT_TIMEOUT)
+    finally:
+        # Only releases locks which were not acquired by others after expiring
+        SingleFlightLock.objects.release([_lock_key(namespace, key) for key in keys],
+                                         token)
+    return results
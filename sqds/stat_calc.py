@@ -0,0 +1,300 @@
+"""
+Local computation of the mod stats of units, to limit calls to the remote stat
+calculation service (see `Swgoh.calculate_stats()`).
+
+A character's final stats are its base stats plus the stats given by its mods. The game
+data tables base stats are derived from (unit growth, gear and relic tables) are not
+available, so base stats are not computed: they only depend on the character's
+progression (rarity, level, gear tier, equipped gear pieces and relic tier), and are
+learned from the remote service. Each time it computes the stats of a character, the
+base stats of its progression are stored in database (see `StatCalcData`). Mod stats are
+then computed locally, for all characters of a batch at once, from the base stats, the
+stats of the equipped gear pieces and the mods themselves. Characters whose progression
+was never seen are sent to the remote service.
+"""
+import json
+from typing import Callable, List
+
+import numpy as np
+
+BASE_STATS_KEY_PREFIX = 'base'
+GEAR_STATS_KEY = 'gear'
+
+# Stats of the 'final' and 'mods' dictionaries, in the order of the stat arrays
+STAT_NAMES = [
+    'Health', 'Strength', 'Agility', 'Tactics', 'Speed', 'Physical Damage',
+    'Special Damage', 'Armor', 'Resistance', 'Armor Penetration',
+    'Resistance Penetration', 'Physical Critical Chance', 'Special Critical Chance',
+    'Critical Damage', 'Potency', 'Tenacity', 'Health Steal', 'Protection',
+    'Critical Avoidance', 'Accuracy',
+]
+STAT_INDEX = {name: i for i, name in enumerate(STAT_NAMES)}
+
+# Gear stats which mod percentages do not apply to, by game stat ID. Gear values are
+# scaled by 1e4 in game data.
+GEAR_STAT_IDS = {
+    'Health': 1,
+    'Speed': 5,
+    'Physical Damage': 6,
+    'Special Damage': 7,
+    'Armor': 8,
+    'Resistance': 9,
+}
+GEAR_STAT_INDEX = {name: i for i, name in enumerate(GEAR_STAT_IDS)}
+GEAR_STAT_SCALE = 1e4
+
+# Mod stats by game stat ID (see `sqds.models.MOD_STAT_MAP`), plus a pseudo-stat for
+# the speed set bonus, which is a percentage of base speed
+SPEED_PERCENT = 0
+MOD_STAT_IDS = [SPEED_PERCENT, 1, 5, 16, 17, 18, 28, 41, 42, 48, 49, 52, 53, 54, 55, 56]
+MOD_STAT_INDEX = {stat_id: i for i, stat_id in enumerate(MOD_STAT_IDS)}
+
+# Mod set bonuses: (stat ID, number of mods per set, bonus in %). The bonus is applied
+# twice for sets whose mods are all at max level.
+MOD_SET_BONUSES = {
+    1: (55, 2, 5.),
+    2: (48, 4, 7.5),
+    3: (49, 2, 12.5),
+    4: (SPEED_PERCENT, 4, 5.),
+    5: (53, 2, 4.),
+    6: (16, 4, 15.),
+    7: (17, 2, 7.5),
+    8: (18, 2, 10.),
+}
+MOD_MAX_LEVEL = 15
+
+# Armor and resistance ratings R give a percentage of R / (R + ARMOR_SCALE * level)
+ARMOR_SCALE = 7.5
+
+
+class StatCalcError(Exception):
+    """
+    Raised when the stats of some characters cannot be computed.
+    """
+    pass
+
+
+def is_character(unit_data):
+    return unit_data['combatType'] == 1
+
+
+def progression_key(unit_data):
+    """
+    Key of a character's base stats.
+    :param unit_data: a roster item of swgoh.help's player data
+    :return: the key
+    """
+    equipped = ','.join(sorted(gear_data['equipmentId']
+                               for gear_data in unit_data['equipped']))
+    relic_tier = (unit_data.get('relic') or {}).get('currentTier', 0)
+    return (f"{BASE_STATS_KEY_PREFIX}:{unit_data['defId']}:{unit_data['rarity']}:"
+            f"{unit_data['level']}:{unit_data['gear']}:{equipped}:{relic_tier}")
+
+
+def load(keys):
+    """
+    :return: dictionary of the stored data of some keys
+    """
+    from .models import StatCalcData
+    return {key: json.loads(data) for key, data in
+            StatCalcData.objects.filter(key__in=list(keys)).values_list('key', 'data')}
+
+
+def store(data, update=False):
+    """
+    Store data used by the local stat calculator.
+    :param data: dictionary of JSON serializable data
+    :param update: (optional) if False, data already stored is kept
+    """
+    from .models import StatCalcData
+    if update:
+        StatCalcData.objects.filter(key__in=list(data)).delete()
+    StatCalcData.objects.bulk_create(
+        [StatCalcData(key=key, data=json.dumps(value)) for key, value in data.items()],
+        batch_size=500, ignore_conflicts=True)
+
+
+def store_gear_stats(gear_data_list):
+    """
+    Store the gear stats used by mod stat computation.
+    :param gear_data_list: gear data, as returned by `Swgoh.get_gear_list()`
+    """
+    gear_stats = {}
+    for gear_data in gear_data_list:
+        stats = [0.] * len(GEAR_STAT_IDS)
+        for stat in gear_data.get('equipmentStat', {}).get('statList', []):
+            for name, stat_id in GEAR_STAT_IDS.items():
+                if stat['unitStatId'] == stat_id:
+                    stats[GEAR_STAT_INDEX[name]] += (stat['statValueDecimal']
+                                                     / GEAR_STAT_SCALE)
+        gear_stats[gear_data['id']] = stats
+    store({GEAR_STATS_KEY: gear_stats}, update=True)
+
+
+def learn_base_stats(player_data_list):
+    """
+    Store the base stats of all characters of players whose stats were computed.
+    :param player_data_list: player data with stats
+    """
+    base_stats = {}
+    for player_data in player_data_list:
+        for unit_data in filter(is_character, player_data['roster']):
+            if 'stats' not in unit_data:
+                continue
+            final, mods = unit_data['stats']['final'], unit_data['stats']['mods']
+            base_stats[progression_key(unit_data)] = {
+                name: value - mods.get(name, 0) for name, value in final.items()}
+    store(base_stats)
+
+
+def compute_mod_stats(units_data, base, gear):
+    """
+    Compute the stats given by mods to characters.
+    :param units_data: list of N roster items
+    :param base: N x len(STAT_NAMES) array of the characters' base stats
+    :param gear: N x len(GEAR_STAT_IDS) array of the stats of the characters' equipped
+    gear pieces
+    :return: N x len(STAT_NAMES) array of mod stats
+    """
+    unit_count = len(units_data)
+
+    # Sum the mod stats and count the mods (at max level or not) of each set
+    rows, columns, values = [], [], []
+    set_counts = np.zeros((unit_count, len(MOD_SET_BONUSES) + 1), dtype=int)
+    max_level_set_counts = np.zeros_like(set_counts)
+    for row, unit_data in enumerate(units_data):
+        for mod_data in unit_data['mods']:
+            for stat in [mod_data['primaryStat'], *mod_data['secondaryStat']]:
+                rows.append(row)
+                columns.append(MOD_STAT_INDEX[stat['unitStat']])
+                values.append(stat['value'])
+            set_counts[row, mod_data['set']] += 1
+            if mod_data['level'] == MOD_MAX_LEVEL:
+                max_level_set_counts[row, mod_data['set']] += 1
+
+    totals = np.zeros((unit_count, len(MOD_STAT_IDS)))
+    np.add.at(totals, (rows, columns), values)
+    for set_id, (stat_id, size, bonus) in MOD_SET_BONUSES.items():
+        totals[:, MOD_STAT_INDEX[stat_id]] += bonus * (
+                set_counts[:, set_id] // size + max_level_set_counts[:, set_id] // size)
+
+    def mod(stat_id):
+        return totals[:, MOD_STAT_INDEX[stat_id]]
+
+    def percent(stat_id):
+        return mod(stat_id) / 100
+
+    def base_without_gear(name):
+        # Mod percentages apply to base stats without the equipped gear pieces
+        return base[:, STAT_INDEX[name]] - gear[:, GEAR_STAT_INDEX[name]]
+
+    stats = np.zeros((unit_count, len(STAT_NAMES)))
+
+    def set_stat(name, value):
+        stats[:, STAT_INDEX[name]] = value
+
+    set_stat('Health', np.floor(mod(1) + percent(55) * base_without_gear('Health')))
+    set_stat('Protection',
+             np.floor(mod(28) + percent(56) * base[:, STAT_INDEX['Protection']]))
+    set_stat('Speed',
+             np.floor(mod(5) + percent(SPEED_PERCENT) * base_without_gear('Speed')))
+    for name in ['Physical Damage', 'Special Damage']:
+        set_stat(name, np.floor(mod(41) + percent(48) * base_without_gear(name)))
+
+    # Defense applies to armor and resistance ratings
+    scale = ARMOR_SCALE * np.array([unit_data['level'] for unit_data in units_data])
+    for name in ['Armor', 'Resistance']:
+        base_percent = base[:, STAT_INDEX[name]]
+        rating = np.round(scale * base_percent / (1 - base_percent))
+        rating_without_gear = rating - gear[:, GEAR_STAT_INDEX[name]]
+        rating += np.floor(mod(42) + percent(49) * rating_without_gear)
+        set_stat(name, rating / (rating + scale) - base_percent)
+
+    set_stat('Physical Critical Chance', percent(53))
+    set_stat('Special Critical Chance', percent(53))
+    set_stat('Critical Damage', percent(16))
+    set_stat('Potency', percent(17))
+    set_stat('Tenacity', percent(18))
+    set_stat('Critical Avoidance', percent(54))
+    set_stat('Accuracy', percent(52))
+    return stats
+
+
+def calculate_stats(player_data_list, remote: Callable[[List], List] = None):
+    """
+    Add stats to player data, like the remote stat calculation service. Only characters
+    get stats.
+    :param player_data_list: player data as returned by swgoh.help
+    :param remote: (optional) function computing stats remotely (e.g.
+    `Swgoh.calculate_stats()`), used for players with characters whose progression was
+    never seen
+    :return: the player data with stats, or None if the remote computation returned None
+    :raise StatCalcError: if the stats of some characters could not be computed
+    """
+    keys = {progression_key(unit_data)
+            for player_data in player_data_list
+            for unit_data in filter(is_character, player_data['roster'])}
+    base_stats = load([GEAR_STATS_KEY, *keys])
+    gear_stats = base_stats.pop(GEAR_STATS_KEY, {})
+
+    def is_known(unit_data):
+        return (progression_key(unit_data) in base_stats
+                and all(gear_data['equipmentId'] in gear_stats
+                        for gear_data in unit_data['equipped']))
+
+    # Have the unknown characters computed remotely, and learn their base stats
+    unknown = [{**player_data,
+                'roster': [unit_data for unit_data in player_data['roster']
+                           if is_character(unit_data) and not is_known(unit_data)]}
+               for player_data in player_data_list]
+    unknown = [player_data for player_data in unknown if player_data['roster']]
+    remote_stats = {}
+    if unknown and remote is not None:
+        remote_data = remote(unknown)
+        if remote_data is None:
+            return None
+        learn_base_stats(remote_data)
+        remote_stats = {unit_data['id']: unit_data['stats']
+                        for player_data in remote_data
+                        for unit_data in player_data['roster'] if 'stats' in unit_data}
+
+    # Compute mod stats of all known characters at once
+    units_data = [unit_data
+                  for player_data in player_data_list
+                  for unit_data in filter(is_character, player_data['roster'])
+                  if is_known(unit_data)]
+    base = np.zeros((len(units_data), len(STAT_NAMES)))
+    gear = np.zeros((len(units_data), len(GEAR_STAT_IDS)))
+    for row, unit_data in enumerate(units_data):
+        for name, value in base_stats[progression_key(unit_data)].items():
+            base[row, STAT_INDEX[name]] = value
+        for gear_data in unit_data['equipped']:
+            gear[row] += gear_stats[gear_data['equipmentId']]
+    mod_stats = compute_mod_stats(units_data, base, gear)
+
+    local_stats = {}
+    for row, unit_data in enumerate(units_data):
+        unit_base = base_stats[progression_key(unit_data)]
+        mods = {name: mod_stats[row, i].item() for i, name in enumerate(STAT_NAMES)
+                if mod_stats[row, i] != 0}
+        final = {name: unit_base.get(name, 0) + mods.get(name, 0)
+                 for name in STAT_NAMES if name in unit_base or name in mods}
+        local_stats[unit_data['id']] = {'final': final, 'mods': mods}
+
+    result = []
+    for player_data in player_data_list:
+        roster = []
+        missing = []
+        for unit_data in player_data['roster']:
+            stats = local_stats.get(unit_data['id']) or remote_stats.get(unit_data['id'])
+            if stats:
+                roster.append({**unit_data, 'stats': stats})
+            elif is_character(unit_data):
+                missing.append(unit_data['defId'])
+            else:
+                roster.append(unit_data)
+        if missing:
+            raise StatCalcError(f"Stats of player {player_data['allyCode']}'s characters "
+                                f"{', '.join(missing)} could not be computed")
+        result.append({**player_data, 'roster': roster})
+    return result
@@ -1,12 +1,156 @@
+import asyncio
+import codecs
+import collections
+import contextlib
+import functools
+import hashlib
+import json
 import math
+import re
 import queue
+import threading
 import time
 from concurrent import futures
 from typing import Collection
+from urllib.parse import urlsplit
 
 import requests
+from requests.adapters import HTTPAdapter
 
+from django.conf import settings
 from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models import F, Q, Value
+from django.db.models.functions import Least
+
+from . import stat_calc
+
+
+_WHITESPACE = re.compile(r'\s*')
+
+
+class _JsonValueScanner:
+    """
+    Find where a JSON value ends, keeping track of strings and of the nesting depth of
+    arrays and objects. Scans resume where the previous one stopped, so that each
+    character of a value is scanned once however it is split into chunks.
+    """
+    _SPECIAL = re.compile(r'[\[\]{}"]')
+    _STRING_SPECIAL = re.compile(r'[\\"]')
+    _SCALAR_END = re.compile(r'[\s,\]}]')
+
+    def __init__(self):
+        self.offset = 0
+        self.depth = 0
+        self.in_string = False
+
+    def _done(self, end):
+        self.offset = self.depth = 0
+        self.in_string = False
+        return end
+
+    def scan(self, buffer, start):
+        """
+        :param buffer: text containing the value
+        :param start: index of the value's first character in the buffer (scans of a
+        value resume at the same distance from its first character)
+        :return: index of the buffer following the value, or None if the buffer ends
+        before the value
+        """
+        if buffer[start] not in '[{"':
+            # Numbers and literals end with the first delimiter
+            match = self._SCALAR_END.search(buffer, start)
+            return None if match is None else match.start()
+
+        pos = start + self.offset
+        while True:
+            if self.in_string:
+                match = self._STRING_SPECIAL.search(buffer, pos)
+                if match is None:
+                    pos = len(buffer)
+                    break
+                if match.group() == '\\':
+                    if match.end() == len(buffer):
+                        # the escaped character is in the next chunk
+                        pos = match.start()
+                        break
+                    pos = match.end() + 1
+                    continue
+                self.in_string = False
+                pos = match.end()
+                if self.depth == 0:
+                    return self._done(pos)
+            else:
+                match = self._SPECIAL.search(buffer, pos)
+                if match is None:
+                    pos = len(buffer)
+                    break
+                char, pos = match.group(), match.end()
+                if char == '"':
+                    self.in_string = True
+                elif char in '[{':
+                    self.depth += 1
+                else:
+                    self.depth -= 1
+                    if self.depth <= 0:
+                        return self._done(pos)
+        self.offset = pos - start
+        return None
+
+
+def iter_json_array(chunks):
+    """
+    Parse a JSON array incrementally, yielding each item as soon as it is complete.
+    Items are only decoded once their end was found (see `_JsonValueScanner`), so that
+    parsing is linear in the size of the document.
+    :param chunks: iterable of text chunks of the JSON document
+    :return: generator of the array's items
+    """
+    decoder = json.JSONDecoder()
+    scanner = _JsonValueScanner()
+    chunks = iter(chunks)
+    buffer = ''
+    pos = 0
+    expected = '['
+
+    def read_more():
+        nonlocal buffer, pos
+        chunk = next(chunks, None)
+        if chunk is None:
+            return False
+        buffer = buffer[pos:] + chunk
+        pos = 0
+        return True
+
+    while True:
+        pos = _WHITESPACE.match(buffer, pos).end()
+        if pos == len(buffer):
+            if read_more():
+                continue
+            raise ValueError('Unexpected end of JSON array')
+
+        char = buffer[pos]
+        if expected == '[':
+            if char != '[':
+                raise ValueError(f'Expected JSON array, got {char!r}')
+            pos += 1
+            expected = 'first item'
+        elif char == ']' and expected != 'item':
+            return
+        elif expected == 'separator':
+            if char != ',':
+                raise ValueError(f'Expected "," or "]" in JSON array, got {char!r}')
+            pos += 1
+            expected = 'item'
+        else:
+            if scanner.scan(buffer, pos) is None:
+                # incomplete item
+                if read_more():
+                    continue
+                raise ValueError('Unexpected end of JSON array')
+            item, pos = decoder.raw_decode(buffer, pos)
+            yield item
+            expected = 'separator'
 
 
 class SwgohError(Exception):
@@ -38,6 +182,240 @@ class BatchError(SwgohError):
     pass
 
 
+class RateLimitError(ApiError):
+    """Raised if no API call could be made within the rate limit for too long."""
+    pass
+
+
+class CircuitOpenError(ApiError):
+    """Raised instead of calling a service which repeatedly failed."""
+    pass
+
+
+class _DownloadCancelled(Exception):
+    """Raised in the download thread when the consumer of a batch download is gone."""
+    pass
+
+
+BatchRecord = collections.namedtuple('BatchRecord', ['size', 'duration', 'success'])
+
+
+class AimdController:
+    """
+    Additive increase, multiplicative decrease (AIMD) control of the batch size and
+    worker count of a batch download. Both grow by one after each successful batch and
+    are halved after a failed batch or a latency spike, i.e. a batch whose latency per
+    player exceeds LATENCY_SPIKE_FACTOR times the running average.
+    """
+    LATENCY_SPIKE_FACTOR = 2.
+    LATENCY_SMOOTHING = .3
+
+    def __init__(self, batch_size, worker_count, max_batch_size, max_worker_count):
+        self.batch_size = batch_size
+        self.worker_count = worker_count
+        self.max_batch_size = max(max_batch_size, batch_size)
+        self.max_worker_count = max(max_worker_count, worker_count)
+
+        # Running average of the latency per player, in seconds
+        self.latency = None
+
+        # All batches downloaded so far, and wall-clock time from the start of the
+        # download to the last completed batch
+        self.history = []
+        self.started = time.monotonic()
+        self.elapsed = 0.
+
+    def _record(self, size, duration, success):
+        self.history.append(BatchRecord(size, duration, success))
+        self.elapsed = time.monotonic() - self.started
+
+    def record_success(self, size, duration):
+        self._record(size, duration, True)
+        latency = duration / size
+        spike = (self.latency is not None
+                 and latency > self.LATENCY_SPIKE_FACTOR * self.latency)
+        if spike:
+            self._decrease()
+        else:
+            self.batch_size = min(self.batch_size + 1, self.max_batch_size)
+            self.worker_count = min(self.worker_count + 1, self.max_worker_count)
+
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += self.LATENCY_SMOOTHING * (latency - self.latency)
+
+    def record_error(self, size, duration):
+        self._record(size, duration, False)
+        self._decrease()
+
+    def _decrease(self):
+        self.batch_size = math.ceil(self.batch_size / 2)
+        self.worker_count = math.ceil(self.worker_count / 2)
+
+    @property
+    def throughput(self):
+        """
+        Number of players downloaded per second of batch download. Batches are
+        downloaded concurrently, so this is relative to wall-clock time rather than to
+        the sum of the batch durations.
+        """
+        size = sum(record.size for record in self.history if record.success)
+        return size / self.elapsed if self.elapsed > 0 else 0.
+
+
+@contextlib.contextmanager
+def locked_service_state(name):
+    """
+    Lock the state of a service (see `ServiceState`) until the end of the current
+    transaction. API calls should therefore not be made within transactions, which
+    would serialize the calls of all processes. Only changes of state which depend on
+    the current one are made with the state locked, e.g. failures.
+    :param name: name of the state
+    :return: context manager yielding the ServiceState object, which is saved on exit
+    """
+    from .models import ServiceState
+
+    with transaction.atomic():
+        ServiceState.objects.get_or_create(name=name)
+        state = ServiceState.objects.select_for_update().get(name=name)
+        yield state
+        state.save()
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter. Its state is stored in database, so that all processes
+    calling a service share the same budget: `rate` calls per second, with bursts of up
+    to `capacity` calls. A token is taken with a single conditional UPDATE.
+    """
+
+    def __init__(self, name, rate, capacity):
+        self.key = f'token_bucket:{name}'
+        self.rate = rate
+        self.capacity = capacity
+
+    def _take(self):
+        """
+        Take a token if one is available.
+        :return: 0 if a token was taken, otherwise the number of seconds until one is
+        available
+        """
+        from .models import ServiceState
+
+        now = time.time()
+        elapsed = Value(now, output_field=models.FloatField()) - F('tokens_updated')
+        if (ServiceState.objects
+                .filter(name=self.key, tokens__gte=1 - elapsed * self.rate)
+                .update(tokens=Least(F('tokens') + elapsed * self.rate,
+                                     self.capacity) - 1,
+                        tokens_updated=now)):
+            return 0.
+
+        tokens, tokens_updated = (ServiceState.objects.filter(name=self.key)
+                                  .values_list('tokens', 'tokens_updated')
+                                  .first() or (None, None))
+        if tokens is None:
+            # first call: the bucket starts full
+            ServiceState.objects.get_or_create(name=self.key)
+            ServiceState.objects.filter(name=self.key, tokens=None).update(
+                tokens=self.capacity, tokens_updated=now)
+            return self._take()
+        tokens = min(self.capacity, tokens + (now - tokens_updated) * self.rate)
+        if tokens >= 1:
+            # the bucket changed since the update
+            return self._take()
+        return (1 - tokens) / self.rate
+
+    def acquire(self, timeout):
+        """
+        Wait for a token.
+        :param timeout: maximum wait in seconds, after which RateLimitError is raised
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            wait = self._take()
+            if wait == 0:
+                return
+            if time.monotonic() + wait > deadline:
+                raise RateLimitError(f'Rate limit of {self.key} exceeded for {timeout}s')
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker around a service, whose state is stored in database so that it is
+    shared by all processes. After `failure_threshold` consecutive failures (server
+    errors or network errors), the circuit opens: calls fail immediately with
+    CircuitOpenError. After `reset_timeout` seconds, a single trial call is let through,
+    which closes the circuit if it succeeds or opens it again if it fails.
+
+    The state is read without locking it, and only written when it changes, so that
+    successful calls do not contend for it.
+    """
+
+    def __init__(self, name, failure_threshold, reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.key = f'circuit_breaker:{name}'
+
+    def _state(self):
+        """
+        :return: dictionary of the failure count, `open_until` and `trial_until`, or
+        None if the service never failed
+        """
+        from .models import ServiceState
+
+        return (ServiceState.objects.filter(name=self.key)
+                .values('failures', 'open_until', 'trial_until').first())
+
+    @property
+    def is_open(self):
+        state = self._state()
+        return (state is not None and state['open_until'] is not None
+                and time.time() < state['open_until'])
+
+    def before_call(self):
+        """Raise CircuitOpenError unless the service may be called."""
+        from .models import ServiceState
+
+        state = self._state()
+        if state is None or state['open_until'] is None:
+            return
+        now = time.time()
+        if now < state['open_until']:
+            raise CircuitOpenError(
+                f'{self.name} is unavailable, calls are suspended for '
+                f'{math.ceil(state["open_until"] - now)}s')
+
+        # Only the caller which starts the trial call is let through
+        if (ServiceState.objects
+                .filter(name=self.key, open_until__lte=now)
+                .filter(Q(trial_until=None) | Q(trial_until__lte=now))
+                .update(trial_until=now + self.reset_timeout)):
+            return
+        state = self._state()
+        if state['open_until'] is not None:
+            raise CircuitOpenError(
+                f'{self.name} is unavailable, waiting for a trial call')
+
+    def record_success(self):
+        from .models import ServiceState
+
+        state = self._state()
+        if state is not None and (state['failures'] or state['open_until'] is not None):
+            ServiceState.objects.filter(name=self.key).update(
+                failures=0, open_until=None, trial_until=None)
+
+    def record_failure(self):
+        with locked_service_state(self.key) as state:
+            state.failures += 1
+            if state.failures >= self.failure_threshold or state.open_until is not None:
+                state.open_until = time.time() + self.reset_timeout
+                state.trial_until = None
+
+
 class MultipleGetQueue(queue.Queue):
     def get_n(self, n):
         """
@@ -55,13 +433,96 @@ class MultipleGetQueue(queue.Queue):
 
 
 class Swgoh:
-    # Configuration variable for player batch download
+    # Configuration variable for player batch download. Batch size and worker count
+    # start from the values the download used to run with, and adapt to errors and
+    # latency (see `AimdController`). Calls of all workers stay within the swgoh.help
+    # quota, which the rate limiter enforces.
     INITIAL_BATCH_SIZE = 12
-    MAX_WORKER_COUNT = 2
+    MAX_BATCH_SIZE = 20
+    INITIAL_WORKER_COUNT = 2
+    MAX_WORKER_COUNT = 6
     MAX_ERROR_COUNT = 5
 
-    def __init__(self):
+    # HTTP timeouts in seconds (player data is slow to generate on the server side)
+    CONNECT_TIMEOUT = 10
+    READ_TIMEOUT = 300
+
+    STAT_CALC_URL = "https://swgoh-stat-calc.glitch.me/api/characters"
+
+    # Size of the chunks read from streamed responses
+    STREAM_CHUNK_SIZE = 64 * 1024
+
+    # Calls to swgoh.help per second and burst size, shared by all processes, and
+    # maximum wait for a call in seconds
+    RATE_LIMIT = 2.
+    RATE_LIMIT_BURST = 10
+    RATE_LIMIT_TIMEOUT = 60
+
+    # Consecutive failures after which calls to a service are suspended, and for how
+    # many seconds. Meanwhile, cached responses are served when available, for up to
+    # FALLBACK_TIMEOUT seconds after they were received. Player data is not cached.
+    BREAKER_FAILURE_THRESHOLD = 5
+    BREAKER_RESET_TIMEOUT = 60
+    FALLBACK_TIMEOUT = 24 * 3600
+
+    def __init__(self, pool_maxsize=None, calc_stats=None):
+        """
+        :param pool_maxsize: (optional) maximum number of connections kept alive per
+        host, defaults to MAX_WORKER_COUNT
+        :param calc_stats: (optional) how batch downloads compute unit stats (see
+        `get_player_data()`), defaults to the SQDS_CALC_STATS setting
+        """
         self.base_url = "https://api.swgoh.help"
+        if calc_stats is None:
+            calc_stats = getattr(settings, 'SQDS_CALC_STATS', True)
+        self.calc_stats = calc_stats
+
+        self.rate_limiter = TokenBucket('swgoh.help', self.RATE_LIMIT,
+                                        self.RATE_LIMIT_BURST)
+        self.breakers = {
+            self.base_url: CircuitBreaker('swgoh.help', self.BREAKER_FAILURE_THRESHOLD,
+                                          self.BREAKER_RESET_TIMEOUT),
+            self.STAT_CALC_URL: CircuitBreaker('stat_calc',
+                                               self.BREAKER_FAILURE_THRESHOLD,
+                                               self.BREAKER_RESET_TIMEOUT),
+        }
+
+        # Connections are kept alive and reused across calls, with a pool large enough
+        # for all batch download workers
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=pool_maxsize or self.MAX_WORKER_COUNT)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers['Accept-Encoding'] = 'gzip, deflate'
+
+    @property
+    def timeout(self):
+        return self.CONNECT_TIMEOUT, self.READ_TIMEOUT
+
+    def _post(self, service, url, **kwargs):
+        """
+        POST to a service through its circuit breaker (and the rate limiter for
+        swgoh.help).
+        :param service: base URL of the service (`base_url` or `STAT_CALC_URL`)
+        :param url: URL to POST to
+        :return: the response
+        """
+        breaker = self.breakers[service]
+        breaker.before_call()
+        if service == self.base_url:
+            self.rate_limiter.acquire(self.RATE_LIMIT_TIMEOUT)
+
+        try:
+            response = self.session.post(url=url, timeout=self.timeout, **kwargs)
+        except requests.exceptions.RequestException as exc:
+            breaker.record_failure()
+            raise ApiError(f'Unexpected {type(exc).__name__} while accessing {url}')
+
+        if response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return response
 
     def get_access_token(self):
         access_token = cache.get('access_token')
@@ -88,8 +549,7 @@ class Swgoh:
 
         start_time = time.time()
         url = "%s/auth/signin" % self.base_url
-        response = requests.post(
-            url, data=auth_payload)
+        response = self._post(self.base_url, url, data=auth_payload)
 
         if response.status_code != 200:
             raise AuthenticationError(
@@ -112,7 +572,7 @@ class Swgoh:
     def get_auth_header(self):
         return {'Authorization': 'Bearer %s' % self.get_access_token()}
 
-    def _call_swgoh_help_api(self, endpoint, json, accept_404=False):
+    def _call_swgoh_help_api(self, endpoint, json, accept_404=False, stream=False):
         """
         Call a swgoh.help end-point with json payload and return the response,
         interpreted as json.
@@ -120,16 +580,20 @@ class Swgoh:
         :param json: json POSTed to end-point
         :param accept_404: if True, return None upon 404, otherwise an exception will
         be raised
+        :param stream: if True, the response (a JSON array) is parsed incrementally
+        and a generator of its items is returned (see `iter_json_array()`)
         :return: objects returned by the end-point, interpreted as json
         """
         url = f'{self.base_url}{endpoint}'
+        fallback_key = 'swgoh_fallback:' + hashlib.sha1(
+            f'{endpoint}{json!r}'.encode()).hexdigest()
         try:
-            response = requests.post(
-                url=url,
-                headers=self.get_auth_header(),
-                json=json)
-        except requests.exceptions.RequestException as exc:
-            raise ApiError(f'Unexpected {type(exc).__name__} while accessing {url}')
+            response = self._post(self.base_url, url, headers=self.get_auth_header(),
+                                  json=json, stream=stream)
+        except CircuitOpenError:
+            if stream or fallback_key not in cache:
+                raise
+            return cache.get(fallback_key)
 
         ok = (accept_404 and response.status_code == 404) or response.status_code == 200
         if not ok:
@@ -139,8 +603,29 @@ class Swgoh:
 
         if response.status_code == 404:
             return None
+        elif stream:
+            return self._iter_response_items(response, url)
         else:
-            return response.json()
+            data = response.json()
+            cache.set(fallback_key, data, self.FALLBACK_TIMEOUT)
+            return data
+
+    def _iter_response_items(self, response, url):
+        """
+        Parse a JSON array response incrementally.
+        :return: generator of the array's items
+        """
+        decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')()
+        chunks = (decoder.decode(chunk)
+                  for chunk in response.iter_content(self.STREAM_CHUNK_SIZE))
+        try:
+            yield from iter_json_array(chunks)
+        except requests.exceptions.RequestException as exc:
+            raise ApiError(f'Unexpected {type(exc).__name__} while reading {url}')
+        except ValueError as exc:
+            raise ApiError(f'Invalid JSON returned by {url}: {exc}', response=response)
+        finally:
+            response.close()
 
     def get_unit_list(self):
         return self._call_swgoh_help_api(
@@ -250,6 +735,39 @@ class Swgoh:
             return guild_data[0]
 
     def get_player_data(self, ally_codes, calc_stats=True):
+        """
+        Download player data.
+        :param ally_codes: ally codes of the players
+        :param calc_stats: (optional) True to compute unit stats with the stat
+        calculation service, 'local' to compute them locally (see `sqds.stat_calc`),
+        False to skip stats
+        :return: the player data, or None if swgoh.help returned 404
+        """
+        player_data = self.iter_player_data(ally_codes, calc_stats=False)
+        if player_data is None:
+            return None
+        player_data = list(player_data)
+
+        # Stats are computed for the whole batch at once
+        if calc_stats == 'local':
+            player_data = stat_calc.calculate_stats(player_data,
+                                                    remote=self.calculate_stats)
+        elif calc_stats:
+            player_data = self.calculate_stats(player_data, stream=True)
+            player_data = None if player_data is None else list(player_data)
+        return player_data
+
+    def iter_player_data(self, ally_codes, calc_stats=True):
+        """
+        Download player data, parsing responses incrementally so that players can be
+        processed before the whole response is received. Without stats or with local
+        stats, each player is yielded as soon as it is received. Remote stats require
+        all players to be sent to the stat calculation service, whose response is then
+        parsed incrementally.
+        :param ally_codes: ally codes of the players
+        :param calc_stats: (optional) see `get_player_data()`
+        :return: generator of player data, or None if swgoh.help returned 404
+        """
         player_data = self._call_swgoh_help_api(
             endpoint='/swgoh/players',
             json={
@@ -268,42 +786,69 @@ class Swgoh:
                     "name": True
                 }
             },
-            accept_404=True)
+            accept_404=True,
+            stream=True)
 
         if player_data is None:
             return None
 
-        if calc_stats:
-            # url = "https://crinolo-swgoh.glitch.me/statCalc/api/characters"
-            url = "https://swgoh-stat-calc.glitch.me/api/characters"
-            try:
-                response = requests.post(
-                    url=url,
-                    params={
-                        "flags": "gameStyle",
-                        "language": "eng_us",
-                    },
-                    headers={
-                        "Content-Type": "application/json",
-                    },
-                    json=player_data)
-            except requests.exceptions.RequestException as exc:
-                raise ApiError(f'Unexpected {type(exc).__name__} while accessing {url}')
-
-            if response.status_code == 404:
-                return None
-            if response.status_code != 200:
-                raise ApiError(
-                    f'Unexpected {response.status_code} status code return by {url}',
-                    response=response)
-
-            return response.json()
+        if calc_stats == 'local':
+            return self._iter_local_stats(player_data)
+        elif calc_stats:
+            return self.calculate_stats(list(player_data), stream=True)
         else:
             return player_data
 
+    def _iter_local_stats(self, player_data):
+        for one_player_data in player_data:
+            with_stats = stat_calc.calculate_stats([one_player_data],
+                                                   remote=self.calculate_stats)
+            if with_stats is None:
+                raise ApiError(f'Could not calculate stats of player '
+                               f'{one_player_data["allyCode"]}')
+            yield from with_stats
+
+    def calculate_stats(self, player_data, stream=False):
+        """
+        Add unit stats to player data, using the stat calculation service.
+        :param player_data: player data as returned by swgoh.help
+        :param stream: if True, the response is parsed incrementally and a generator of
+        player data is returned
+        :return: the player data with stats, or None if the service returned 404
+        """
+        # url = "https://crinolo-swgoh.glitch.me/statCalc/api/characters"
+        url = self.STAT_CALC_URL
+        response = self._post(
+            self.STAT_CALC_URL,
+            url,
+            params={
+                "flags": "gameStyle",
+                "language": "eng_us",
+            },
+            headers={
+                "Content-Type": "application/json",
+            },
+            json=player_data,
+            stream=stream)
+
+        if response.status_code == 404:
+            return None
+        if response.status_code != 200:
+            raise ApiError(
+                f'Unexpected {response.status_code} status code return by {url}',
+                response=response)
+
+        if stream:
+            return self._iter_response_items(response, url)
+        return response.json()
+
     def _download_players(self, ally_codes: Collection[int]):
+        """
+        :return: iterable of the players' data, parsed as it is received (see
+        `iter_player_data()`)
+        """
         print(f"Downloading {ally_codes}")
-        return self.get_player_data(ally_codes)
+        return self.iter_player_data(ally_codes, self.calc_stats) or []
 
     def get_player_data_batch(self, ally_code_list: Collection[int]):
         """
@@ -313,87 +858,401 @@ class Swgoh:
         :return: array of player data (the order is arbitrary and may be different from
                  ally code list provided
         """
+        results = []
+        self._download_player_data_batch(ally_code_list, results.append)
+        return results
+
+    def iter_player_data_batch(self, ally_code_list: Collection[int],
+                               max_pending_batches=2):
+        """
+        Download player data like `get_player_data_batch()`, but yield players as soon
+        as they are parsed from the responses, in arrays of up to MAX_BATCH_SIZE players.
+        The download runs in background threads and hands players over through a
+        bounded queue, so that the caller can process them (e.g. write them to the
+        database) while the responses are still being received, and never holds more
+        than a few batches in memory.
+        :param ally_code_list: list of player ally codes to download
+        :param max_pending_batches: number of batches of players which may wait for the
+        caller before the download is paused
+        :return: iterator of arrays of player data
+        """
+        pending = MultipleGetQueue(maxsize=max_pending_batches * self.MAX_BATCH_SIZE)
+        cancelled = threading.Event()
+        end = object()
+
+        def hand_over(item):
+            while not cancelled.is_set():
+                try:
+                    pending.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+            raise _DownloadCancelled()
+
+        def download():
+            try:
+                self._download_player_data_batch(ally_code_list, hand_over)
+            except _DownloadCancelled:
+                return
+            except Exception as exc:  # pylint: disable=broad-except
+                item = exc
+            else:
+                item = end
+
+            try:
+                hand_over(item)
+            except _DownloadCancelled:
+                pass
+
+        thread = threading.Thread(target=download, daemon=True)
+        thread.start()
+        try:
+            while True:
+                player_data_batch = []
+                for item in pending.get_n(self.MAX_BATCH_SIZE):
+                    if item is end:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    player_data_batch.append(item)
+                if player_data_batch:
+                    yield player_data_batch
+                if item is end:
+                    return
+        finally:
+            cancelled.set()
+            thread.join()
+
+    def _download_player_data_batch(self, ally_code_list: Collection[int], on_result):
+        """
+        Download player data for multiple player using a thread pool and adaptable
+        batch size, and pass each player's data to `on_result` as soon as it is parsed.
+        :param ally_code_list: list of player ally codes to download
+        :param on_result: function called with the data of each downloaded player, from
+        the worker threads
+        :return: the AimdController of the download, which recorded each batch's size
+        and latency
+        """
         ## Setup
 
-        # Storage for all player's data
-        results = []
+        # Number of player's data downloaded so far
+        result_count = 0
 
         # Input queue filled with all ally codes to be downloaded
         ally_codes_queue = MultipleGetQueue()
         _ = list(map(ally_codes_queue.put, ally_code_list))
 
-        # Initial batch size. We try to be smart and use all worker available if the list
-        # is small.
+        # Initial batch size. We try to be smart and use all initial workers if the list
+        # is small. For very small batch, we may reduce the initial worker count.
         batch_size = min(self.INITIAL_BATCH_SIZE,
-                         math.ceil(len(ally_code_list) / self.MAX_WORKER_COUNT))
-
-        # Work count. For very small batch, we may reduce the default worker count.
-        worker_count = min(self.MAX_WORKER_COUNT,
+                         math.ceil(len(ally_code_list) / self.INITIAL_WORKER_COUNT))
+        worker_count = min(self.INITIAL_WORKER_COUNT,
                            math.ceil(len(ally_code_list) / batch_size))
 
+        # Batch size and worker count then adapt to errors and latency
+        controller = AimdController(
+            batch_size, worker_count, self.MAX_BATCH_SIZE, self.MAX_WORKER_COUNT)
+
         # Let's keep track of the number of error
         error_count = 0
 
         ## Run
         print(f"Batch download with {worker_count} workers and batches of {batch_size} "
               f"ally codes")
-        with futures.ThreadPoolExecutor(max_workers=worker_count) as executor:
+        with futures.ThreadPoolExecutor(max_workers=self.MAX_WORKER_COUNT) as executor:
 
-            # We keep a map of futures to the corresponding list of ally codes
+            # We keep a map of futures to the corresponding list of ally codes and start
+            # time
             futures_to_ally_codes = {}
+            futures_to_start_time = {}
+            futures_to_delivered = {}
 
-            # First, let's feed all workers with something to download. Thanks to the
-            # smart definition of batch_size and worker_count, we are guaranteed to
-            # have a batch available for every single worker.
-            for _ in range(worker_count):
-                ally_code_batch = ally_codes_queue.get_n(batch_size)
-                futures_to_ally_codes[executor.submit(self._download_players,
-                                                      ally_code_batch)] = ally_code_batch
+            def download(ally_code_batch, delivered):
+                # Hand players over as they are parsed, keeping track of them so that
+                # only the other ones are downloaded again if the download fails
+                player_data_list = self._download_players(ally_code_batch)
+                try:
+                    for player_data in player_data_list:
+                        on_result(player_data)
+                        delivered.append(player_data['allyCode'])
+                finally:
+                    if hasattr(player_data_list, 'close'):
+                        player_data_list.close()
+
+            def schedule():
+                # Feed workers with something to download, up to the current worker count
+                while (not ally_codes_queue.empty()
+                       and len(futures_to_ally_codes) < controller.worker_count):
+                    ally_code_batch = ally_codes_queue.get_n(controller.batch_size)
+                    delivered = []
+                    future = executor.submit(download, ally_code_batch, delivered)
+                    futures_to_ally_codes[future] = ally_code_batch
+                    futures_to_start_time[future] = time.monotonic()
+                    futures_to_delivered[future] = delivered
+
+            schedule()
 
             # We iterate until either we have the same amount of result as initially
             # requested. If the error count exceed the maximum allowed before we
             # complete all download, an exception will be raised
-            while len(results) < len(ally_code_list):
+            while result_count < len(ally_code_list) and futures_to_ally_codes:
 
                 # wait for at least one worker to complete
                 done_list, _ = futures.wait(futures_to_ally_codes,
                                             return_when=futures.FIRST_COMPLETED)
 
                 for done in done_list:
+                    ally_code_batch = futures_to_ally_codes.pop(done)
+                    duration = time.monotonic() - futures_to_start_time.pop(done)
+                    delivered = futures_to_delivered.pop(done)
+                    result_count += len(delivered)
                     try:
                         # This will raise an ApiError if the corresponding futures
                         # failed to download the player data
-                        res = done.result()
+                        done.result()
                     except ApiError as exc:
-                        # We put back the things we needed to get do in the queue
-                        _ = list(map(ally_codes_queue.put, futures_to_ally_codes[done]))
+                        # We put back the players which were not handed over in the
+                        # queue
+                        _ = list(map(ally_codes_queue.put,
+                                     [ally_code for ally_code in ally_code_batch
+                                      if ally_code not in delivered]))
 
                         # We adapt the batch size and increase the error count
-                        if batch_size > 1:
-                            batch_size = math.ceil(batch_size / 2)
+                        controller.record_error(len(ally_code_batch), duration)
                         error_count += 1
                         print(f"Error caught ({str(exc)}), batch size reduced to"
-                              f" {batch_size}")
+                              f" {controller.batch_size} and worker count to "
+                              f"{controller.worker_count}")
                     else:
-                        # Download was successful, keep the results
-                        results.extend(res)
-
-                    # The future is complete and must be deleted from our maps
-                    del futures_to_ally_codes[done]
-
-                    # Since we have freed a worker, we can schedule more download.
-                    # Unless we have too many errors, in which case we throw a BatchError
-                    if not ally_codes_queue.empty():
-                        if error_count <= self.MAX_ERROR_COUNT:
-                            ally_code_batch = ally_codes_queue.get_n(batch_size)
-                            futures_to_ally_codes[
-                                executor.submit(self._download_players,
-                                                ally_code_batch)] = ally_code_batch
-                        else:
-                            raise BatchError(
-                                f'Unexpected number of errors ({error_count}) during '
-                                f'batch player download')
-        return results
+                        controller.record_success(len(ally_code_batch), duration)
+
+                # Since we have freed workers, we can schedule more download. Unless we
+                # have too many errors, in which case we throw a BatchError
+                if error_count > self.MAX_ERROR_COUNT and not ally_codes_queue.empty():
+                    raise BatchError(
+                        f'Unexpected number of errors ({error_count}) during '
+                        f'batch player download')
+                schedule()
+
+        print(f"Batch download complete: {controller.throughput:.1f} players/s")
+        return controller
+
+
+class AsyncSwgoh:
+    """
+    asyncio client for swgoh.help and the stat calculation service, meant to download
+    the data of several guilds concurrently with a single pool of connections and
+    workers.
+
+    No asyncio HTTP library being available, the blocking calls of a `Swgoh` client
+    run in one shared thread pool: this is not asynchronous HTTP, each call in flight
+    occupies a thread. The number of concurrent calls is bounded globally and per host.
+    Cancelling a coroutine cancels the calls it has not started yet.
+    """
+    MAX_CONCURRENCY = 8
+    MAX_CONCURRENCY_PER_HOST = 4
+    BATCH_SIZE = Swgoh.INITIAL_BATCH_SIZE
+
+    def __init__(self, max_concurrency=None, max_concurrency_per_host=None):
+        self.max_concurrency = max_concurrency or self.MAX_CONCURRENCY
+        self.max_concurrency_per_host = (max_concurrency_per_host
+                                         or self.MAX_CONCURRENCY_PER_HOST)
+        self.api = Swgoh(pool_maxsize=self.max_concurrency_per_host)
+        self.executor = futures.ThreadPoolExecutor(max_workers=self.max_concurrency)
+
+        # Semaphores are bound to the running event loop and created on first use
+        self._loop = None
+        self._semaphore = None
+        self._host_semaphores = {}
+
+    def _semaphores(self, host):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._host_semaphores = {}
+        if host not in self._host_semaphores:
+            self._host_semaphores[host] = asyncio.Semaphore(
+                self.max_concurrency_per_host)
+        return self._semaphore, self._host_semaphores[host]
+
+    async def _call(self, url, func, *args):
+        """
+        Run a blocking call of the `Swgoh` client in the thread pool, within the
+        concurrency limits of the call's host.
+        """
+        semaphore, host_semaphore = self._semaphores(urlsplit(url).netloc)
+        # The host's semaphore is acquired first, so that calls waiting for a busy host
+        # do not hold a slot of the global limit which other hosts could use
+        async with host_semaphore, semaphore:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, functools.partial(func, *args))
+
+    async def get_unit_list(self):
+        return await self._call(self.api.base_url, self.api.get_unit_list)
+
+    async def get_skill_list(self):
+        return await self._call(self.api.base_url, self.api.get_skill_list)
+
+    async def get_ability_list(self):
+        return await self._call(self.api.base_url, self.api.get_ability_list)
+
+    async def get_gear_list(self):
+        return await self._call(self.api.base_url, self.api.get_gear_list)
+
+    async def get_category_list(self):
+        return await self._call(self.api.base_url, self.api.get_category_list)
+
+    async def get_guild_list(self, ally_code):
+        return await self._call(self.api.base_url, self.api.get_guild_list, ally_code)
+
+    async def get_player_data(self, ally_codes, calc_stats=True):
+        player_data = await self._call(self.api.base_url, self.api.get_player_data,
+                                       ally_codes, False)
+        if player_data is not None and calc_stats == 'local':
+            player_data = await self._call(self.api.STAT_CALC_URL,
+                                           stat_calc.calculate_stats, player_data,
+                                           self.api.calculate_stats)
+        elif player_data is not None and calc_stats:
+            player_data = await self._call(self.api.STAT_CALC_URL,
+                                           self.api.calculate_stats, player_data)
+        return player_data
+
+    async def get_player_data_batch(self, ally_code_list: Collection[int]):
+        """
+        Download player data for multiple players, in concurrent batches. Batches which
+        fail are split in halves and retried, until more than `Swgoh.MAX_ERROR_COUNT`
+        errors occurred.
+        :param ally_code_list: list of player ally codes to download
+        :return: array of player data (the order is arbitrary)
+        """
+        ally_code_list = list(ally_code_list)
+        errors = []
+        batches = [ally_code_list[i:i + self.BATCH_SIZE]
+                   for i in range(0, len(ally_code_list), self.BATCH_SIZE)]
+        results = await self._gather(*(self._download_players(batch, errors)
+                                       for batch in batches))
+        return [player_data for result in results for player_data in result]
+
+    async def _download_players(self, ally_codes, errors):
+        try:
+            return await self.get_player_data(ally_codes, self.api.calc_stats) or []
+        except ApiError as exc:
+            errors.append(exc)
+            if len(errors) > self.api.MAX_ERROR_COUNT:
+                raise BatchError(f'Unexpected number of errors ({len(errors)}) during '
+                                 f'batch player download')
+
+            half = math.ceil(len(ally_codes) / 2)
+            results = await self._gather(*(self._download_players(batch, errors)
+                                           for batch in (ally_codes[:half],
+                                                         ally_codes[half:]) if batch))
+            return [player_data for result in results for player_data in result]
+
+    async def get_guild_data(self, ally_code=None, guild_data=None,
+                             player_ally_codes=None):
+        """
+        Download a guild and the data of its players.
+        :param ally_code: ally code of one of the guild's players
+        :param guild_data: (optional) the guild data, if already downloaded (e.g. by
+        `get_guild_lists()`), in which case only the players are downloaded
+        :param player_ally_codes: (optional) ally codes of the players to download,
+        defaults to all the guild's players
+        :return: (guild data, array of player data) tuple
+        """
+        if guild_data is None:
+            guild_data = await self.get_guild_list(ally_code)
+        if player_ally_codes is None:
+            player_ally_codes = [p['allyCode'] for p in guild_data['roster']]
+        return guild_data, await self.get_player_data_batch(player_ally_codes)
+
+    def get_guild_lists(self, ally_codes: Collection[int]) -> list:
+        """
+        Synchronous wrapper downloading several guilds (without their players)
+        concurrently.
+        :param ally_codes: one ally code per guild
+        :return: array of guild data (None for the guilds which were not found), in the
+        order of the ally codes
+        """
+        return asyncio.run(self._gather(*(self.get_guild_list(ally_code)
+                                          for ally_code in ally_codes)))
+
+    @staticmethod
+    async def _gather(*coroutines):
+        """
+        Like `asyncio.gather()`, but cancel the remaining coroutines as soon as one of
+        them fails.
+        """
+        tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+        try:
+            return await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def iter_guild_data(self, ally_codes: Collection[int] = (),
+                        guilds: Collection[tuple] = ()):
+        """
+        Synchronous wrapper downloading several guilds concurrently (see
+        `get_guild_data()`) and yielding each of them as soon as it is complete. The
+        event loop runs in a background thread, which is cancelled if the caller stops
+        early.
+        :param ally_codes: one ally code per guild
+        :param guilds: (optional) (guild data, ally codes of the players to download)
+        tuples of guilds which were already downloaded
+        :return: iterator of (guild data, array of player data) tuples
+        """
+        results = queue.Queue()
+        end = object()
+
+        async def download():
+            tasks = [asyncio.ensure_future(self.get_guild_data(ally_code))
+                     for ally_code in ally_codes]
+            tasks += [asyncio.ensure_future(self.get_guild_data(
+                guild_data=guild_data, player_ally_codes=player_ally_codes))
+                for guild_data, player_ally_codes in guilds]
+            try:
+                for future in asyncio.as_completed(tasks):
+                    results.put(await future)
+            except asyncio.CancelledError:
+                pass
+            except Exception as exc:  # pylint: disable=broad-except
+                results.put(exc)
+            else:
+                results.put(end)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+        loop = asyncio.new_event_loop()
+        main_task = loop.create_task(download())
+
+        def run():
+            try:
+                loop.run_until_complete(main_task)
+            except asyncio.CancelledError:
+                # cancelled before it started
+                pass
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = results.get()
+                if item is end:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            loop.call_soon_threadsafe(main_task.cancel)
+            thread.join()
+            loop.close()
+
+    def close(self):
+        """Stop the thread pool, once the calls in flight are complete."""
+        self.executor.shutdown()
 
 
 # pylint: disable=invalid-name
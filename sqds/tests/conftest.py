@@ -3,8 +3,9 @@ import numbers
 import os
 
 import pytest
+from django.core.cache import cache
 
-from sqds.models import update_game_data, Gear, Guild
+from sqds.models import update_game_data, Gear, Guild, GameDataRegistry
 
 
 def data_path(path, *more_path):
@@ -17,6 +18,26 @@ def load_data(path, *more_path):
     return data
 
 
+@pytest.fixture(autouse=True)
+def game_data_registry():
+    """
+    Test transactions are never committed, so the game data registry is never
+    invalidated: drop it before each test instead.
+    """
+    GameDataRegistry.clear()
+
+
+@pytest.fixture(autouse=True)
+def locmem_cache(settings):
+    """
+    Use a cache local to each test, instead of the configured one which may be shared
+    with other runs.
+    """
+    settings.CACHES = {
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+    cache.clear()
+
+
 @pytest.fixture()
 def patched_swgoh(mocker):
     def get_guild_list(ally_code):
@@ -40,6 +61,10 @@ def patched_swgoh(mocker):
             player_data.append(load_data('data', 'player_data', str(ally_code) + '.json'))
         return player_data
 
+    def iter_player_data_batch(ally_codes, **_):
+        for ally_code in ally_codes:
+            yield get_player_data_batch(ally_code)
+
     data = load_data('data', 'game_data.json')
     swgoh_patches = {
         'get_gear_list': mocker.patch('sqds.swgoh.Swgoh.get_gear_list',
@@ -55,7 +80,9 @@ def patched_swgoh(mocker):
         'get_guild_list': mocker.patch('sqds.swgoh.Swgoh.get_guild_list',
                                        side_effect=get_guild_list),
         'get_player_data_batch': mocker.patch('sqds.swgoh.Swgoh.get_player_data_batch',
-                                              side_effect=get_player_data_batch)
+                                              side_effect=get_player_data_batch),
+        'iter_player_data_batch': mocker.patch('sqds.swgoh.Swgoh.iter_player_data_batch',
+                                               side_effect=iter_player_data_batch)
     }
 
     return swgoh_patches
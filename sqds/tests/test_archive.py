@@ -0,0 +1,63 @@
+import copy
+import os
+
+import pytest
+from django.core.management import call_command
+
+from sqds.models import ArchivedPayload, ArchivedPayloadKind, Player, PlayerUnit
+from sqds.tests.conftest import load_data
+from sqds.tests.utils import generate_roster_game_data
+
+
+@pytest.fixture
+def archive_dir(settings, tmp_path):
+    settings.SQDS_ARCHIVE_DIR = str(tmp_path)
+    return tmp_path
+
+
+def test_store_many(db, archive_dir):
+    player_data = {'allyCode': 123456789, 'roster': [{'defId': 'BOSSK'}]}
+
+    payload, = ArchivedPayload.objects.store_many(
+        ArchivedPayloadKind.PLAYER, [(123456789, player_data)])
+    ArchivedPayload.objects.store_many(ArchivedPayloadKind.PLAYER,
+                                       [(123456789, copy.deepcopy(player_data))])
+
+    assert ArchivedPayload.objects.count() == 2
+    assert len([f for _, _, files in os.walk(archive_dir) for f in files]) == 1
+    assert ArchivedPayload.objects.first().load() == player_data
+
+    new_player_data = copy.deepcopy(player_data)
+    new_player_data['roster'].append({'defId': 'REY'})
+    ArchivedPayload.objects.store_many(ArchivedPayloadKind.PLAYER,
+                                       [(123456789, new_player_data)])
+    latest, = ArchivedPayload.objects.latest(ArchivedPayloadKind.PLAYER)
+    assert latest.load() == new_player_data
+
+    # The payload downloaded last is the latest, even if it was downloaded before
+    ArchivedPayload.objects.store_many(ArchivedPayloadKind.PLAYER,
+                                       [(123456789, player_data)])
+    latest, = ArchivedPayload.objects.latest(ArchivedPayloadKind.PLAYER)
+    assert latest.load() == player_data
+
+
+def test_archiving_disabled(db, settings):
+    settings.SQDS_ARCHIVE_DIR = None
+    assert ArchivedPayload.objects.store_many(ArchivedPayloadKind.GUILD,
+                                              [('G1', {})]) == []
+    assert ArchivedPayload.objects.count() == 0
+
+
+def test_reingest(db, archive_dir):
+    player_data = load_data('data', 'player_data', '168562452.json')
+    player_data['guildRefId'] = ''
+    generate_roster_game_data(player_data['roster'])
+    ArchivedPayload.objects.store_many(ArchivedPayloadKind.PLAYER,
+                                       [(player_data['allyCode'], player_data)])
+    player = Player.objects.update_or_create_from_data(player_data, None)
+    unit_count = PlayerUnit.objects.filter(player=player).count()
+    PlayerUnit.objects.filter(player=player).delete()
+
+    call_command('reingest', '--batch-size', '1')
+
+    assert PlayerUnit.objects.filter(player=player).count() == unit_count
@@ -0,0 +1,57 @@
+import json
+
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from sqds import benchmark
+from sqds.models import Player, Unit
+
+
+def test_benchmark_run(db):
+    results = benchmark.run(player_count=2, batch_size=1)
+
+    assert [r.scenario for r in results] == ['guild_import', 'guild_reimport',
+                                             'update_player_units',
+                                             'update_player_units_unchanged']
+    guild_import, guild_reimport, update, unchanged = results
+    assert all(r.players == 2 and r.vendor == 'sqlite' for r in results)
+    assert guild_import.rows_written > guild_reimport.rows_written
+    assert 0 < update.rows_written < guild_import.rows_written
+    assert unchanged.rows_written == 0
+    assert guild_import.peak_memory > 0
+
+    # everything is rolled back
+    assert Player.objects.count() == 0
+    assert Unit.objects.count() == 0
+
+
+def test_benchmark_compare():
+    baseline = [
+        benchmark.BenchmarkResult('guild_import', 'sqlite', 10, 1., 100, 1000, 10)]
+
+    assert benchmark.compare(
+        [benchmark.BenchmarkResult('guild_import', 'sqlite', 10, 1.1, 100, 1000, 10)],
+        baseline) == []
+    assert benchmark.compare(
+        [benchmark.BenchmarkResult('guild_import', 'sqlite', 10, 1., 150, 1000, 10)],
+        baseline) == ['guild_import: queries increased from 100 to 150']
+    assert benchmark.compare(
+        [benchmark.BenchmarkResult('guild_import', 'postgresql', 10, 2., 150, 1000, 10)],
+        baseline) == []
+
+
+def test_benchmark_command_baseline(db, tmp_path):
+    output = tmp_path / 'baseline.json'
+    call_command('benchmark_ingest', '--players', '1', '--no-memory',
+                 '--output', str(output))
+
+    baseline = json.loads(output.read_text())
+    assert len(baseline) == 4
+    for result in baseline:
+        result['queries'] //= 2
+    output.write_text(json.dumps(baseline))
+
+    with pytest.raises(CommandError, match='queries increased'):
+        call_command('benchmark_ingest', '--players', '1', '--no-memory',
+                     '--baseline', str(output))
@@ -1,5 +1,9 @@
-from sqds.models import Unit, Skill, Category, Gear
-from sqds_seed.factories import UnitFactory, CategoryFactory, SkillFactory
+from django.db import transaction
+
+from sqds.models import Unit, Skill, Category, Gear, GameDataRegistry, update_game_data, \
+    PlayerCategoryGP, update_stats
+from sqds_seed.factories import UnitFactory, CategoryFactory, SkillFactory, GearFactory, \
+    PlayerUnitFactory, PlayerFactory
 
 
 def test_units_and_categories(db):
@@ -88,3 +92,113 @@ def test_gear_data(game_data):
         assert gear.name == name
         assert gear.is_left_hand_g12 == is_left
         assert gear.is_right_hand_g12 == is_right
+
+
+def test_game_data_registry(db, django_assert_num_queries):
+    units = UnitFactory.create_batch(3)
+    gear = GearFactory()
+    skills = list(Skill.objects.filter(unit=units[0]))
+    registry = GameDataRegistry.get()
+
+    with django_assert_num_queries(0):
+        assert GameDataRegistry.get() is registry
+        assert [registry.unit(unit.api_id) for unit in units] == units
+        assert registry.gear_piece(gear.api_id) == gear
+        for skill in skills:
+            assert registry.skill(skill.api_id) == skill
+
+    # objects created after the registry was loaded are fetched once
+    new_unit = UnitFactory(skill=[])
+    with django_assert_num_queries(1):
+        assert registry.unit(new_unit.api_id) == new_unit
+        assert registry.unit(new_unit.api_id) == new_unit
+
+
+def test_game_data_registry_invalidation(transactional_db):
+    registry = GameDataRegistry.get()
+    with transaction.atomic():
+        GameDataRegistry.invalidate()
+        assert GameDataRegistry.get() is registry
+    assert GameDataRegistry.get() is not registry
+
+
+def game_data_lists(unit_name='Bossk', bossk_categories=('profession_bountyhunter',
+                                                         'role_tank')):
+    return {
+        'ability_data_list': [{'id': 'ability_bossk', 'nameKey': 'On The Hunt'},
+                              {'id': 'ability_rey', 'nameKey': 'Flurry of Blows'}],
+        'skill_data_list': [
+            {'id': 'uniqueskill_BOSSK01', 'abilityReference': 'ability_bossk',
+             'isZeta': True},
+            {'id': 'basicskill_REY', 'abilityReference': 'ability_rey',
+             'isZeta': False}],
+        'unit_data_list': [
+            {'baseId': 'BOSSK', 'nameKey': unit_name,
+             'skillReferenceList': [{'skillId': 'uniqueskill_BOSSK01'}],
+             'categoryIdList': list(bossk_categories)},
+            {'baseId': 'REY', 'nameKey': 'Rey (Scavenger)',
+             'skillReferenceList': [{'skillId': 'basicskill_REY'}],
+             'categoryIdList': ['role_attacker', 'unknown_category']}],
+        'category_data_list': [
+            {'id': 'profession_bountyhunter', 'descKey': 'Bounty Hunters'},
+            {'id': 'role_tank', 'descKey': 'Tank'},
+            {'id': 'role_attacker', 'descKey': 'Attacker'}],
+    }
+
+
+def test_update_game_data(db, django_assert_max_num_queries):
+    with django_assert_max_num_queries(20):
+        update_game_data(**game_data_lists())
+
+    bossk = Unit.objects.get(api_id='BOSSK')
+    assert bossk.name == 'Bossk'
+    assert {c.api_id for c in bossk.categories.all()} == {'profession_bountyhunter',
+                                                          'role_tank'}
+    assert Skill.objects.get(api_id='uniqueskill_BOSSK01').unit == bossk
+    assert Skill.objects.get(api_id='basicskill_REY').name == 'Flurry of Blows'
+    assert Category.objects.get(api_id='role_attacker').unit_set.get().api_id == 'REY'
+
+    UnitFactory(api_id='REMOVED', skill=[])
+    update_game_data(**game_data_lists(unit_name='Bossk (updated)',
+                                       bossk_categories=['role_tank']))
+
+    assert Unit.objects.get(pk=bossk.pk).name == 'Bossk (updated)'
+    assert [c.api_id for c in bossk.categories.all()] == ['role_tank']
+    assert not Unit.objects.filter(api_id='REMOVED').exists()
+    assert Unit.objects.count() == 2
+
+
+def test_update_game_data_refreshes_category_gp(db):
+    update_game_data(**game_data_lists())
+    player_unit = PlayerUnitFactory(player=PlayerFactory(),
+                                    unit=Unit.objects.get(api_id='BOSSK'), gp=1000)
+    update_stats([player_unit.player_id])
+
+    def category_gp():
+        return dict(PlayerCategoryGP.objects.filter(player=player_unit.player)
+                    .values_list('category__api_id', 'gp'))
+
+    assert category_gp() == {'profession_bountyhunter': 1000, 'role_tank': 1000}
+
+    update_game_data(**game_data_lists(bossk_categories=['role_tank']))
+    assert category_gp() == {'role_tank': 1000}
+
+
+def test_update_gear(db, mocker):
+    gear_data_list = [
+        {'id': '165', 'nameKey': 'Mk 12 ArmaTek Medpac', 'tier': 12,
+         'requiredRarity': 1, 'requiredLevel': 85, 'statList': []},
+        {'id': 'G12Finisher_DROIDEKA_A', 'nameKey': 'Power Cell Injector', 'tier': 12,
+         'requiredRarity': 1, 'requiredLevel': 85, 'statList': []},
+    ]
+    mocker.patch('sqds.swgoh.Swgoh.get_gear_list', return_value=gear_data_list)
+    mocker.patch('sqds.stat_calc.store_gear_stats')
+    GearFactory(api_id='112')
+    GearFactory(api_id='165', name='Old name')
+
+    Gear.objects.update_or_create_from_swgoh()
+
+    assert sorted(Gear.objects.values_list('api_id', 'name', 'is_left_hand_g12',
+                                           'is_right_hand_g12')) == [
+        ('165', 'Mk 12 ArmaTek Medpac', True, False),
+        ('G12Finisher_DROIDEKA_A', 'Power Cell Injector', False, True)]
@@ -1,12 +1,20 @@
+import copy
 import datetime
 import itertools
+import os
 import random
 
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
-from sqds.models import Player, Guild, Unit, PlayerUnitGear, PlayerUnit
+from sqds.models import Player, Guild, Unit, PlayerUnitGear, PlayerUnit, PlayerStats, \
+    GuildStats, update_stats, Mod, Zeta, RosterWriter, GameDataRegistry, copy_text, \
+    ModStat, ModStatHistogram, PlayerCategoryGP, stat_tables, faction_gp_tables
+from sqds.tests.conftest import load_data, data_path
+from sqds.tests.utils import generate_roster_game_data
 from sqds_seed.factories import PlayerFactory, PlayerUnitFactory, GuildFactory, \
-    UnitFactory, SkillFactory, ZetaFactory, ModFactory
+    UnitFactory, SkillFactory, ZetaFactory, ModFactory, CategoryFactory
 
 
 def test_guild_import(guild_data):
@@ -16,6 +24,28 @@ def test_guild_import(guild_data):
     assert Guild.objects.annotate_stats()[0].player_count == Player.objects.count()
 
 
+def test_guild_import_failure_keeps_written_batches_consistent(db):
+    player_data = load_data('data', 'player_data', '168562452.json')
+    generate_roster_game_data(player_data['roster'])
+    guild_data = {'id': 'G1', 'name': 'Guild', 'gp': 1,
+                  'roster': [{'allyCode': player_data['allyCode']},
+                             {'allyCode': 999999999}]}
+
+    def batches():
+        yield [player_data]
+        raise RuntimeError
+
+    try:
+        Guild.objects.update_or_create_from_data(guild_data, batches())
+    except RuntimeError:
+        pass
+
+    player = Player.objects.get()
+    assert PlayerStats.objects.get(player=player).unit_count == player.unit_set.count()
+    assert GuildStats.objects.get(guild=player.guild).unit_count == \
+        player.unit_set.count()
+
+
 def test_guild_import_with_guild_only(guild_data_no_player):
     assert Guild.objects.count() == 1
     assert Guild.objects.all()[0].name == 'PREPARE'
@@ -82,6 +112,50 @@ def test_guild_annotate_faction_gp(game_data):
     assert qs[0].gr_gp == sum(pu.gp for pu in gr_pus)
 
 
+def test_category_gp_rollup(db):
+    categories = CategoryFactory.create_batch(2)
+    units = [UnitFactory(categories=categories), UnitFactory(categories=categories[:1]),
+             UnitFactory()]
+    player = PlayerFactory()
+    pus = [PlayerUnitFactory(player=player, unit=unit) for unit in units]
+
+    def rollup():
+        return dict(PlayerCategoryGP.objects.filter(player=player)
+                    .values_list('category', 'gp'))
+
+    expected = {categories[0].pk: pus[0].gp + pus[1].gp, categories[1].pk: pus[0].gp}
+    assert rollup() == expected
+    PlayerCategoryGP.objects.all().delete()
+    PlayerCategoryGP.objects.update_for_players([player.pk])
+    assert rollup() == expected
+
+    PlayerUnit.objects.filter(pk=pus[1].pk).update(gp=pus[1].gp + 10)
+    pus[0].delete()
+    PlayerCategoryGP.objects.update_for_players([player.pk])
+    assert rollup() == {categories[0].pk: pus[1].gp + 10}
+
+
+def test_annotate_category_gp(db):
+    categories = CategoryFactory.create_batch(2)
+    guild = GuildFactory()
+    players = PlayerFactory.create_batch(2, guild=guild)
+    units = [UnitFactory(categories=categories[:1]), UnitFactory(categories=categories)]
+    pus = [PlayerUnitFactory(player=player, unit=unit)
+           for player in players for unit in units]
+
+    api_ids = [c.api_id for c in categories]
+    with CaptureQueriesContext(connection) as queries:
+        qs = Player.objects.annotate_category_gp(api_ids + ['missing']).order_by('pk')
+        annotated = list(qs.values_list(*[f'{api_id}_gp' for api_id in api_ids],
+                                        'missing_gp'))
+    assert len(queries) == 1
+    assert annotated == [(pus[0].gp + pus[1].gp, pus[1].gp, 0),
+                         (pus[2].gp + pus[3].gp, pus[3].gp, 0)]
+
+    guild = Guild.objects.annotate_category_gp({'first_gp': api_ids[0]}).get()
+    assert guild.first_gp == sum(pu.gp for pu in pus)
+
+
 def test_player_annotate_stats_unit_count(db):
     player = PlayerFactory()
 
@@ -267,6 +341,280 @@ def test_annotate_stats_consistency(guild_data):
         assert getattr(guild, stat) == sum(getattr(p, stat) for p in players)
 
 
+def test_player_compute_stats_matches_annotate_stats(db):
+    """
+    The grouped statistics engine must agree with the per-row annotations, including
+    for players without any unit.
+    """
+    player = PlayerFactory()
+    PlayerFactory()
+    for gear, speed in [(13, 25), (12, 17), (10, 3)]:
+        unit = UnitFactory()
+        pu = PlayerUnitFactory(player=player, unit=unit, gear=gear, rarity=7)
+        ZetaFactory(player_unit=pu, skill=SkillFactory(unit=unit, is_zeta=True))
+        ModFactory(player_unit=pu, slot=0, speed=speed, pips=6, primary_stat='DE')
+
+    stats = Player.objects.compute_stats()
+
+    assert stats.keys() == set(Player.objects.values_list('pk', flat=True))
+    for p in Player.objects.annotate_stats().annotate_faction_gp():
+        for stat, value in stats[p.pk].items():
+            assert getattr(p, stat) == value
+
+
+def test_annotate_stats_joins_one_grouped_query_per_table(db):
+    guild = GuildFactory()
+    players = PlayerFactory.create_batch(3, guild=guild)
+    for i, player in enumerate(players):
+        for _ in range(i + 1):
+            pu = PlayerUnitFactory(player=player, unit=UnitFactory(), gear=13)
+            ModFactory(player_unit=pu, slot=0, speed=20, pips=6, primary_stat='DE')
+    update_stats([players[0].pk])
+    PlayerStats.objects.filter(player=players[0]).update(unit_count=10)
+
+    qs = Player.objects.filter(guild=guild).annotate_stats().annotate_faction_gp()
+
+    tables = stat_tables() + faction_gp_tables()
+    assert str(qs.query).count('GROUP BY') == len(tables)
+    # rows with a rollup read it, the others are computed
+    assert [p.unit_count for p in qs.order_by('-unit_count')] == [10, 3, 2]
+    assert qs.filter(mod_count_6dot__gte=2).count() == 2
+    assert list(Player.objects.filter(pk__in=qs.filter(unit_count=3).values('pk'))) == [
+        players[2]]
+
+
+def test_stats_rollup_is_read_by_annotate_stats(db):
+    guild = GuildFactory()
+    players = PlayerFactory.create_batch(2, guild=guild)
+    for player in players:
+        PlayerUnitFactory(player=player, unit=UnitFactory(), gear=13)
+
+    update_stats([p.pk for p in players])
+
+    assert PlayerStats.objects.count() == 2
+    assert GuildStats.objects.get(guild=guild).player_count == 2
+
+    # Rollups are only updated on ingest, so new units are not accounted for yet
+    PlayerUnitFactory(player=players[0], unit=UnitFactory(), gear=13)
+    assert Player.objects.annotate_stats().get(pk=players[0].pk).g13_unit_count == 1
+    assert Guild.objects.annotate_stats().get(pk=guild.pk).g13_unit_count == 2
+
+    update_stats([players[0].pk])
+    assert Player.objects.annotate_stats().get(pk=players[0].pk).g13_unit_count == 2
+    assert Guild.objects.annotate_stats().get(pk=guild.pk).g13_unit_count == 3
+
+
+def test_guild_stats_rollup_matches_compute_stats(db):
+    guild = GuildFactory()
+    GuildFactory()
+    for player in PlayerFactory.create_batch(3, guild=guild):
+        for gear in [10, 12, 13]:
+            pu = PlayerUnitFactory(player=player, unit=UnitFactory(), gear=gear)
+            ModFactory(player_unit=pu, slot=0, speed=gear + 5, primary_stat='DE')
+
+    # Guild stats are computed from player stats, which are created when missing
+    GuildStats.objects.update_for_guilds(Guild.objects.values_list('pk', flat=True))
+
+    stats = Guild.objects.compute_stats()
+    for guild_stats in GuildStats.objects.all():
+        for stat, value in stats[guild_stats.guild_id].items():
+            assert getattr(guild_stats, stat) == value
+
+
+def test_update_player_units_only_writes_changes(db):
+    roster = load_data('data', 'player_data', '168562452.json')['roster']
+    generate_roster_game_data(roster)
+    player = PlayerFactory()
+    Player.objects.update_player_units(player, roster)
+
+    pu_ids = dict(PlayerUnit.objects.filter(player=player).values_list('unit__api_id',
+                                                                       'id'))
+    mod_ids = dict(Mod.objects.values_list('api_id', 'id'))
+    before = timezone.now()
+
+    # Upgrade a unit, drop another one and move a mod between units
+    roster = copy.deepcopy(roster)
+    characters = [u for u in roster if u['combatType'] == 1]
+    modded = [u for u in characters if u['mods']]
+    upgraded, moved_from, moved_to = modded[0], modded[1], modded[2]
+    upgraded['gear'] += 1
+    upgraded['equipped'] = upgraded['equipped'][1:]
+    moved_mod = moved_from['mods'].pop()
+    moved_to['mods'].append(moved_mod)
+    removed = characters[-1]
+    roster.remove(removed)
+    Player.objects.update_player_units(player, roster)
+
+    player_units = PlayerUnit.objects.filter(player=player)
+    assert player_units.count() == len(characters) - 1
+    assert not player_units.filter(unit__api_id=removed['defId']).exists()
+    for pu in player_units:
+        assert pu.id == pu_ids[pu.unit.api_id]
+        unit_data = next(u for u in roster if u['defId'] == pu.unit.api_id)
+        assert pu.gear == unit_data['gear']
+        assert pu.pug_set.count() == len(unit_data['equipped'])
+        assert sorted(pu.mod_set.values_list('api_id', flat=True)) == sorted(
+            m['id'] for m in unit_data['mods'])
+        assert (pu.last_updated > before) == (unit_data is upgraded)
+
+    mod = Mod.objects.get(api_id=moved_mod['id'])
+    assert mod.id == mod_ids[moved_mod['id']]
+    assert mod.player_unit.unit.api_id == moved_to['defId']
+
+
+def test_update_player_units_zetas(db):
+    roster = load_data('data', 'player_data', '168562452.json')['roster']
+    generate_roster_game_data(roster)
+    player = PlayerFactory()
+    Player.objects.update_player_units(player, roster)
+
+    zetas = [(u, s) for u in roster if u['combatType'] == 1 for s in u['skills']
+             if s['isZeta'] and s['tier'] == 8]
+    assert Zeta.objects.filter(player_unit__player=player).count() == len(zetas)
+    zeta_ids = set(Zeta.objects.values_list('id', flat=True))
+
+    zetas[0][1]['tier'] = 7
+    Player.objects.update_player_units(player, roster)
+
+    assert set(Zeta.objects.values_list('id', flat=True)) < zeta_ids
+    assert Zeta.objects.filter(player_unit__player=player).count() == len(zetas) - 1
+    assert not Zeta.objects.filter(skill__api_id=zetas[0][1]['id']).exists()
+
+
+def test_update_player_units_counters(db):
+    roster = load_data('data', 'player_data', '168562452.json')['roster']
+    generate_roster_game_data(roster)
+    player = PlayerFactory()
+    Player.objects.update_player_units(player, roster)
+
+    # Move a mod and drop a zeta
+    roster = copy.deepcopy(roster)
+    modded = [u for u in roster if u['combatType'] == 1 and u['mods']]
+    modded[1]['mods'].append(modded[0]['mods'].pop())
+    zeta = next(s for u in roster for s in u['skills'] if s['isZeta'] and s['tier'] == 8)
+    zeta['tier'] = 7
+    Player.objects.update_player_units(player, roster)
+
+    player_units = PlayerUnit.objects.filter(player=player)
+    stored = list(player_units.order_by('pk').values_list(
+        'pk', 'mod_speed_no_set', 'zeta_count'))
+    assert any(zeta_count for _, _, zeta_count in stored)
+    player_units.update_counters()
+    assert list(player_units.order_by('pk').values_list(
+        'pk', 'mod_speed_no_set', 'zeta_count')) == stored
+
+
+def test_mod_stat_histogram(db):
+    roster = load_data('data', 'player_data', '168562452.json')['roster']
+    generate_roster_game_data(roster)
+    player = PlayerFactory()
+    Player.objects.update_player_units(player, roster)
+
+    histogram = sorted(ModStatHistogram.objects.values_list('stat', 'value', 'count'))
+    assert histogram
+    ModStatHistogram.objects.rebuild_for_players([player.pk])
+    assert sorted(ModStatHistogram.objects.values_list('stat', 'value', 'count')) == \
+        histogram
+
+    mods = Mod.objects.exclude(primary_stat='SP')
+    buckets = ModStatHistogram.objects.buckets(ModStat.SPEED, [10, 20])[player.pk]
+    assert buckets == {
+        'speed_10_20': mods.filter(speed__gte=10, speed__lt=20).count(),
+        'speed_20plus': mods.filter(speed__gte=20).count(),
+    }
+    buckets = ModStatHistogram.objects.buckets(ModStat.CRITICAL_CHANCE, [.02])[player.pk]
+    assert buckets == {'critical_chance_0.02plus': Mod.objects.exclude(
+        primary_stat='CC').filter(critical_chance__gte=.02).count()}
+
+
+def test_roster_writer_batch(db):
+    rosters = [load_data('data', 'player_data', filename)['roster']
+               for filename in sorted(os.listdir(data_path('data', 'player_data')))]
+    for roster in rosters:
+        generate_roster_game_data(roster)
+    players = PlayerFactory.create_batch(len(rosters))
+    GameDataRegistry.get()
+
+    writer = RosterWriter()
+    for player, roster in zip(players, rosters):
+        writer.add(player, roster)
+    with CaptureQueriesContext(connection) as queries:
+        writer.write()
+
+    # Thousands of rows are written with a few dozen queries
+    assert len(queries) <= 50
+    for player, roster in zip(players, rosters):
+        characters = [u for u in roster if u['combatType'] == 1]
+        assert player.unit_set.count() == len(characters)
+        assert Mod.objects.filter(player_unit__player=player).count() == sum(
+            len(u['mods']) for u in characters)
+        assert PlayerUnitGear.objects.filter(player_unit__player=player).count() == sum(
+            len(u['equipped']) for u in characters)
+
+
+def test_roster_writer_copy_falls_back_to_bulk_create(db):
+    roster = load_data('data', 'player_data', '168562452.json')['roster']
+    generate_roster_game_data(roster)
+    player = PlayerFactory()
+
+    writer = RosterWriter(use_copy=True)
+    assert writer.use_copy == (connection.vendor == 'postgresql')
+    writer.add(player, roster)
+    writer.write()
+
+    assert player.unit_set.count() == len([u for u in roster if u['combatType'] == 1])
+
+
+def test_copy_text():
+    assert copy_text(None) == '\\N'
+    assert copy_text(True) == 't'
+    assert copy_text(False) == 'f'
+    assert copy_text(12) == '12'
+    assert copy_text(0.125) == '0.125'
+    assert copy_text('a\tb\nc\\d\re') == 'a\\tb\\nc\\\\d\\re'
+
+
+def test_unchanged_roster_is_not_rewritten(db, django_assert_max_num_queries):
+    player_data = load_data('data', 'player_data', '168562452.json')
+    generate_roster_game_data(player_data['roster'])
+    player = Player.objects.update_or_create_from_data(player_data, None)
+    assert player.roster_hash
+    pu_count = PlayerUnit.objects.filter(player=player).count()
+
+    # same swgoh.help snapshot
+    with django_assert_max_num_queries(3):
+        Player.objects.update_or_create_from_data(player_data, None)
+
+    # new snapshot with the same roster
+    player_data = copy.deepcopy(player_data)
+    player_data['updated'] += 1000
+    player_data['stats'][0]['value'] += 1
+    with django_assert_max_num_queries(3):
+        player = Player.objects.update_or_create_from_data(player_data, None)
+    assert player.gp == player_data['stats'][0]['value']
+
+    # units deleted outside of ingestion are written again
+    PlayerUnit.objects.filter(player=player).first().delete()
+    Player.objects.update_or_create_from_data(player_data, None)
+    assert PlayerUnit.objects.filter(player=player).count() == pu_count
+
+    # changed roster
+    player_data['updated'] += 1000
+    player_data['roster'] = player_data['roster'][1:]
+    Player.objects.update_or_create_from_data(player_data, None)
+    assert PlayerUnit.objects.filter(player=player).count() < pu_count
+
+
+def test_changed_gp_ally_codes(db):
+    players = PlayerFactory.create_batch(2)
+    guild_roster_data = [{'allyCode': players[0].ally_code, 'gp': players[0].gp},
+                         {'allyCode': players[1].ally_code, 'gp': players[1].gp + 1},
+                         {'allyCode': 999999999, 'gp': 1}]
+
+    assert Player.objects.changed_gp_ally_codes(guild_roster_data) == [
+        players[1].ally_code, 999999999]
+
+
 def test_player_unit_annotate_stats(db):
     pass
 
@@ -0,0 +1,89 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from sqds import page_cache
+from sqds.models import Player, update_stats
+from sqds_seed.factories import GuildFactory, PlayerFactory, PlayerUnitFactory
+
+
+@pytest.fixture(autouse=True)
+def page_cache_timeout(settings):
+    settings.SQDS_PAGE_CACHE_TIMEOUT = 3600
+
+
+def test_key_changes_when_scope_is_invalidated(transactional_db):
+    def make_key(guild_id):
+        return page_cache.make_key(
+            'test', [page_cache.GLOBAL, page_cache.guild_scope(guild_id)], '/path')
+
+    key1, key2 = make_key(1), make_key(2)
+    assert make_key(1) == key1
+    assert key1 != key2
+
+    page_cache.invalidate_guilds([1])
+    assert make_key(1) != key1
+    assert make_key(2) == key2
+
+    key1 = make_key(1)
+    page_cache.invalidate([page_cache.GLOBAL])
+    assert make_key(1) != key1
+    assert make_key(2) != key2
+
+
+def test_get_or_set(settings):
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return len(calls)
+
+    assert page_cache.get_or_set('key', compute) == 1
+    assert page_cache.get_or_set('key', compute) == 1
+
+    settings.SQDS_PAGE_CACHE_TIMEOUT = None
+    assert page_cache.get_or_set('key', compute) == 2
+
+
+def test_guild_view_is_cached_until_ingest(transactional_db, client):
+    guild = GuildFactory()
+    players = PlayerFactory.create_batch(2, guild=guild, name='Before')
+    for player in players:
+        PlayerUnitFactory.create_batch(2, player=player)
+    url = reverse('sqds:guild', args=[guild.api_id])
+
+    with CaptureQueriesContext(connection) as first:
+        assert 'Before' in client.get(url).content.decode()
+    Player.objects.filter(guild=guild).update(name='After')
+    with CaptureQueriesContext(connection) as second:
+        assert 'Before' in client.get(url).content.decode()
+    assert len(second) < len(first)
+
+    update_stats([player.pk for player in players])
+    assert 'After' in client.get(url).content.decode()
+
+
+def test_guild_units_view_count_is_cached(transactional_db, client):
+    guild = GuildFactory()
+    player = PlayerFactory(guild=guild)
+    PlayerUnitFactory.create_batch(3, player=player)
+    url = reverse('sqds:guild_units', args=[guild.api_id])
+
+    assert client.get(url).context['table'].paginator.count == 3
+    PlayerUnitFactory(player=player)
+    assert client.get(url).context['table'].paginator.count == 3
+    assert client.get(url, {'sort': 'gp'}).context['table'].paginator.count == 4
+
+    update_stats([player.pk])
+    assert client.get(url).context['table'].paginator.count == 4
+
+
+def test_global_invalidation_changes_etag(transactional_db, client):
+    guild = GuildFactory()
+    url = reverse('sqds:guild', args=[guild.api_id])
+    etag = client.get(url)['ETag']
+    assert client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 304
+
+    page_cache.invalidate([page_cache.GLOBAL])
+    assert client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 200
@@ -0,0 +1,73 @@
+import datetime
+
+import pytest
+from django.core.management import call_command
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from sqds.models import RefreshJob, RefreshJobKind, RefreshJobStatus
+
+
+def test_enqueue_deduplicates_active_jobs(db):
+    job = RefreshJob.objects.enqueue(RefreshJobKind.PLAYER, 123456789)
+    assert RefreshJob.objects.enqueue(RefreshJobKind.PLAYER, 123456789) == job
+    assert RefreshJob.objects.enqueue(RefreshJobKind.GUILD, 123456789) != job
+
+    job.status = RefreshJobStatus.DONE
+    job.save()
+    new_job = RefreshJob.objects.enqueue(RefreshJobKind.PLAYER, 123456789)
+    assert new_job != job
+    assert RefreshJob.objects.latest(RefreshJobKind.PLAYER, 123456789) == new_job
+
+
+def test_only_one_active_job(db):
+    RefreshJob.objects.create(kind=RefreshJobKind.PLAYER, ally_code=123456789)
+    with pytest.raises(IntegrityError), transaction.atomic():
+        RefreshJob.objects.create(kind=RefreshJobKind.PLAYER, ally_code=123456789)
+    RefreshJob.objects.create(kind=RefreshJobKind.PLAYER, ally_code=123456789,
+                              status=RefreshJobStatus.DONE)
+
+
+def test_enqueue_concurrently(db, mocker):
+    # another request creates the job after this one found none
+    job = RefreshJob.objects.create(kind=RefreshJobKind.PLAYER, ally_code=123456789)
+    first = mocker.patch('django.db.models.QuerySet.first', side_effect=[None, job])
+    assert RefreshJob.objects.enqueue(RefreshJobKind.PLAYER, 123456789) == job
+    assert first.call_count == 2
+    assert RefreshJob.objects.count() == 1
+
+
+def test_claim(db):
+    first = RefreshJob.objects.enqueue(RefreshJobKind.PLAYER, 123456789)
+    second = RefreshJob.objects.enqueue(RefreshJobKind.PLAYER, 987654321)
+
+    assert RefreshJob.objects.claim() == first
+    assert RefreshJob.objects.claim() == second
+    assert RefreshJob.objects.claim() is None
+    first.refresh_from_db()
+    assert first.status == RefreshJobStatus.RUNNING
+
+    RefreshJob.objects.filter(pk=first.pk).update(
+        started=timezone.now() - datetime.timedelta(hours=2))
+    assert RefreshJob.objects.requeue_stale(3600) == 1
+    assert RefreshJob.objects.claim() == first
+
+
+def test_refresh_worker(db, mocker, caplog):
+    refresh = mocker.patch(
+        'sqds.models.PlayerManager.update_or_create_multiple_from_swgoh')
+    player_job = RefreshJob.objects.enqueue(RefreshJobKind.PLAYER, 123456789)
+    mocker.patch('sqds.models.GuildManager.update_or_create_from_swgoh',
+                 side_effect=RuntimeError('unreachable'))
+    guild_job = RefreshJob.objects.enqueue(RefreshJobKind.GUILD, 987654321)
+
+    call_command('refresh_worker', '--once')
+
+    refresh.assert_called_once_with([123456789])
+    player_job.refresh_from_db()
+    guild_job.refresh_from_db()
+    assert player_job.status == RefreshJobStatus.DONE
+    assert guild_job.status == RefreshJobStatus.FAILED
+    assert guild_job.error == 'RuntimeError: unreachable'
+    assert guild_job.finished is not None
+    assert 'RuntimeError: unreachable' in caplog.text
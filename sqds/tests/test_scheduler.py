@@ -0,0 +1,119 @@
+import datetime
+import threading
+import time
+
+import pytest
+from django.utils import timezone
+
+from sqds import scheduler
+from sqds.models import Guild, Player
+from sqds_seed.factories import GuildFactory, PlayerFactory
+
+
+def set_last_updated(model, obj, hours):
+    model.objects.filter(pk=obj.pk).update(
+        last_updated=timezone.now() - datetime.timedelta(hours=hours))
+
+
+def test_refresh_candidates(db):
+    recent_guild, stale_guild, popular_guild = GuildFactory.create_batch(3)
+    for guild in [recent_guild, stale_guild, popular_guild]:
+        PlayerFactory.create_batch(3, guild=guild)
+    set_last_updated(Guild, recent_guild, 0.5)
+    set_last_updated(Guild, stale_guild, 6)
+    set_last_updated(Guild, popular_guild, 3)
+    popular_guild.record_view()
+    popular_guild.record_view()
+    Guild.flush_view_counts()
+
+    overdue_player = PlayerFactory(guild=None)
+    set_last_updated(Player, overdue_player, 30)
+
+    candidates = scheduler.refresh_candidates()
+
+    assert [(c.model, c.pk) for c in candidates] == [
+        (Player, overdue_player.pk), (Guild, popular_guild.pk), (Guild, stale_guild.pk)]
+    assert candidates[1].cost == 3
+    assert candidates[1].ally_code in popular_guild.player_set.values_list(
+        'ally_code', flat=True)
+
+
+def test_view_counts_are_flushed(db):
+    guild = GuildFactory()
+    guild.record_view()
+    guild.record_view()
+    assert Guild.objects.get(pk=guild.pk).view_count == 0
+
+    Guild.flush_view_counts()
+    Guild.flush_view_counts()
+    assert Guild.objects.get(pk=guild.pk).view_count == 2
+
+
+def test_refresh_guilds(db, mocker, settings):
+    settings.SQDS_CALC_STATS = False
+    lock = threading.Lock()
+    state = {'running': 0, 'max_running': 0}
+
+    def call(result):
+        with lock:
+            state['running'] += 1
+            state['max_running'] = max(state['max_running'], state['running'])
+        time.sleep(0.05)
+        with lock:
+            state['running'] -= 1
+        return result
+
+    # players whose GP did not change are not downloaded
+    unchanged = PlayerFactory(guild=None)
+
+    def get_guild_list(_, ally_code):
+        return call({'id': f'G{ally_code}',
+                     'roster': [{'allyCode': ally_code, 'gp': 1},
+                                {'allyCode': unchanged.ally_code, 'gp': unchanged.gp}]})
+
+    mocker.patch('sqds.swgoh.Swgoh.get_guild_list', autospec=True,
+                 side_effect=get_guild_list)
+    mocker.patch('sqds.swgoh.Swgoh.get_player_data', autospec=True,
+                 side_effect=lambda _, ally_codes, calc_stats: call(
+                     [{'allyCode': ally_code} for ally_code in ally_codes]))
+    update = mocker.patch('sqds.models.GuildManager.update_or_create_from_data',
+                          side_effect=lambda guild_data, *_: guild_data['id'])
+
+    scheduler.refresh_guilds(list(range(1, 11)))
+
+    assert update.call_count == 10
+    for args, _ in update.call_args_list:
+        guild_data, player_data_batches, use_copy = args
+        assert [p['allyCode'] for batch in player_data_batches for p in batch] == [
+            int(guild_data['id'][1:])]
+        assert use_copy
+    # guilds are downloaded concurrently
+    assert state['max_running'] > 1
+
+
+def test_plan_refreshes():
+    candidates = [scheduler.RefreshCandidate(Guild, 1, 1, 50, (False, 5)),
+                  scheduler.RefreshCandidate(Guild, 2, 2, 40, (False, 4)),
+                  scheduler.RefreshCandidate(Player, 3, 3, 1, (False, 3))]
+
+    assert [c.pk for c in scheduler.plan_refreshes(candidates, 60)] == [1, 3]
+
+
+def test_run(db, mocker):
+    refresh_guilds = mocker.patch('sqds.scheduler.refresh_guilds')
+    refresh_players = mocker.patch(
+        'sqds.models.PlayerManager.update_or_create_multiple_from_swgoh')
+    guild = GuildFactory()
+    member = PlayerFactory(guild=guild)
+    player = PlayerFactory(guild=None)
+    set_last_updated(Guild, guild, 2)
+    set_last_updated(Player, player, 2)
+    for _ in range(3):
+        player.record_view()
+
+    scheduler.run()
+
+    refresh_guilds.assert_called_once_with([member.ally_code])
+    refresh_players.assert_called_once_with([player.ally_code])
+    player.refresh_from_db()
+    assert player.view_count == 1
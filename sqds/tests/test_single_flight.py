@@ -0,0 +1,102 @@
+import threading
+import time
+
+import pytest
+from django.utils import timezone
+
+from sqds.models import Guild, SingleFlightLock
+from sqds.single_flight import single_flight_many, single_flight
+from sqds_seed.factories import GuildFactory, PlayerFactory
+
+
+def test_concurrent_refreshes_are_coalesced(transactional_db):
+    calls = []
+    started = threading.Event()
+
+    def refresh(keys):
+        calls.append(sorted(keys))
+        started.set()
+        time.sleep(0.3)
+        return {key: key * 10 for key in keys if key != 2}
+
+    results = {}
+
+    def run(name, keys):
+        results[name] = single_flight_many('test', keys, refresh)
+
+    first = threading.Thread(target=run, args=('first', [1, 2, 3]))
+    first.start()
+    started.wait()
+    second = threading.Thread(target=run, args=('second', [2, 3, 4]))
+    second.start()
+    first.join()
+    second.join()
+
+    assert calls == [[1, 2, 3], [4]]
+    assert results['first'] == {1: 10, 3: 30}
+    assert results['second'] == {3: 30, 4: 40}
+
+
+def test_failed_refresh_is_retried(transactional_db):
+    started = threading.Event()
+
+    def failing_refresh():
+        started.set()
+        time.sleep(0.3)
+        raise RuntimeError('error')
+
+    def run():
+        with pytest.raises(RuntimeError):
+            single_flight('test', 'key', failing_refresh)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    started.wait()
+    assert single_flight('test', 'key', lambda: 'result') == 'result'
+    thread.join()
+
+    # locks are released
+    assert single_flight('test', 'key', lambda: 'other result') == 'other result'
+    assert SingleFlightLock.objects.count() == 0
+
+
+def test_concurrent_guild_imports_download_the_guild_once(transactional_db, mocker):
+    guild = GuildFactory()
+    members = PlayerFactory.create_batch(2, guild=guild)
+    started = threading.Event()
+
+    def get_guild_list(_):
+        started.set()
+        time.sleep(0.3)
+        return {'id': guild.api_id, 'name': guild.name, 'gp': guild.gp,
+                'roster': [{'allyCode': member.ally_code} for member in members]}
+
+    get_guild_list = mocker.patch('sqds.swgoh.api.get_guild_list',
+                                  side_effect=get_guild_list)
+    mocker.patch('sqds.swgoh.api.iter_player_data_batch', return_value=[])
+    results = []
+
+    def run(ally_code):
+        results.append(Guild.objects.update_or_create_from_swgoh(ally_code))
+
+    # members hit refresh at the same time
+    threads = [threading.Thread(target=run, args=(member.ally_code,))
+               for member in members]
+    threads[0].start()
+    started.wait()
+    threads[1].start()
+    for thread in threads:
+        thread.join()
+
+    assert get_guild_list.call_count == 1
+    assert results == [guild, guild]
+
+
+def test_expired_lock_is_acquired_again(db):
+    assert SingleFlightLock.objects.acquire('key', 'first', 600)
+    assert not SingleFlightLock.objects.acquire('key', 'second', 600)
+
+    SingleFlightLock.objects.update(expires=timezone.now())
+    assert SingleFlightLock.objects.acquire('key', 'second', 600)
+    SingleFlightLock.objects.release(['key'], 'first')
+    assert SingleFlightLock.objects.holders(['key']) == {'key': 'second'}
@@ -0,0 +1,89 @@
+import os
+
+import pytest
+
+from sqds import stat_calc
+from sqds.tests.conftest import load_data, data_path
+
+PLAYER_FILES = sorted(os.listdir(data_path('data', 'player_data')))
+
+
+@pytest.fixture(autouse=True)
+def gear_stats(db):
+    stat_calc.store_gear_stats(load_data('data', 'gear_data.json'))
+
+
+def without_stats(player_data):
+    return {**player_data,
+            'roster': [{key: value for key, value in unit_data.items() if key != 'stats'}
+                       for unit_data in player_data['roster']]}
+
+
+def assert_same_stats(player_data, expected_player_data):
+    expected_roster = {unit_data['id']: unit_data
+                       for unit_data in expected_player_data['roster']}
+    for unit_data in filter(stat_calc.is_character, player_data['roster']):
+        expected = expected_roster[unit_data['id']]['stats']
+        for kind in ['final', 'mods']:
+            names = set(unit_data['stats'][kind]) | set(expected[kind])
+            for name in names:
+                assert unit_data['stats'][kind].get(name, 0) == pytest.approx(
+                    expected[kind].get(name, 0)), (unit_data['defId'], kind, name)
+
+
+def test_local_mod_stats_match_fixtures():
+    # Base stats are learned from the fixtures themselves, mod stats (and therefore final
+    # stats) are computed from the mods only
+    fixtures = [load_data('data', 'player_data', file) for file in PLAYER_FILES]
+    stat_calc.learn_base_stats(fixtures)
+
+    player_data_list = stat_calc.calculate_stats([without_stats(player_data)
+                                                  for player_data in fixtures])
+
+    for player_data, expected in zip(player_data_list, fixtures):
+        assert_same_stats(player_data, expected)
+
+
+def test_unknown_progressions_are_computed_remotely():
+    *known, player_data = [load_data('data', 'player_data', file)
+                           for file in PLAYER_FILES]
+    stat_calc.learn_base_stats(known)
+    expected_roster = {unit_data['id']: unit_data for unit_data in player_data['roster']}
+    remote_units = []
+
+    def remote(player_data_list):
+        roster = player_data_list[0]['roster']
+        remote_units.extend(roster)
+        return [{**player_data_list[0],
+                 'roster': [expected_roster[unit_data['id']] for unit_data in roster]}]
+
+    result = stat_calc.calculate_stats([without_stats(player_data)], remote=remote)
+
+    characters = list(filter(stat_calc.is_character, player_data['roster']))
+    assert 0 < len(remote_units) < len(characters)
+    assert_same_stats(result[0], player_data)
+
+    # base stats of unknown progressions were learned
+    remote_units.clear()
+    result = stat_calc.calculate_stats([without_stats(player_data)], remote=remote)
+    assert remote_units == []
+    assert_same_stats(result[0], player_data)
+
+
+def test_unknown_progressions_without_remote_raise():
+    *known, player_data = [load_data('data', 'player_data', file)
+                           for file in PLAYER_FILES]
+    stat_calc.learn_base_stats(known)
+
+    with pytest.raises(stat_calc.StatCalcError, match=str(player_data['allyCode'])):
+        stat_calc.calculate_stats([without_stats(player_data)])
+
+
+def test_missing_remote_stats_raise():
+    player_data = load_data('data', 'player_data', PLAYER_FILES[0])
+
+    def remote(player_data_list):
+        return [without_stats(player_data_list[0])]
+
+    with pytest.raises(stat_calc.StatCalcError):
+        stat_calc.calculate_stats([without_stats(player_data)], remote=remote)
@@ -0,0 +1,370 @@
+import asyncio
+import json
+import random
+import threading
+import time
+
+import pytest
+
+from sqds.swgoh import Swgoh, AsyncSwgoh, AimdController, ApiError, BatchError, \
+    CircuitBreaker, CircuitOpenError, RateLimitError, TokenBucket, iter_json_array
+from sqds.tests.conftest import load_data
+
+
+@pytest.fixture(autouse=True)
+def service_state(db):
+    # rate limiter and circuit breaker states are stored in database
+    pass
+
+
+def fake_download(ally_codes):
+    return [{'allyCode': ally_code} for ally_code in ally_codes]
+
+
+def test_iter_player_data_batch(mocker):
+    mocker.patch('sqds.swgoh.Swgoh._download_players', side_effect=fake_download)
+    ally_codes = list(range(100000000, 100000040))
+
+    batches = list(Swgoh().iter_player_data_batch(ally_codes))
+
+    assert len(batches) > 1
+    assert sorted(p['allyCode'] for batch in batches for p in batch) == ally_codes
+
+
+def test_iter_player_data_batch_stops_download(mocker):
+    download = mocker.patch('sqds.swgoh.Swgoh._download_players',
+                            side_effect=fake_download)
+    ally_codes = list(range(100000000, 100000100))
+    thread_count = threading.active_count()
+
+    for _ in Swgoh().iter_player_data_batch(ally_codes, max_pending_batches=1):
+        break
+
+    assert threading.active_count() == thread_count
+    assert sum(len(call[0][0]) for call in download.call_args_list) < len(ally_codes)
+
+
+def test_iter_player_data_batch_error(mocker):
+    mocker.patch('sqds.swgoh.Swgoh._download_players', side_effect=ApiError('error'))
+
+    with pytest.raises(BatchError):
+        list(Swgoh().iter_player_data_batch([100000000, 100000001]))
+
+
+def test_iter_player_data_batch_hands_players_over_as_parsed(mocker):
+    downloads = []
+
+    def download(ally_codes):
+        downloads.append(list(ally_codes))
+        yield from fake_download(ally_codes[:1])
+        if len(downloads) == 1:
+            raise ApiError('error')
+        yield from fake_download(ally_codes[1:])
+
+    mocker.patch('sqds.swgoh.Swgoh._download_players', side_effect=download)
+    ally_codes = list(range(100000000, 100000004))
+
+    batches = list(Swgoh().iter_player_data_batch(ally_codes))
+
+    # players parsed before the error are not downloaded again
+    assert sorted(p['allyCode'] for batch in batches for p in batch) == ally_codes
+    assert downloads[0][0] not in [ally_code for ally_codes in downloads[1:]
+                                   for ally_code in ally_codes]
+
+
+def test_aimd_controller(mocker):
+    monotonic = mocker.patch('sqds.swgoh.time.monotonic', return_value=100.)
+    controller = AimdController(batch_size=4, worker_count=2, max_batch_size=6,
+                                max_worker_count=3)
+
+    controller.record_success(4, 4.)
+    controller.record_success(5, 5.)
+    assert (controller.batch_size, controller.worker_count) == (6, 3)
+    controller.record_success(6, 6.)
+    assert (controller.batch_size, controller.worker_count) == (6, 3)
+
+    controller.record_error(6, 1.)
+    assert (controller.batch_size, controller.worker_count) == (3, 2)
+
+    # latency spike
+    controller.record_success(3, 9.)
+    assert (controller.batch_size, controller.worker_count) == (2, 1)
+
+    # concurrent batches: throughput is relative to wall-clock time
+    monotonic.return_value = 110.
+    controller.record_success(2, 8.)
+    assert controller.throughput == pytest.approx(20 / 10)
+
+
+def test_player_data_batch_recovers_from_error(mocker):
+    failed = []
+
+    def download(ally_codes):
+        if not failed:
+            failed.append(ally_codes)
+            raise ApiError('error')
+        time.sleep(0.005 * len(ally_codes))
+        return fake_download(ally_codes)
+
+    mocker.patch('sqds.swgoh.Swgoh._download_players', side_effect=download)
+    ally_codes = list(range(100000000, 100000400))
+    api = Swgoh()
+
+    player_data = []
+    controller = api._download_player_data_batch(ally_codes, player_data.append)
+
+    assert sorted(p['allyCode'] for p in player_data) == ally_codes
+    history = controller.history
+    assert [record.success for record in history].count(False) == 1
+    # the batch size was halved, and grew back
+    after_error = history[[record.success for record in history].index(False) + 1:]
+    assert min(record.size for record in after_error) < Swgoh.INITIAL_BATCH_SIZE
+    assert max(record.size for record in after_error) > Swgoh.INITIAL_BATCH_SIZE
+
+
+def test_player_data_batch_concurrency_grows(mocker):
+    lock = threading.Lock()
+    state = {'running': 0, 'max_running': 0}
+
+    def download(ally_codes):
+        with lock:
+            state['running'] += 1
+            state['max_running'] = max(state['max_running'], state['running'])
+        time.sleep(0.002 * len(ally_codes))
+        with lock:
+            state['running'] -= 1
+        return fake_download(ally_codes)
+
+    mocker.patch('sqds.swgoh.Swgoh._download_players', side_effect=download)
+    ally_codes = list(range(100000000, 100000400))
+
+    Swgoh()._download_player_data_batch(ally_codes, lambda _: None)
+
+    # successful batches raise the worker count past its initial value
+    assert state['max_running'] > Swgoh.INITIAL_WORKER_COUNT
+
+
+def test_api_calls_share_pooled_session(mocker):
+    api = Swgoh()
+    mocker.patch.object(api, 'get_access_token', return_value='token')
+    post = mocker.patch.object(api.session, 'post')
+    post.return_value.status_code = 200
+    post.return_value.json.return_value = [{'id': 'G1'}]
+
+    api.get_guild_list(123456789)
+    api.get_unit_list()
+
+    assert post.call_count == 2
+    for call in post.call_args_list:
+        assert call[1]['timeout'] == (Swgoh.CONNECT_TIMEOUT, Swgoh.READ_TIMEOUT)
+    adapter = api.session.get_adapter(api.base_url)
+    assert adapter._pool_maxsize == Swgoh.MAX_WORKER_COUNT
+
+
+def patch_async_api(mocker, fail_once=()):
+    """
+    Patch player and guild downloads, keeping track of the maximum number of
+    concurrent calls to swgoh.help. Batches containing an ally code of `fail_once`
+    fail the first time.
+    """
+    lock = threading.Lock()
+    state = {'running': 0, 'max_running': 0, 'failed': set()}
+
+    def get_player_data(_, ally_codes, calc_stats=True):
+        with lock:
+            state['running'] += 1
+            state['max_running'] = max(state['max_running'], state['running'])
+        time.sleep(0.01)
+        with lock:
+            state['running'] -= 1
+        for ally_code in ally_codes:
+            if ally_code in fail_once and ally_code not in state['failed']:
+                state['failed'].add(ally_code)
+                raise ApiError('error')
+        time.sleep(0.005 * len(ally_codes))
+        return fake_download(ally_codes)
+
+    def get_guild_list(_, ally_code):
+        return {'id': ally_code,
+                'roster': [{'allyCode': ally_code * 100 + i} for i in range(50)]}
+
+    mocker.patch('sqds.swgoh.Swgoh.get_player_data', autospec=True,
+                 side_effect=get_player_data)
+    mocker.patch('sqds.swgoh.Swgoh.calculate_stats', autospec=True,
+                 side_effect=lambda _, player_data: player_data)
+    mocker.patch('sqds.swgoh.Swgoh.get_guild_list', autospec=True,
+                 side_effect=get_guild_list)
+    return state
+
+
+def test_async_player_data_batch(mocker):
+    state = patch_async_api(mocker, fail_once=[100000005])
+    ally_codes = list(range(100000000, 100000100))
+    client = AsyncSwgoh(max_concurrency=6, max_concurrency_per_host=3)
+
+    player_data = asyncio.run(client.get_player_data_batch(ally_codes))
+
+    assert sorted(p['allyCode'] for p in player_data) == ally_codes
+    assert 1 < state['max_running'] <= 3
+
+
+def test_async_player_data_batch_error(mocker):
+    mocker.patch('sqds.swgoh.Swgoh.get_player_data', side_effect=ApiError('error'))
+
+    with pytest.raises(BatchError):
+        asyncio.run(AsyncSwgoh().get_player_data_batch(list(range(100000000, 100000100))))
+
+
+def test_async_iter_guild_data(mocker):
+    state = patch_async_api(mocker)
+    client = AsyncSwgoh(max_concurrency_per_host=4)
+
+    guilds = list(client.iter_guild_data([1, 2, 3]))
+
+    assert sorted(guild_data['id'] for guild_data, _ in guilds) == [1, 2, 3]
+    for guild_data, player_data in guilds:
+        assert len(player_data) == len(guild_data['roster'])
+    assert state['max_running'] <= 4
+
+    # guilds already downloaded
+    assert client.get_guild_lists([4, 5])[1]['id'] == 5
+    (guild_data, player_data), = client.iter_guild_data(
+        guilds=[({'id': 4, 'roster': []}, [401, 402])])
+    assert guild_data['id'] == 4
+    assert sorted(p['allyCode'] for p in player_data) == [401, 402]
+    client.close()
+
+
+def random_chunks(text, max_size):
+    pos = 0
+    while pos < len(text):
+        size = random.randint(1, max_size)
+        yield text[pos:pos + size]
+        pos += size
+
+
+@pytest.mark.parametrize('document', [
+    [],
+    [1, 23456, -7.5e3, True, None, "a, ]string"],
+    [{'a': [1, 2, {'b': '}'}]}, [], {}, 'x'],
+])
+def test_iter_json_array(document):
+    text = json.dumps(document, indent=2)
+    for max_size in [1, 3, 1000]:
+        assert list(iter_json_array(random_chunks(text, max_size))) == document
+
+
+@pytest.mark.parametrize('text', ['{"a": 1}', '[1, 2', '[1 2]', '[1,]', '[{"a": 1'])
+def test_iter_json_array_invalid(text):
+    with pytest.raises(ValueError):
+        list(iter_json_array(random_chunks(text, 2)))
+
+
+def test_iter_player_data_streams_response(mocker):
+    player_data = [load_data('data', 'player_data', '168562452.json'),
+                   load_data('data', 'player_data', '278732538.json')]
+    content = json.dumps(player_data).encode()
+    api = Swgoh()
+    mocker.patch.object(api, 'get_access_token', return_value='token')
+    post = mocker.patch.object(api.session, 'post')
+    post.return_value.status_code = 200
+    post.return_value.encoding = None
+    chunks_read = []
+
+    def iter_content(chunk_size):
+        for i in range(0, len(content), chunk_size):
+            chunks_read.append(i)
+            yield content[i:i + chunk_size]
+
+    post.return_value.iter_content.side_effect = iter_content
+
+    players = api.iter_player_data([168562452, 278732538], calc_stats=False)
+    first = next(players)
+
+    assert first['allyCode'] == 168562452
+    assert len(chunks_read) < len(content) / Swgoh.STREAM_CHUNK_SIZE
+    assert [p['allyCode'] for p in players] == [278732538]
+    assert post.call_args[1]['stream']
+    post.return_value.close.assert_called_once()
+
+
+def test_token_bucket(mocker):
+    sleep = mocker.patch('sqds.swgoh.time.sleep')
+    bucket = TokenBucket('test', rate=10., capacity=3)
+
+    for _ in range(3):
+        bucket.acquire(timeout=1)
+    sleep.assert_not_called()
+
+    bucket.acquire(timeout=1)
+    assert 0 < sleep.call_args[0][0] <= .1
+
+    with pytest.raises(RateLimitError):
+        TokenBucket('test', rate=.1, capacity=3).acquire(timeout=1)
+
+
+def test_successful_calls_do_not_lock_service_state(django_assert_num_queries):
+    bucket = TokenBucket('test', rate=10., capacity=3)
+    breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=60)
+    bucket.acquire(timeout=1)
+
+    # one conditional UPDATE per token, and closed circuits are only read
+    with django_assert_num_queries(3):
+        bucket.acquire(timeout=1)
+        breaker.before_call()
+        breaker.record_success()
+
+    breaker.record_failure()
+    with django_assert_num_queries(3):
+        breaker.before_call()
+        breaker.record_success()
+    breaker.record_failure()
+    assert not breaker.is_open
+
+
+def test_circuit_breaker_serves_cached_data(mocker):
+    mocker.patch('sqds.swgoh.Swgoh.RATE_LIMIT_BURST', 100)
+    api = Swgoh()
+    mocker.patch.object(api, 'get_access_token', return_value='token')
+    post = mocker.patch.object(api.session, 'post')
+    post.return_value.status_code = 200
+    post.return_value.json.return_value = [{'id': 'G1'}]
+    assert api.get_guild_list(123456789) == {'id': 'G1'}
+
+    post.return_value.status_code = 503
+    for _ in range(Swgoh.BREAKER_FAILURE_THRESHOLD):
+        with pytest.raises(ApiError):
+            api.get_guild_list(123456789)
+    call_count = post.call_count
+
+    # calls are suspended, and cached responses are served meanwhile
+    assert api.get_guild_list(123456789) == {'id': 'G1'}
+    with pytest.raises(CircuitOpenError):
+        api.get_guild_list(987654321)
+    assert post.call_count == call_count
+
+    # a trial call closes the circuit once the service is back
+    now = time.time()
+    mocker.patch('sqds.swgoh.time.time', return_value=now + Swgoh.BREAKER_RESET_TIMEOUT)
+    post.return_value.status_code = 200
+    post.return_value.json.return_value = [{'id': 'G2'}]
+    assert api.get_guild_list(987654321) == {'id': 'G2'}
+    assert not api.breakers[api.base_url].is_open
+
+
+def test_circuit_breaker_lets_one_trial_call_through(mocker):
+    breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=60)
+    breaker.before_call()
+    breaker.record_failure()
+    breaker.before_call()
+    breaker.record_failure()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    now = time.time()
+    mocker.patch('sqds.swgoh.time.time', return_value=now + 60)
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError, match='trial'):
+        breaker.before_call()
+    breaker.record_success()
+    breaker.before_call()
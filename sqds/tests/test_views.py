@@ -1,11 +1,16 @@
+from unittest import mock
+
 from bs4 import BeautifulSoup
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 from django.urls import reverse
 
-from sqds.models import Player, Guild, Category, Unit, PlayerUnit
+from sqds.models import Player, Guild, Category, Unit, PlayerUnit, RefreshJob, \
+    RefreshJobKind, RefreshJobStatus
 from sqds.templatetags.sqds_filters import big_number
 from sqds.tests.utils import generate_game_data, generate_guild, random_sublist, \
     generate_player_unit
+from sqds.views import MAX_MOD_BUCKETS
 from sqds_seed.factories import CategoryFactory, UnitFactory, PlayerUnitFactory, \
     PlayerFactory, ModFactory, SkillFactory, ZetaFactory, GuildFactory
 
@@ -255,6 +260,33 @@ class ViewTests(TestCase):
         self.assertTrue(table_column_contains_int(soup.table, 'Speed'))
         self.assertTemplateUsed(response, 'sqds/guild_units.html')
 
+    def test_guild_mod_buckets_view(self):
+        guild = generate_guild(player_count=0)
+        player1, player2 = PlayerFactory.create_batch(2, guild=guild)
+        for player, speeds in (player1, [12, 16, 30]), (player2, [3, 14]):
+            player_unit = PlayerUnitFactory(player=player)
+            for slot, speed in enumerate(speeds):
+                ModFactory(player_unit=player_unit, slot=slot, speed=speed,
+                           primary_stat='OF')
+        url = reverse('sqds:guild_mod_buckets', args=[guild.api_id])
+
+        data = self.client.get(url, {'buckets': '10,15,25'}).json()
+        self.assertEqual(data['buckets'], ['speed_10_15', 'speed_15_25', 'speed_25plus'])
+        self.assertEqual(data['guild'],
+                         {'speed_10_15': 2, 'speed_15_25': 1, 'speed_25plus': 1})
+        counts = {p['ally_code']: p for p in data['players']}
+        self.assertEqual(counts[player2.ally_code]['speed_10_15'], 1)
+        self.assertEqual(counts[player2.ally_code]['speed_25plus'], 0)
+
+        response = self.client.get(url, {'stat': 'health'})
+        self.assertEqual(response.status_code, 400)
+
+        buckets = ','.join(map(str, range(MAX_MOD_BUCKETS)))
+        response = self.client.get(url, {'buckets': buckets})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(url, {'buckets': f'{buckets},100'})
+        self.assertEqual(response.status_code, 400)
+
     def test_guild_comparison_units_view(self):
         generate_guild(player_count=20)
         guild1 = Guild.objects.first()
@@ -386,3 +418,107 @@ class PlayerUnitTests(TestCase):
         self.assertContains(response, 'Speed (3)')
         self.assertContains(response, '5.88%')
         self.assertContains(response, str(120))
+
+
+class RefreshTests(TestCase):
+    def test_missing_player_is_queued(self):
+        url = reverse('sqds:player', args=[123456789])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'sqds/refreshing.html')
+        job, = response.context['refresh_jobs']
+        self.assertEqual((job.kind, job.ally_code), (RefreshJobKind.PLAYER, 123456789))
+
+        # pending refreshes are not queued twice
+        response = self.client.get(url)
+        self.assertEqual(list(response.context['refresh_jobs']), [job])
+
+        response = self.client.get(reverse('sqds:refresh_job_status', args=[job.pk]))
+        self.assertEqual(response.json(), {'status': 'pending', 'active': True})
+
+    def test_missing_player_after_refresh(self):
+        job = RefreshJob.objects.enqueue(RefreshJobKind.PLAYER, 123456789)
+        RefreshJob.objects.claim()
+        job.refresh_from_db()
+        with mock.patch('sqds.models.PlayerManager.update_or_create_multiple_from_swgoh',
+                        return_value=[]):
+            job.run()
+
+        self.assertEqual(job.status, RefreshJobStatus.DONE)
+        response = self.client.get(reverse('sqds:player', args=[123456789]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_player_compare_queues_missing_players(self):
+        player = PlayerFactory()
+        url = reverse('sqds:player_compare', args=[player.ally_code, 123456789])
+        response = self.client.get(url)
+        self.assertTemplateUsed(response, 'sqds/refreshing.html')
+        self.assertEqual([job.ally_code for job in response.context['refresh_jobs']],
+                         [123456789])
+
+    def test_player_refresh(self):
+        player = PlayerFactory()
+        response = self.client.get(reverse('sqds:player_refresh',
+                                           args=[player.ally_code]))
+        self.assertRedirects(response, reverse('sqds:player', args=[player.ally_code]),
+                             fetch_redirect_response=False)
+
+        response = self.client.get(reverse('sqds:player', args=[player.ally_code]))
+        self.assertTemplateUsed(response, 'sqds/single_player.html')
+        self.assertEqual(len(response.context['refresh_jobs']), 1)
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_guild_view(self):
+        guild = generate_guild(player_count=2)
+        url = reverse('sqds:guild', args=[guild.api_id])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertIn('Cookie', response['Vary'])
+
+        with self.assertNumQueries(1):  # Guild lookup, views are counted in the cache
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        Guild.flush_view_counts()
+        self.assertEqual(Guild.objects.get(pk=guild.pk).view_count, 2)
+
+        # The page depends on the visitor's cookies and on the guild's data
+        self.client.cookies['sqds_my_guild_api_id'] = 'other'
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        etag = self.client.get(url)['ETag']
+        guild.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_player_view(self):
+        player = PlayerFactory()
+        PlayerUnitFactory(player=player)
+        url = reverse('sqds:player', args=[player.ally_code])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+        etag = response['ETag']
+        RefreshJob.objects.enqueue(RefreshJobKind.PLAYER, player.ally_code)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['refresh_jobs']), 1)
+
+    def test_unit_view(self):
+        pu = PlayerUnitFactory(player=PlayerFactory())
+        url = reverse('sqds:unit', args=[pu.player.ally_code, pu.unit.api_id])
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        pu.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(self.client.get(reverse('sqds:unit', args=[
+            pu.player.ally_code, 'missing'])).status_code, 404)
@@ -2,7 +2,7 @@ import random
 
 from sqds.models import Unit, PlayerUnitGear, Gear, Skill
 from sqds_seed.factories import CategoryFactory, GearFactory, UnitFactory, GuildFactory, \
-    PlayerFactory, PlayerUnitFactory, ZetaFactory, ModFactory
+    PlayerFactory, PlayerUnitFactory, ZetaFactory, ModFactory, SkillFactory
 
 
 def random_sublist(lst, probability=0.5):
@@ -62,3 +62,23 @@ def generate_guild(player_count=45):
             generate_player_unit(unit, player)
 
     return guild
+
+
+def generate_roster_game_data(roster):
+    """
+    Generate the units, zeta skills and gear referred to by a player's roster from
+    swgoh.help, so that it can be imported without the full game data.
+    """
+    for unit_data in roster:
+        if unit_data['combatType'] != 1:
+            continue
+        unit = Unit.objects.filter(api_id=unit_data['defId']).first()
+        if unit is None:
+            unit = UnitFactory(api_id=unit_data['defId'], skill=[])
+        for skill_data in unit_data['skills']:
+            if (skill_data['isZeta']
+                    and not Skill.objects.filter(api_id=skill_data['id']).exists()):
+                SkillFactory(api_id=skill_data['id'], unit=unit, is_zeta=True)
+        for gear_data in unit_data['equipped']:
+            if not Gear.objects.filter(api_id=gear_data['equipmentId']).exists():
+                GearFactory(api_id=gear_data['equipmentId'])
@@ -9,6 +9,8 @@ urlpatterns = [
     path('players/', views.FilteredPlayerListView.as_view(), name='players'),
     path('guild/<str:api_id>/', views.GuildView.as_view(), name='guild'),
     path('guild/<str:api_id>/units/', views.GuildUnitsView.as_view(), name='guild_units'),
+    path('guild/<str:api_id>/mods/buckets/', views.guild_mod_buckets,
+         name='guild_mod_buckets'),
     path('guild/<str:api_id1>/c/<str:api_id2>/units/',
          views.GuildComparisonUnitsView.as_view(), name='guild_compare_units'),
     path('units/', views.AllPlayerUnitsListView.as_view(), name='units'),
@@ -16,6 +18,7 @@ urlpatterns = [
          views.SinglePlayerView.as_view(), name='player'),
     path('player/<int:ally_code>/refresh/',
          views.player_refresh, name='player_refresh'),
+    path('refresh/<int:pk>/', views.refresh_job_status, name='refresh_job_status'),
     path('player/<int:ally_code>/unit/<str:unit_api_id>/', views.UnitView.as_view(),
          name='unit'),
     path('player/<int:ally_code>/me',
@@ -35,6 +35,7 @@ class QueryLogger:
             raise
         else:
             current_query['status'] = 'ok'
+            current_query['rows'] = context['cursor'].rowcount
             return result
         finally:
             duration = time.time() - start
@@ -1,4 +1,7 @@
 import collections
+import hashlib
+import math
+from datetime import timedelta
 from textwrap import wrap
 
 import numpy as np
@@ -7,9 +10,12 @@ import plotly.offline as opy
 from django.contrib import messages
 from django.db.models import Q, F
 from django.db.models.functions import Lower
-from django.http import Http404
+from django.http import Http404, JsonResponse
 from django.shortcuts import render, redirect, get_object_or_404
+from django.utils import timezone
+from django.utils.cache import patch_cache_control, patch_vary_headers
 from django.utils.html import format_html
+from django.views.decorators.http import condition
 from django.views.generic import DetailView, TemplateView
 from django_filters import FilterSet, ChoiceFilter
 from django_filters.views import FilterView
@@ -17,7 +23,11 @@ from django_tables2.views import SingleTableMixin
 from meta.views import MetadataMixin
 
 from sqds_ga.models import GAPool
-from .models import Category, Guild, Player, PlayerUnit, Unit
+from . import page_cache
+from .models import Category, Guild, Player, PlayerUnit, Unit, GameDataRegistry, \
+    RefreshJob, RefreshJobKind, RefreshJobStatus, ModStat, ModStatHistogram, \
+    histogram_buckets
+from .page_cache import GuildPageCacheMixin
 from .tables import PlayerTable, PlayerUnitTable
 from .utils import format_large_int
 
@@ -26,7 +36,53 @@ def index(request):
     return render(request, "sqds/index.html", {"guilds": Guild.objects.all()})
 
 
-class UnitView(MetadataMixin, DetailView):
+class ConditionalGetMixin:
+    """
+    Answer conditional GET requests (If-None-Match, If-Modified-Since) with 304 Not
+    Modified before the view loads anything else than the page's freshness, see
+    `get_freshness()`. Pages showing messages are always rendered.
+    """
+
+    # Visitor cookies shown in every page, see base.html
+    etag_cookies = [
+        "sqds_my_name",
+        "sqds_my_ally_code",
+        "sqds_my_guild_api_id",
+        "sqds_my_guild_name",
+    ]
+
+    def get_freshness(self):
+        """
+        :return: (last_modified, etag_parts) tuple, where `last_modified` is the last
+        time the page's data changed and `etag_parts` identify its current version, or
+        None if the page cannot be conditionally served
+        """
+        return None
+
+    def dispatch(self, request, *args, **kwargs):
+        freshness = None if messages.get_messages(request) else self.get_freshness()
+        if freshness is None:
+            return super().dispatch(request, *args, **kwargs)
+
+        last_modified, etag_parts = freshness
+        etag_parts = [
+            type(self).__name__,
+            *etag_parts,
+            *(request.COOKIES.get(name, "") for name in self.etag_cookies),
+        ]
+        etag = hashlib.md5(chr(0).join(map(str, etag_parts)).encode()).hexdigest()
+        response = condition(
+            etag_func=lambda *_, **__: etag,
+            last_modified_func=lambda *_, **__: last_modified,
+        )(super().dispatch)(request, *args, **kwargs)
+
+        # Pages must be revalidated, and depend on cookies
+        patch_cache_control(response, no_cache=True)
+        patch_vary_headers(response, ["Cookie"])
+        return response
+
+
+class UnitView(ConditionalGetMixin, MetadataMixin, DetailView):
     model = PlayerUnit
     context_object_name = "player_unit"
     template_name = "sqds/unit.html"
@@ -45,6 +101,21 @@ class UnitView(MetadataMixin, DetailView):
             )
         )
 
+    def get_freshness(self):
+        updated = (
+            PlayerUnit.objects.filter(
+                player__ally_code=self.kwargs["ally_code"],
+                unit__api_id=self.kwargs["unit_api_id"],
+            )
+            .values_list("last_updated", "player__last_updated")
+            .first()
+        )
+        if updated is None:
+            return None
+        # Medals depend on medal rules
+        global_updated = page_cache.last_invalidated([page_cache.GLOBAL])
+        return max(*updated, global_updated), [*updated, global_updated]
+
     def get_object(self, queryset=None):
         if queryset is None:
             queryset = self.get_queryset()
@@ -118,7 +189,9 @@ class GPFilter(FilterSet):
         fields = ["gp"]
 
 
-class GuildView(MetadataMixin, SingleTableMixin, FilterView):
+class GuildView(
+    ConditionalGetMixin, GuildPageCacheMixin, MetadataMixin, SingleTableMixin, FilterView
+):
     table_class = PlayerTable
     model = Player
     template_name = "sqds/guild.html"
@@ -128,10 +201,15 @@ class GuildView(MetadataMixin, SingleTableMixin, FilterView):
     def setup(self, request, *args, **kwargs):
         super().setup(request, *args, **kwargs)
         # noinspection PyAttributeOutsideInit
-        self.guild = (
-            Guild.objects.annotate_stats()
-            .annotate_faction_gp()
-            .get(api_id=self.kwargs["api_id"])
+        self.guild = Guild.objects.get(api_id=self.kwargs["api_id"])
+        self.guild.record_view()
+
+    def get_freshness(self):
+        # Ingesting the guild's players or changing medal rules invalidates its scopes
+        invalidated = page_cache.last_invalidated(self.get_page_cache_scopes())
+        return (
+            max(self.guild.last_updated, invalidated),
+            [self.guild.pk, self.guild.last_updated, invalidated],
         )
 
     def get_queryset(self):
@@ -144,6 +222,17 @@ class GuildView(MetadataMixin, SingleTableMixin, FilterView):
         return qs
 
     def get_context_data(self, **kwargs):
+        # noinspection PyAttributeOutsideInit
+        self.guild = page_cache.get_or_set(
+            page_cache.make_key(
+                "GuildView.guild",
+                self.get_page_cache_scopes(),
+                self.guild.last_updated.isoformat(),
+            ),
+            lambda: Guild.objects.annotate_stats()
+            .annotate_faction_gp()
+            .get(pk=self.guild.pk),
+        )
         context = super().get_context_data(**kwargs)
         context["guild"] = self.guild
         return context
@@ -172,7 +261,7 @@ class UnitsFilter(FilterSet):
         fields = ["unit", "category"]
 
 
-class GuildUnitsView(MetadataMixin, SingleTableMixin, FilterView):
+class GuildUnitsView(GuildPageCacheMixin, MetadataMixin, SingleTableMixin, FilterView):
     """
     Render the unit list for a given guild.
     """
@@ -295,12 +384,122 @@ def player_unregister_me(request):
     return response
 
 
+##########################################################################################
+## REFRESH JOBS                                                                         ##
+##########################################################################################
+
+
 def player_refresh(request, ally_code):
-    Player.objects.update_or_create_from_swgoh(ally_code)
+    RefreshJob.objects.enqueue(RefreshJobKind.PLAYER, ally_code)
     return redirect("sqds:player", ally_code=ally_code)
 
 
-class SinglePlayerView(MetadataMixin, SingleTableMixin, FilterView):
+def refresh_job_status(request, pk):
+    job = get_object_or_404(RefreshJob, pk=pk)
+    return JsonResponse(
+        {
+            "status": RefreshJobStatus.name(job.status).lower(),
+            "active": job.is_active,
+        }
+    )
+
+
+# Maximum number of buckets of guild_mod_buckets(), each of them costing an aggregate
+MAX_MOD_BUCKETS = 20
+
+
+def guild_mod_buckets(request, api_id):
+    """
+    Count the mods of a guild's players per bucket of a secondary statistic. The `stat`
+    query parameter is a `ModStat` name (default: speed), and `buckets` the
+    comma-separated bucket lower bounds (default: 10,15,20,25, at most MAX_MOD_BUCKETS).
+    """
+    guild = get_object_or_404(Guild, api_id=api_id)
+    try:
+        stat = ModStat.get(request.GET.get("stat", "speed").upper()).value
+        bounds = request.GET.get("buckets", "10,15,20,25").split(",")
+        if len(bounds) > MAX_MOD_BUCKETS:
+            raise ValueError(bounds)
+        boundaries = sorted({float(b) for b in bounds})
+        if not all(map(math.isfinite, boundaries)):
+            raise ValueError(boundaries)
+    except (AttributeError, ValueError):
+        return JsonResponse({"error": "Invalid stat or buckets"}, status=400)
+
+    bucket_names = list(histogram_buckets(stat, boundaries))
+    counts = ModStatHistogram.objects.filter(player__guild=guild).buckets(
+        stat, boundaries
+    )
+    empty = dict.fromkeys(bucket_names, 0)
+    players = [
+        {"ally_code": ally_code, "name": name, **counts.get(pk, empty)}
+        for pk, ally_code, name in guild.player_set.order_by(Lower("name")).values_list(
+            "pk", "ally_code", "name"
+        )
+    ]
+    return JsonResponse(
+        {
+            "stat": ModStat.name(stat).lower(),
+            "buckets": bucket_names,
+            "guild": {
+                name: sum(player[name] for player in players) for name in bucket_names
+            },
+            "players": players,
+        }
+    )
+
+
+class PlayerRefreshMixin:
+    """
+    Mixin for views of players which may not be loaded yet. Missing players are queued
+    for refresh (see `RefreshJob`), and a page waiting for the refresh is returned
+    instead of the view.
+    """
+
+    # Players still missing this many seconds after their last refresh are not found
+    refresh_retry_delay = 60
+
+    refresh_jobs = ()
+
+    def queue_missing_players(self, ally_codes):
+        """
+        Queue the refresh of players which are not loaded.
+        :return: True if at least one player is being refreshed
+        """
+        loaded = set(
+            Player.objects.filter(ally_code__in=ally_codes).values_list(
+                "ally_code", flat=True
+            )
+        )
+        retry_after = timezone.now() - timedelta(
+            seconds=self.refresh_retry_delay
+        )
+        jobs = []
+        for ally_code in ally_codes:
+            if ally_code in loaded:
+                continue
+            job = RefreshJob.objects.latest(RefreshJobKind.PLAYER, ally_code)
+            if job is not None and not job.is_active and job.finished > retry_after:
+                raise Http404(f"Player {ally_code} could not be loaded")
+            jobs.append(RefreshJob.objects.enqueue(RefreshJobKind.PLAYER, ally_code))
+        self.refresh_jobs = jobs
+        return bool(jobs)
+
+    def dispatch(self, request, *args, **kwargs):
+        if self.refresh_jobs:
+            return render(
+                request, "sqds/refreshing.html", {"refresh_jobs": self.refresh_jobs}
+            )
+        return super().dispatch(request, *args, **kwargs)
+
+
+class SinglePlayerView(
+    PlayerRefreshMixin,
+    ConditionalGetMixin,
+    MetadataMixin,
+    SingleTableMixin,
+    FilterView,
+):
     table_class = PlayerUnitTable
     model = PlayerUnit
     template_name = "sqds/single_player.html"
@@ -311,17 +510,38 @@ class SinglePlayerView(MetadataMixin, SingleTableMixin, FilterView):
     def setup(self, request, *args, **kwargs):
         super().setup(request, *args, **kwargs)
         ally_code = self.kwargs["ally_code"]
-        if not Player.objects.filter(ally_code=ally_code):
-            Player.objects.update_or_create_from_swgoh(ally_code)
+        if self.queue_missing_players([ally_code]):
+            return
 
         try:
-            self.player = (
-                Player.objects.annotate_stats()
-                .annotate_faction_gp()
-                .get(ally_code=ally_code)
-            )
+            self.player = Player.objects.get(ally_code=ally_code)
         except Player.DoesNotExist:
             raise Http404(f"Player {ally_code} could not be loaded")
+        self.player.record_view()
+
+    def get_freshness(self):
+        refresh_job = RefreshJob.objects.latest(
+            RefreshJobKind.PLAYER, self.player.ally_code
+        )
+        ga_pool_created = (
+            GAPool.objects.filter(focus_player=self.player)
+            .order_by("-created")
+            .values_list("created", flat=True)
+            .first()
+        )
+        # Medals depend on medal rules
+        invalidated = page_cache.last_invalidated([page_cache.GLOBAL])
+        updated = [self.player.last_updated, ga_pool_created, invalidated]
+        if refresh_job is not None:
+            updated += [refresh_job.created, refresh_job.started, refresh_job.finished]
+        return (
+            max(filter(None, updated)),
+            [
+                self.player.pk,
+                *updated,
+                refresh_job and (refresh_job.pk, refresh_job.status),
+            ],
+        )
 
     def get_queryset(self):
         return (
@@ -331,11 +551,20 @@ class SinglePlayerView(MetadataMixin, SingleTableMixin, FilterView):
         )
 
     def get_context_data(self, **kwargs):
+        # noinspection PyAttributeOutsideInit
+        self.player = (
+            Player.objects.annotate_stats().annotate_faction_gp().get(pk=self.player.pk)
+        )
         context = super().get_context_data(**kwargs)
         context["player"] = self.player
         context["ga_pools"] = GAPool.objects.filter(focus_player=self.player).order_by(
             "-created"
         )[:10]
+        refresh_job = RefreshJob.objects.latest(
+            RefreshJobKind.PLAYER, self.player.ally_code
+        )
+        if refresh_job is not None and refresh_job.is_active:
+            context["refresh_jobs"] = [refresh_job]
         return context
 
     def get_meta_title(self, **kwargs):
@@ -377,15 +606,16 @@ PLAYER_COMPARE_KEY_TOONS = (
 )
 
 
-class PlayerCompareView(MetadataMixin, TemplateView):
+class PlayerCompareView(PlayerRefreshMixin, MetadataMixin, TemplateView):
     template_name = "sqds/player_compare.html"
 
     # noinspection PyAttributeOutsideInit
     def setup(self, request, *args, **kwargs):
         super().setup(request, *args, **kwargs)
-        Player.objects.ensure_exist(
+        if self.queue_missing_players(
             [self.kwargs["ally_code1"], self.kwargs["ally_code2"]]
-        )
+        ):
+            return
 
         qs = (
             Player.objects.filter(
@@ -409,13 +639,11 @@ class PlayerCompareView(MetadataMixin, TemplateView):
             self.kwargs["ally_code2"], PLAYER_COMPARE_KEY_TOONS
         )
 
-        id_to_name = {
-            v["api_id"]: v["name"] for v in Unit.objects.values("api_id", "name")
-        }
+        game_data = GameDataRegistry.get()
 
         self.units = collections.OrderedDict()
         for toon in PLAYER_COMPARE_KEY_TOONS:
-            self.units[id_to_name[toon]] = dict(
+            self.units[game_data.unit(toon).name] = dict(
                 player1=p1_units[toon] if toon in p1_units else None,
                 player2=p2_units[toon] if toon in p2_units else None,
             )
@@ -518,7 +746,9 @@ class PlayerCompareView(MetadataMixin, TemplateView):
         return opy.plot(figure, auto_open=False, output_type="div")
 
 
-class PlayerCompareUnitsView(MetadataMixin, SingleTableMixin, FilterView):
+class PlayerCompareUnitsView(
+    PlayerRefreshMixin, MetadataMixin, SingleTableMixin, FilterView
+):
     table_class = PlayerUnitTable
     model = PlayerUnit
     template_name = "sqds/player_compare_units.html"
@@ -528,9 +758,10 @@ class PlayerCompareUnitsView(MetadataMixin, SingleTableMixin, FilterView):
     # noinspection PyAttributeOutsideInit
     def setup(self, request, *args, **kwargs):
         super().setup(request, *args, **kwargs)
-        Player.objects.ensure_exist(
+        if self.queue_missing_players(
             [self.kwargs["ally_code1"], self.kwargs["ally_code2"]]
-        )
+        ):
+            return
 
         self.player1 = get_object_or_404(Player, ally_code=self.kwargs["ally_code1"])
         self.player2 = get_object_or_404(Player, ally_code=self.kwargs["ally_code2"])
@@ -20,12 +20,15 @@ def create_ga_pool(request, ally_code):
     if 'ally_codes' in request.POST:
         ally_codes = extract_all_ally_codes(request.POST['ally_codes'])
 
+        focus_player = get_object_or_404(Player, ally_code=ally_code)
+
+        # Refreshes are committed on their own (see sqds.single_flight)
+        Player.objects.ensure_exist(ally_codes, max_days=7)
+
         with transaction.atomic():
-            ga_pool = GAPool(focus_player=get_object_or_404(Player, ally_code=ally_code))
+            ga_pool = GAPool(focus_player=focus_player)
             ga_pool.save()
 
-            Player.objects.ensure_exist(ally_codes, max_days=7)
-
             for ac in ally_codes:
                 ga_pool_player = GAPoolPlayer(ga_pool=ga_pool,
                                               player=Player.objects.get(ally_code=ac))
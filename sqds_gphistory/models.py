@@ -1,6 +1,7 @@
 from django.db import models
 
-from sqds.models import PlayerUnit, Unit
+from sqds import page_cache
+from sqds.models import Guild, PlayerUnit, Unit
 
 
 class GPManager(models.Manager):
@@ -15,6 +16,8 @@ class GPManager(models.Manager):
                 for
                 pu in qs)
         GP.objects.bulk_create(objs)
+        page_cache.invalidate_guilds(
+            Guild.objects.filter(api_id=guild_api_id).values_list('pk', flat=True))
 
 
 class GP(models.Model):
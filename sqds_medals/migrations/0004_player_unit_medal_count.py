@@ -0,0 +1,26 @@
+# Generated by Django 2.2.28 on 2026-10-17 22:14
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+
+
+def compute_medal_count(apps, schema_editor):
+    PlayerUnit = apps.get_model('sqds', 'PlayerUnit')
+    PlayerUnit.objects.update(medal_count=Subquery(
+        PlayerUnit.objects
+        .filter(pk=OuterRef('pk'))
+        .annotate(value=Count('medal_set'))
+        .values('value'),
+        output_field=models.IntegerField()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medals', '0003_auto_20190824_1622'),
+        ('sqds', '0020_player_unit_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(compute_medal_count, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,8 @@
 from django.db import models, transaction
-from django.db.models import Count
+from django.db.models import Count, Q
 
-from sqds.models import Unit, Skill, PlayerUnit, Zeta, Player
+from sqds import page_cache
+from sqds.models import Unit, Skill, PlayerUnit, Zeta, Player, update_stats
 
 
 class MedaledUnit(Unit):
@@ -78,30 +79,37 @@ class MedalManager(models.Manager):
         with transaction.atomic():
             self.model.objects.filter(player_unit__unit=unit).delete()
 
-            if unit.stat_medal_rule_set.count() + unit.zeta_medal_rule_set.count() != 7:
-                return
+            if unit.stat_medal_rule_set.count() + unit.zeta_medal_rule_set.count() == 7:
+                stat_rules = StatMedalRule.objects.filter(unit=unit)
+                zeta_rules = ZetaMedalRule.objects.filter(unit=unit)
 
-            stat_rules = StatMedalRule.objects.filter(unit=unit)
-            zeta_rules = ZetaMedalRule.objects.filter(unit=unit)
+                medals = []
+                for rule in stat_rules:
+                    filter_args = {rule.stat + "__gte": rule.value, "unit": rule.unit}
 
-            medals = []
-            for rule in stat_rules:
-                filter_args = {rule.stat + "__gte": rule.value, "unit": rule.unit}
-
-                medals.extend(
-                    self.model(player_unit=pu, stat_medal_rule=rule)
-                    for pu in PlayerUnit.objects.filter(**filter_args)
-                )
+                    medals.extend(
+                        self.model(player_unit=pu, stat_medal_rule=rule)
+                        for pu in PlayerUnit.objects.filter(**filter_args)
+                    )
 
-            for rule in zeta_rules:
-                medals.extend(
-                    self.model(player_unit=z.player_unit, zeta_medal_rule=rule)
-                    for z in Zeta.objects.filter(
-                        skill=rule.skill, player_unit__unit=rule.unit
+                for rule in zeta_rules:
+                    medals.extend(
+                        self.model(player_unit=z.player_unit, zeta_medal_rule=rule)
+                        for z in Zeta.objects.filter(
+                            skill=rule.skill, player_unit__unit=rule.unit
+                        )
                     )
-                )
 
-            self.model.objects.bulk_create(medals)
+                self.model.objects.bulk_create(medals)
+
+            PlayerUnit.objects.filter(unit=unit).update_counters(["medal_count"])
+
+            update_stats(
+                Player.objects.filter(unit_set__unit=unit).values_list("pk", flat=True)
+            )
+
+            # The unit's medal rules changed
+            page_cache.invalidate([page_cache.GLOBAL])
 
     def update_all(self, ally_codes=None):
         """
@@ -152,6 +160,15 @@ class MedalManager(models.Manager):
 
             self.model.objects.bulk_create(medals)
 
+            # Update the medal count of the player units whose medals were rewritten or
+            # deleted
+            player_units = PlayerUnit.objects.all()
+            if pu_args:
+                player_units = player_units.filter(
+                    Q(**pu_args) | Q(medal_count__gt=0) & ~Q(unit__in=subquery)
+                )
+            player_units.update_counters(["medal_count"])
+
 
 class Medal(models.Model):
     player_unit = models.ForeignKey(
@@ -1,4 +1,4 @@
-from sqds.models import Player, Guild, Unit, Skill
+from sqds.models import Player, Guild, Unit, Skill, PlayerUnit
 from sqds_medals.models import Medal, StatMedalRule
 from sqds_seed.factories import (
     StatMedalRuleFactory,
@@ -122,6 +122,28 @@ def test_update_all_deletes_invalid_medals(db):
     assert Medal.objects.count() == 0
 
 
+def test_medal_count(db):
+    unit = UnitFactory()
+    rules = [
+        StatMedalRuleFactory(unit=unit, stat="health", value=x * 1000) for x in range(7)
+    ]
+    p1, p2 = PlayerFactory.create_batch(2)
+    pu1 = PlayerUnitFactory(player=p1, unit=unit, health=3500)
+    pu2 = PlayerUnitFactory(player=p2, unit=unit, health=5500)
+
+    def medal_counts():
+        return [PlayerUnit.objects.get(pk=pu.pk).medal_count for pu in (pu1, pu2)]
+
+    Medal.objects.update_all(ally_codes=[p1.ally_code])
+    assert medal_counts() == [4, 0]
+    Medal.objects.update_for_unit(unit)
+    assert medal_counts() == [4, 6]
+
+    rules[0].delete()
+    Medal.objects.update_all(ally_codes=[p1.ally_code])
+    assert medal_counts() == [0, 0]
+
+
 def test_annotate_stats_medal_count_consistency(guild_data):
     bossk = Unit.objects.get(api_id="BOSSK")
     bossk_zeta_skills = Skill.objects.filter(unit=bossk, is_zeta=True)
@@ -3,10 +3,11 @@ from django_tables2 import SingleTableView
 from meta.views import MetadataMixin
 
 from sqds.models import Unit
+from sqds.page_cache import PageCacheMixin
 from .tables import MedaledUnitTable
 
 
-class MedalList(MetadataMixin, SingleTableView):
+class MedalList(PageCacheMixin, MetadataMixin, SingleTableView):
     model = Unit
     table_class = MedaledUnitTable
     template_name = 'sqds_medals/medal_list.html'
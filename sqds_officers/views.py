@@ -1,7 +1,7 @@
 import pandas as pd
 import plotly.graph_objs as go
 import plotly.offline as opy
-from django.db.models import Sum, Q, Case, When, BooleanField, OuterRef, Subquery
+from django.db.models import Sum, Case, When, BooleanField, OuterRef, Subquery
 from django.db.models.functions import TruncDay
 from django.views.generic import TemplateView
 from django_filters import FilterSet, ChoiceFilter
@@ -9,7 +9,9 @@ from django_filters.views import FilterView
 from django_tables2 import SingleTableMixin
 from meta.views import MetadataMixin
 
-from sqds.models import Player, Unit, PlayerUnit, Guild
+from sqds import page_cache
+from sqds.models import Player, PlayerUnit, Guild
+from sqds.page_cache import GuildPageCacheMixin
 from sqds_gphistory.models import GP
 from .tables import GeoTBPlayerTable
 
@@ -38,7 +40,7 @@ class DRMalakFilterSet(FilterSet):
         fields = ['has_dr', 'has_malak']
 
 
-class GeoTBPlayerView(MetadataMixin, SingleTableMixin, FilterView):
+class GeoTBPlayerView(GuildPageCacheMixin, MetadataMixin, SingleTableMixin, FilterView):
     table_class = GeoTBPlayerTable
     model = Player
     template_name = 'sqds_officers/geotb_player_list.html'
@@ -74,24 +76,12 @@ class GeoTBPlayerView(MetadataMixin, SingleTableMixin, FilterView):
                 output_field=BooleanField()))
 
         # ANNOTATE FACTION GP
-        factions = {
-            'profession_bountyhunter': {'label': 'bh_gp'},
-            'affiliation_firstorder': {'label': 'fo_gp'},
-            'affiliation_separatist': {'label': 'sep_gp'},
-            'affiliation_nightsisters': {'label': 'ns_gp'},
-        }
-        for faction in factions:
-            factions[faction]['id_list'] = Unit.objects.filter(
-                categories__api_id=faction).values('id')
-
-        for faction in factions:
-            args = {
-                factions[faction]['label']: Sum(
-                    'unit_set__gp',
-                    filter=Q(unit_set__unit__id__in=factions[faction]['id_list']))
-            }
-
-            qs = qs.annotate(**args)
+        qs = qs.annotate_category_gp({
+            'bh_gp': 'profession_bountyhunter',
+            'fo_gp': 'affiliation_firstorder',
+            'sep_gp': 'affiliation_separatist',
+            'ns_gp': 'affiliation_nightsisters',
+        })
 
         return qs
 
@@ -111,12 +101,18 @@ class GeoTBPlayerView(MetadataMixin, SingleTableMixin, FilterView):
 ##########################################################################################
 
 
-class SepFarmProgressView(MetadataMixin, TemplateView):
+class SepFarmProgressView(GuildPageCacheMixin, MetadataMixin, TemplateView):
     template_name = 'sqds_officers/sep_farm.html'
 
+    def setup(self, request, *args, **kwargs):
+        super().setup(request, *args, **kwargs)
+        # noinspection PyAttributeOutsideInit
+        self.guild = Guild.objects.get(api_id=self.kwargs['api_id'])
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['sep_farm_graph'] = self.get_sep_farm_graph()
+        context['sep_farm_graph'] = page_cache.get_or_set(
+            self.get_page_cache_key('graph'), self.get_sep_farm_graph)
         return context
 
     # noinspection PyMethodMayBeStatic
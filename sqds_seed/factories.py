@@ -1,6 +1,7 @@
 import random
 
 import factory.fuzzy
+from django.db.models import F
 from faker.providers import BaseProvider
 
 from sqds.models import (
@@ -15,6 +16,8 @@ from sqds.models import (
     PlayerUnitGear,
     Mod,
     ModSet,
+    ModStatHistogram,
+    PlayerCategoryGP,
 )
 from sqds_medals.models import StatMedalRule, ZetaMedalRule, Medal
 
@@ -170,8 +173,36 @@ class PlayerUnitFactory(factory.DjangoModelFactory):
     mod_critical_avoidance = factory.Faker("gaussian_percent")
     mod_accuracy = factory.Faker("gaussian_percent")
 
+    # noinspection PyUnusedLocal
+    @factory.post_generation
+    def player_category_gp(self, create, extracted, **kwargs):
+        if not create or self.player_id is None:
+            return
+        for category in self.unit.categories.all():
+            if not PlayerCategoryGP.objects.filter(
+                player_id=self.player_id, category=category
+            ).update(gp=F("gp") + self.gp):
+                PlayerCategoryGP.objects.create(
+                    player_id=self.player_id, category=category, gp=self.gp
+                )
+
+
+class PlayerUnitChildFactory(factory.DjangoModelFactory):
+    """
+    Keep the counters stored in the parent PlayerUnit up to date.
+    """
 
-class ZetaFactory(factory.DjangoModelFactory):
+    class Meta:
+        abstract = True
+
+    # noinspection PyUnusedLocal
+    @factory.post_generation
+    def player_unit_counters(self, create, extracted, **kwargs):
+        if create and self.player_unit_id is not None:
+            PlayerUnit.objects.filter(pk=self.player_unit_id).update_counters()
+
+
+class ZetaFactory(PlayerUnitChildFactory):
     class Meta:
         model = Zeta
 
@@ -181,7 +212,7 @@ class PlayerUnitGearFactory(factory.DjangoModelFactory):
         model = PlayerUnitGear
 
 
-class ModFactory(factory.DjangoModelFactory):
+class ModFactory(PlayerUnitChildFactory):
     class Meta:
         model = Mod
 
@@ -209,6 +240,20 @@ class ModFactory(factory.DjangoModelFactory):
     critical_avoidance = factory.Faker("gaussian_percent", mean=0.03, sigma=0.01)
     accuracy = factory.Faker("gaussian_percent", mean=0.03, sigma=0.01)
 
+    # noinspection PyUnusedLocal
+    @factory.post_generation
+    def player_histogram(self, create, extracted, **kwargs):
+        if not create or self.player_unit_id is None:
+            return
+        player_id = self.player_unit.player_id
+        for (stat, value), count in ModStatHistogram.objects.count_mods([self]).items():
+            if not ModStatHistogram.objects.filter(
+                player_id=player_id, stat=stat, value=value
+            ).update(count=F("count") + count):
+                ModStatHistogram.objects.create(
+                    player_id=player_id, stat=stat, value=value, count=count
+                )
+
 
 ##########################################################################################
 ##  MEDALS                                                                              ##
@@ -228,6 +273,6 @@ class ZetaMedalRuleFactory(factory.DjangoModelFactory):
         model = ZetaMedalRule
 
 
-class MedalFactory(factory.DjangoModelFactory):
+class MedalFactory(PlayerUnitChildFactory):
     class Meta:
         model = Medal
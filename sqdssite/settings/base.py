@@ -147,3 +147,15 @@ META_SITE_PROTOCOL = 'https'
 
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
+
+# Directory where raw swgoh.help payloads are archived (e.g. /var/lib/sqds/archive, outside
+# of the source tree), None to disable archiving. Archived payloads are never pruned.
+SQDS_ARCHIVE_DIR = os.environ.get('SQDS_ARCHIVE_DIR')
+
+# Seconds the expensive parts of guild pages are cached, unless the guild's data changes
+# before (see sqds.page_cache), None to disable the page cache
+SQDS_PAGE_CACHE_TIMEOUT = 24 * 3600
+
+# How unit stats are computed: True with the stat calculation service, 'local' to compute
+# mod stats locally (see sqds.stat_calc)
+SQDS_CALC_STATS = 'local' if os.environ.get('SQDS_CALC_STATS') == 'local' else True
@@ -6,3 +6,6 @@ DATABASES = {
         'ENGINE': 'django.db.backends.sqlite3'
     }
 }
+
+SQDS_ARCHIVE_DIR = None
+SQDS_PAGE_CACHE_TIMEOUT = None